@@ -9,7 +9,7 @@ from lxml import etree
 
 from osc2.remote import RORemoteFile, RWRemoteFile
 from osc2.util.io import copy_file
-from osc2.util.xml import fromstring, OscElement
+from osc2.util.xml import fromstring, get_parser, OscElement
 from osc2.util.cpio import CpioArchive
 from osc2.core import Osc
 
@@ -56,9 +56,10 @@ class BinaryList(OscElement):
         """
         if 'schema' not in kwargs:
             kwargs['schema'] = BinaryList.SCHEMA
+        parser = get_parser(binarylist=BinaryList, binary=Binary)
         f = BinaryList._perform_request(project, repository, arch, package,
-                                        **kwargs)
-        bl = fromstring(f.read(), binarylist=BinaryList, binary=Binary)
+                                        parser=parser, **kwargs)
+        bl = f.xml
         bl.set('project', project)
         bl.set('package', package)
         bl.set('repository', repository)
@@ -169,8 +170,8 @@ class BuildResult(object):
         if 'schema' not in kwargs:
             kwargs['schema'] = BuildResult.RESULT_SCHEMA
         f = request.get(path, package=package, repository=repository,
-                        arch=arch, **kwargs)
-        results = fromstring(f.read(), status=Status)
+                        arch=arch, parser=get_parser(status=Status), **kwargs)
+        results = f.xml
         return results
 
     def _prepare_kwargs(self, kwargs, *required):
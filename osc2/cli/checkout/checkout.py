@@ -95,4 +95,8 @@ class WCCheckoutController(WCUpdateController):
         tl = RendererUpdateTransactionListener(self._renderer)
         prj = Project.init(path, info.project, info.apiurl,
                            transaction_listener=[tl])
-        self._update_project(prj, info)
+        if info.get('sparse'):
+            # the packages are checked out on first access
+            prj.update(sparse=True)
+        else:
+            self._update_project(prj, info)
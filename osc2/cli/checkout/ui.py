@@ -10,6 +10,9 @@ class Checkout(CommandDescription, OscCommand):
 
     Examples:
     osc2 checkout api://project                 # checkout project
+    osc2 checkout --sparse api://project        # only register the packages
+                                                  of the project (they are
+                                                  checked out on first access)
     osc2 checkout api://project/package         # checkout package
     osc2 checkout /path/to/project              # revert all local
                                                   modifications in the project
@@ -26,4 +29,7 @@ class Checkout(CommandDescription, OscCommand):
                         action='store_true')
     opt_revision = Option('r', 'revision', 'list revision',
                           default='latest')
+    opt_sparse = Option('s', 'sparse',
+                        'do not check out the packages of a project',
+                        action='store_true')
     func = call(WCCheckoutController().checkout)
@@ -8,6 +8,9 @@ from ConfigParser import SafeConfigParser
 from collections import Sequence
 
 from osc2.core import Osc
+from osc2.httpcache import ResponseCache
+from osc2.httplimit import RequestLimiter
+from osc2.wc.store import set_durability
 from osc2.cli import plugin
 from osc2.cli.description import CommandDescription
 from osc2.cli import render
@@ -67,9 +70,31 @@ def _init(apiurl):
             if password is None:
                 msg = "No password provided for %s" % section
                 raise ValueError(msg)
+            response_cache = None
+            if cp.has_option(section, 'http_cache_dir'):
+                cache_dir = cp.get(section, 'http_cache_dir', raw=True)
+                ttl = 60
+                if cp.has_option(section, 'http_cache_ttl'):
+                    ttl = cp.getint(section, 'http_cache_ttl')
+                response_cache = ResponseCache(os.path.expanduser(cache_dir),
+                                               ttl=ttl, user=user)
+            rate = 0
+            if cp.has_option(section, 'http_max_rate'):
+                rate = cp.getfloat(section, 'http_max_rate')
+            burst = 1
+            if cp.has_option(section, 'http_burst'):
+                burst = cp.getint(section, 'http_burst')
+            max_in_flight = 0
+            if cp.has_option(section, 'http_max_in_flight'):
+                max_in_flight = cp.getint(section, 'http_max_in_flight')
+            request_limiter = RequestLimiter(rate, burst, max_in_flight)
+            if cp.has_option(section, 'wc_durability'):
+                set_durability(cp.get(section, 'wc_durability', raw=True))
             if '://' not in section:
                 section = 'https://{0}'.format(section)
-            Osc.init(section, username=user, password=password)
+            Osc.init(section, username=user, password=password,
+                     response_cache=response_cache,
+                     request_limiter=request_limiter)
             return section
 
 
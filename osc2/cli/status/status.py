@@ -43,15 +43,16 @@ def _package_status(renderer, prj, pkg, info):
 
 def _project_status(renderer, prj, info):
     global STATUS_PACKAGE_TEMPLATE
-    for package in prj.packages():
-        pkg = prj.package(package)
-        if pkg is None:
-            package_state = prj._status(package)
-            renderer.render(STATUS_PACKAGE_TEMPLATE, states={},
-                            package=package, package_state=package_state,
-                            info=info, path_prefix='')
-        else:
-            _package_status(renderer, prj, prj.package(package), info)
+    # the package states are computed concurrently and each package
+    # is rendered as soon as its states are available
+    for package, package_state, states in prj.package_states(untracked=True):
+        path_prefix = ''
+        if states:
+            # no states: the package is missing (state !)
+            path_prefix = package
+        renderer.render(STATUS_PACKAGE_TEMPLATE, states=states,
+                        package=package, package_state=package_state,
+                        info=info, path_prefix=path_prefix)
 
 
 def _package_states(pkg, *filenames, **kwargs):
@@ -1,4 +1,7 @@
+import threading
+
 from osc2.httprequest import Urllib2HTTPRequest
+from osc2.httpasync import AsyncHTTPRequest
 
 
 # XXX: needs a bit more thinking... this will be the "global" place where
@@ -7,22 +10,37 @@ class Osc(object):
     _osc = None
 
     def __init__(self, apiurl, username='', password='', request_object=None,
-                 debug=False, validate=True):
+                 debug=False, validate=True, response_cache=None,
+                 request_limiter=None):
         super(Osc, self).__init__()
         if username and request_object is not None:
             raise ValueError('either specify username or request_object')
         self.request_object = request_object
         if request_object is None:
-            self.request_object = Urllib2HTTPRequest(apiurl,
-                                                     username=username,
-                                                     password=password,
-                                                     validate=validate,
-                                                     debug=debug)
+            self.request_object = Urllib2HTTPRequest(
+                apiurl, username=username, password=password,
+                validate=validate, debug=debug,
+                response_cache=response_cache,
+                request_limiter=request_limiter)
+        self._async_request_object = None
+        self._lock = threading.Lock()
         Osc._osc = self
 
     def get_reqobj(self):
         return self.request_object
 
+    def get_async_reqobj(self):
+        """Returns an AsyncHTTPRequest object.
+
+        It wraps the request object and is created on demand.
+
+        """
+        with self._lock:
+            if self._async_request_object is None:
+                self._async_request_object = AsyncHTTPRequest(
+                    self.request_object)
+            return self._async_request_object
+
     @staticmethod
     def init(*args, **kwargs):
         return Osc(*args, **kwargs)
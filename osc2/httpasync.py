@@ -0,0 +1,109 @@
+"""Provides a http request object whose methods do not block.
+
+Each request is issued by a worker thread of a thread pool and a
+osc2.util.pool.Future object is returned immediately. This way, a
+single thread can drive many concurrent requests.
+
+Example usage:
+ r = AsyncHTTPRequest(Urllib2HTTPRequest('https://host'))
+ futures = [r.get('/source/%s/_meta' % prj) for prj in projects]
+ for future in as_completed(futures):
+     print future.result().read().result()
+"""
+
+from osc2.httprequest import AbstractHTTPRequest, AbstractHTTPResponse
+from osc2.util.pool import ThreadPool
+
+__all__ = ['AsyncHTTPRequest', 'AsyncHTTPResponse']
+
+
+class AsyncHTTPResponse(AbstractHTTPResponse):
+    """Wraps a http response.
+
+    The read method returns a Future object, whose result is the
+    read data.
+
+    """
+
+    def __init__(self, resp, pool):
+        """Constructs a new AsyncHTTPResponse object.
+
+        resp is the wrapped AbstractHTTPResponse object and pool is the
+        ThreadPool object, which executes the reads. It must not be the
+        pool, which executes the requests (otherwise, a read cannot be
+        executed if all workers wait for the result of a read).
+
+        """
+        super(AsyncHTTPResponse, self).__init__(resp.url, resp.code,
+                                                resp.headers, resp)
+        self.xml = resp.xml
+        self._pool = pool
+
+    def read(self, size=-1):
+        return self._pool.submit(self.orig_resp.read, size)
+
+    def close(self):
+        return self.orig_resp.close()
+
+
+class AsyncHTTPRequest(AbstractHTTPRequest):
+    """Issues the requests of a (blocking) request object in a thread pool.
+
+    All methods take the same arguments as the corresponding methods
+    of the wrapped request object. Instead of a response, a Future
+    object is returned, whose result is an AsyncHTTPResponse object.
+    Note: the number of concurrent requests is limited by max_workers
+    (and the wrapped request object's request limiter).
+
+    """
+
+    def __init__(self, request_object, pool=None, max_workers=8):
+        """Constructs a new AsyncHTTPRequest object.
+
+        request_object is the wrapped AbstractHTTPRequest object.
+
+        Keyword arguments:
+        pool -- a ThreadPool object, which executes the requests
+                (default: None, that is a new pool is created)
+        max_workers -- maximum number of worker threads of the newly
+                       created pool and of the pool, which executes
+                       the reads of the responses (default: 8)
+
+        """
+        super(AsyncHTTPRequest, self).__init__(request_object.apiurl,
+                                               request_object.validate)
+        self.request_object = request_object
+        if pool is None:
+            pool = ThreadPool(max_workers)
+        self.pool = pool
+        # the reads are executed in a separate pool, so that a read is
+        # never queued behind requests, which wait for a read result
+        self._read_pool = ThreadPool(max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        """Executes fn(*args, **kwargs) in the pool.
+
+        This can be used to execute a blocking function, which issues
+        requests via the wrapped request object. A Future object is
+        returned.
+
+        """
+        return self.pool.submit(fn, *args, **kwargs)
+
+    def _request(self, method, *args, **kwargs):
+        meth = getattr(self.request_object, method)
+        return self.pool.submit(
+            lambda: AsyncHTTPResponse(meth(*args, **kwargs),
+                                      self._read_pool))
+
+    def get(self, *args, **kwargs):
+        return self._request('get', *args, **kwargs)
+
+    def put(self, *args, **kwargs):
+        return self._request('put', *args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        return self._request('post', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._request('delete', *args, **kwargs)
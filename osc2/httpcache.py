@@ -0,0 +1,338 @@
+"""Provides an on-disk cache for http responses and a validator store.
+
+The cache is used by the Urllib2HTTPRequest class for GET requests
+which are issued with cache=True (for instance search or source
+listings). The validator store is used for conditional GET requests.
+
+"""
+
+import os
+import time
+import json
+import errno
+import hashlib
+import httplib
+import logging
+import threading
+import urllib
+from cStringIO import StringIO
+from collections import OrderedDict
+
+from osc2.util.io import copy_file
+
+__all__ = ['ResponseCache', 'ValidatorStore', 'Validators']
+
+
+def logger():
+    """Returns a logging.Logger object."""
+    return logging.getLogger(__name__)
+
+
+def _unlink(filename):
+    """Removes filename (it is no error if it does not exist)."""
+    try:
+        os.unlink(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class ResponseCache(object):
+    """Stores the bodies of http responses on disk.
+
+    An entry is keyed by the request's url (see httprequest.build_url)
+    and the user (the url already contains the apiurl). The cache
+    directory is only accessible by its owner (0700) and the entries are
+    stored with mode 0600, because they might contain private data.
+    A fresh entry (that is, it is younger than ttl seconds) is served
+    without issuing a http request. A stale entry, which has an ETag,
+    can be revalidated with an If-None-Match request.
+    If the total size of all entries exceeds max_size, the least recently
+    used entries are removed. Responses which are larger than
+    max_entry_size are not cached at all. The sizes of the entries are
+    kept in an in-memory index, which is read from the cache directory
+    on demand and reread every RESCAN_INTERVAL stores (this accounts
+    the entries, which are stored by other processes).
+    The number of hits, misses, revalidations and evictions is recorded
+    in the stats dict.
+
+    """
+    # response headers which are stored
+    HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+    # number of stores after which the index is reread
+    RESCAN_INTERVAL = 256
+
+    def __init__(self, cache_dir, ttl=60, max_size=1024 * 1024 * 50,
+                 max_entry_size=1024 * 1024 * 5, user=''):
+        """Constructs a new ResponseCache object.
+
+        cache_dir is the directory where the entries are stored (it is
+        created with mode 0700, if it does not exist).
+
+        Keyword arguments:
+        ttl -- number of seconds an entry is considered fresh (default: 60)
+        max_size -- maximum size of all entries in bytes
+                    (default: 50 MiB)
+        max_entry_size -- maximum size of a single entry in bytes
+                          (default: 5 MiB)
+        user -- the user on whose behalf the requests are issued; it is
+                part of the key, so that users do not share entries
+                (default: '')
+
+        """
+        super(ResponseCache, self).__init__()
+        self._cache_dir = cache_dir
+        self._user = user
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0,
+                      'evictions': 0}
+        # maps the name of an entry to its size (lru order)
+        self._index = None
+        self._total = 0
+        self._stores = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, 0700)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _filename(self, url, ext=''):
+        key = hashlib.sha1("%s\n%s" % (self._user, url)).hexdigest()
+        return os.path.join(self._cache_dir, key + ext)
+
+    def _write_meta(self, url, meta):
+        filename = self._filename(url, '.meta')
+        tmp_filename = "%s.%d.%d" % (filename, os.getpid(),
+                                     threading.current_thread().ident)
+        try:
+            fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(meta, f)
+            os.rename(tmp_filename, filename)
+        finally:
+            _unlink(tmp_filename)
+
+    def lookup(self, url):
+        """Returns the metadata dict of the entry for url.
+
+        None is returned if no such entry exists.
+
+        """
+        try:
+            with open(self._filename(url, '.meta'), 'r') as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if meta.get('url') != url or not os.path.isfile(self._filename(url)):
+            return None
+        return meta
+
+    def fresh(self, meta):
+        """Returns True if the entry is still fresh, otherwise False."""
+        return time.time() - meta['time'] < self.ttl
+
+    def _response(self, fobj, url, headers):
+        data = ''.join(["%s: %s\r\n" % (k, v)
+                        for k, v in headers.iteritems()])
+        msg = httplib.HTTPMessage(StringIO(data))
+        return urllib.addinfourl(fobj, msg, url, 200)
+
+    def open(self, meta):
+        """Returns a urllib2 like response object for the cached entry.
+
+        This counts as a cache hit.
+
+        """
+        url = meta['url']
+        filename = self._filename(url)
+        fobj = open(filename, 'rb')
+        # used for the lru eviction
+        try:
+            os.utime(filename, None)
+        except OSError:
+            # evicted meanwhile (fobj stays readable)
+            pass
+        with self._lock:
+            if self._index is not None and filename in self._index:
+                self._index[filename] = self._index.pop(filename)
+        self._count('hits')
+        logger().debug("cache hit: %s", url)
+        return self._response(fobj, url, meta['headers'])
+
+    def revalidate(self, meta):
+        """Marks the entry as fresh and returns a response object.
+
+        This is called if the server confirmed that the entry is
+        still valid (304 response).
+
+        """
+        meta['time'] = time.time()
+        self._write_meta(meta['url'], meta)
+        self._count('revalidations')
+        return self.open(meta)
+
+    def store(self, url, resp):
+        """Stores the body of the urllib2 response resp.
+
+        A response object, which reads the stored body, is returned.
+        This counts as a cache miss.
+
+        """
+        self._count('misses')
+        headers = {}
+        info = resp.info()
+        for hdr in ResponseCache.HEADERS:
+            val = info.get(hdr)
+            if val is not None:
+                headers[hdr] = val
+        filename = self._filename(url)
+        tmp_filename = "%s.%d.%d.tmp" % (filename, os.getpid(),
+                                         threading.current_thread().ident)
+        try:
+            copy_file(resp, tmp_filename, mode=0600)
+            resp.close()
+            fobj = open(tmp_filename, 'rb')
+            size = os.path.getsize(tmp_filename)
+            if size <= self.max_entry_size:
+                meta = {'url': url, 'time': time.time(), 'size': size,
+                        'headers': headers}
+                os.rename(tmp_filename, filename)
+                self._write_meta(url, meta)
+                self._evict(filename, size)
+        finally:
+            # the (already opened) fobj stays readable
+            _unlink(tmp_filename)
+        headers['Content-Length'] = str(size)
+        return self._response(fobj, url, headers)
+
+    def _remove(self, filename):
+        for ext in ('', '.meta'):
+            _unlink(filename + ext)
+
+    def _scan(self):
+        """Reads the index from the cache directory.
+
+        The caller has to hold the lock.
+
+        """
+        entries = []
+        for name in os.listdir(self._cache_dir):
+            filename = os.path.join(self._cache_dir, name)
+            if '.' in name:
+                continue
+            try:
+                st = os.stat(filename)
+            except OSError:
+                # removed meanwhile
+                continue
+            entries.append((st.st_mtime, filename, st.st_size))
+        entries.sort()
+        self._index = OrderedDict([(filename, size)
+                                   for _, filename, size in entries])
+        self._total = sum(self._index.itervalues())
+
+    def _evict(self, filename, size):
+        """Adds the stored entry to the index and removes the least
+        recently used entries (if needed).
+
+        """
+        with self._lock:
+            self._stores += 1
+            if (self._index is None
+                    or self._stores % ResponseCache.RESCAN_INTERVAL == 0):
+                self._scan()
+            else:
+                self._total -= self._index.pop(filename, 0)
+                self._index[filename] = size
+                self._total += size
+            while self._total > self.max_size and self._index:
+                filename, size = self._index.popitem(last=False)
+                self._remove(filename)
+                self._total -= size
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        """Removes all entries (including leftover temporary files)."""
+        with self._lock:
+            for name in os.listdir(self._cache_dir):
+                filename = os.path.join(self._cache_dir, name)
+                if os.path.isfile(filename):
+                    _unlink(filename)
+            self._index = None
+            self._total = 0
+
+
+class Validators(object):
+    """Represents the validators of a response.
+
+    It provides the following attributes:
+    - etag: the value of the ETag header (or None)
+    - last_modified: the value of the Last-Modified header (or None)
+    - value: an arbitrary object, which is associated with the response
+      (for instance the parsed xml)
+
+    """
+
+    def __init__(self, etag, last_modified, value=None):
+        super(Validators, self).__init__()
+        self.etag = etag
+        self.last_modified = last_modified
+        self.value = value
+
+
+class ValidatorStore(object):
+    """Stores the validators of the most recently used urls.
+
+    If a ValidatorStore object is passed to a GET request, the stored
+    validators are sent as If-None-Match/If-Modified-Since headers. If
+    the server responds with 304, the stored value is reused.
+
+    """
+
+    def __init__(self, maxsize=128):
+        """Constructs a new ValidatorStore object.
+
+        Keyword arguments:
+        maxsize -- maximum number of stored urls (default: 128)
+
+        """
+        super(ValidatorStore, self).__init__()
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._validators = OrderedDict()
+
+    def get(self, url):
+        """Returns the Validators object for url (or None)."""
+        with self._lock:
+            validators = self._validators.pop(url, None)
+            if validators is not None:
+                self._validators[url] = validators
+            return validators
+
+    def set(self, url, headers, value=None):
+        """Stores the validators from the response headers.
+
+        headers are the response headers and value is an arbitrary
+        object, which is associated with the response. If the headers
+        contain no validator, an existing entry for url is removed.
+
+        """
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        with self._lock:
+            self._validators.pop(url, None)
+            if etag is None and last_modified is None:
+                return
+            self._validators[url] = Validators(etag, last_modified, value)
+            while len(self._validators) > self._maxsize:
+                self._validators.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            self._validators.clear()
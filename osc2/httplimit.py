@@ -0,0 +1,132 @@
+"""Provides a client-side rate limiter for http requests.
+
+The limiter is used by the Urllib2HTTPRequest class. It limits the
+number of requests per second (token bucket) and the number of requests
+which are in flight at the same time. The limits are applied per apiurl
+and are shared by all threads which use the same limiter.
+
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+__all__ = ['TokenBucket', 'RequestLimiter']
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket.
+
+    The bucket holds at most burst tokens and is refilled with rate
+    tokens per second. Each acquire call takes a token (and waits, if
+    no token is available).
+
+    """
+
+    def __init__(self, rate, burst=1, clock=time.time, sleep=time.sleep):
+        """Constructs a new TokenBucket object.
+
+        rate is the number of tokens which are added per second.
+
+        Keyword arguments:
+        burst -- maximum number of tokens (default: 1)
+        clock -- function which returns the current time (default:
+                 time.time)
+        sleep -- function which is called with the number of seconds
+                 to wait (default: time.sleep)
+
+        """
+        super(TokenBucket, self).__init__()
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._last = clock()
+
+    def acquire(self):
+        """Takes a token from the bucket.
+
+        If the bucket is empty, a token is reserved and the caller waits
+        until it is available. The number of seconds waited is returned.
+
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = 0.0
+            if self._tokens < 0:
+                wait = -self._tokens / self.rate
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class RequestLimiter(object):
+    """Limits the request rate and the number of in-flight requests.
+
+    The limits are applied per apiurl. A request is considered to be
+    in flight until its response headers were received.
+
+    """
+
+    def __init__(self, rate=0, burst=1, max_in_flight=0, sleep=time.sleep):
+        """Constructs a new RequestLimiter object.
+
+        Keyword arguments:
+        rate -- maximum number of requests per second (0 means
+                unlimited) (default: 0)
+        burst -- number of requests which can be issued at once
+                 before the rate limit applies (default: 1)
+        max_in_flight -- maximum number of concurrent requests (0 means
+                         unlimited) (default: 0)
+        sleep -- function which is called with the number of seconds
+                 to wait (default: time.sleep)
+
+        """
+        super(RequestLimiter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._limits = {}
+
+    def _get_limits(self, apiurl):
+        with self._lock:
+            limits = self._limits.get(apiurl)
+            if limits is None:
+                bucket = None
+                if self.rate > 0:
+                    bucket = TokenBucket(self.rate, self.burst,
+                                         sleep=self._sleep)
+                sem = None
+                if self.max_in_flight > 0:
+                    sem = threading.BoundedSemaphore(self.max_in_flight)
+                limits = self._limits[apiurl] = (bucket, sem)
+            return limits
+
+    @contextmanager
+    def slot(self, apiurl):
+        """Waits until a request to apiurl can be issued.
+
+        It is used as a context manager; the request is in flight
+        until the with block is left.
+
+        """
+        bucket, sem = self._get_limits(apiurl)
+        if sem is not None:
+            sem.acquire()
+        try:
+            if bucket is not None:
+                bucket.acquire()
+            yield
+        finally:
+            if sem is not None:
+                sem.release()
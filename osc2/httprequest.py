@@ -12,19 +12,32 @@ Example usage:
 """
 
 import os
+import copy
 import urllib2
 import urllib
 import cookielib
 import urlparse
-import cStringIO
-import mmap
 import logging
 import base64
+import zlib
+import time
+import threading
+import warnings
+
+from tempfile import SpooledTemporaryFile
 
 from lxml import etree
 
+from osc2.httpretry import RetryPolicy, CircuitBreaker
+from osc2.httplimit import RequestLimiter
+from osc2.util.xml import assert_valid
+from osc2.util.io import copy_file
+from osc2.util.notify import Notifier
+
 __all__ = ['AbstractHTTPRequest', 'AbstractHTTPResponse', 'HTTPError',
-           'Urllib2HTTPResponse', 'Urllib2HTTPError', 'Urllib2HTTPRequest']
+           'Urllib2HTTPResponse', 'Urllib2HTTPError', 'Urllib2HTTPRequest',
+           'DecompressingFile', 'Urllib2ContentDecodingProcessor',
+           'CircuitOpenError', 'RequestListener', 'StreamingUpload']
 
 
 def build_url(apiurl, path, **query):
@@ -53,10 +66,22 @@ def build_url(apiurl, path, **query):
                                 ''))
 
 
+def _apiurl(url):
+    """Returns the apiurl (scheme and host) of the url url."""
+    scheme, host = urlparse.urlsplit(url)[0:2]
+    return urlparse.urlunsplit((scheme, host, '', '', ''))
+
+
 class AbstractHTTPResponse(object):
     """Base class for an http response object.
 
     It provides the following attributes:
+    - url: the url of the request
+    - code: the http status code (304 if a conditional GET request
+      was issued and the resource was not modified)
+    - headers: the response headers
+    - xml: the parsed xml root element (only set if a parser was passed
+      to the request method, otherwise None)
 
     """
 
@@ -77,6 +102,7 @@ class AbstractHTTPResponse(object):
         self.code = code
         self.headers = headers
         self.orig_resp = orig_resp
+        self.xml = None
 
     def read(self, size=-1):
         """Read the response.
@@ -123,6 +149,83 @@ class HTTPError(Exception):
         self.orig_exc = orig_exc
 
 
+class CircuitOpenError(HTTPError):
+    """Raised if the circuit breaker for an apiurl is open.
+
+    In this case, no request is issued.
+
+    """
+
+    def __init__(self, url, apiurl):
+        """Constructs a new CircuitOpenError object.
+
+        url is the url of the request and apiurl is the apiurl whose
+        circuit breaker is open.
+
+        """
+        super(CircuitOpenError, self).__init__(url, None, {})
+        self.apiurl = apiurl
+
+    def __str__(self):
+        return "circuit breaker for %s is open" % self.apiurl
+
+
+class NotModifiedError(HTTPError):
+    """Raised if a conditional request is answered with 304, but the
+    response should be parsed and no value is stored.
+
+    In this case, the response has no xml (for instance, the caller
+    passed an ETag but no validator store).
+
+    """
+
+    def __init__(self, exc):
+        super(NotModifiedError, self).__init__(exc.filename, exc.code,
+                                               exc.hdrs, exc)
+
+    def __str__(self):
+        return "%s not modified, but no stored value" % self.url
+
+
+class RequestListener(object):
+    """Notifies a client about the issued http requests.
+
+    This can be used to record retries and latencies.
+
+    """
+
+    def retry(self, method, url, attempt, delay, exc):
+        """This method is called before a failed request is retried.
+
+        method is the http method, url is the url of the request,
+        attempt is the number of the retry (starting with 1), delay
+        is the number of seconds before the request is retried and exc
+        is the exception which caused the retry.
+
+        """
+        raise NotImplementedError()
+
+    def finished(self, method, url, code, duration):
+        """This method is called after each attempt of a request.
+
+        method is the http method, url is the url of the request, code
+        is the http status code (None if no response was received)
+        and duration is the latency of the attempt in seconds.
+
+        """
+        raise NotImplementedError()
+
+
+class RequestNotifier(Notifier):
+    """Notifies all registered RequestListener."""
+
+    def retry(self, *args, **kwargs):
+        self._notify('retry', *args, **kwargs)
+
+    def finished(self, *args, **kwargs):
+        self._notify('finished', *args, **kwargs)
+
+
 class AbstractHTTPRequest(object):
     """Base class which provides methods for doing http requests.
 
@@ -151,60 +254,97 @@ class AbstractHTTPRequest(object):
         self.apiurl = apiurl
         self.validate = validate
 
-    def get(self, path, apiurl='', schema='', **query):
+    def get(self, path, apiurl='', schema='', parser=None, cache=False,
+            if_none_match='', if_modified_since='', validator_store=None,
+            **query):
         """Issues a http request to apiurl/path.
 
         The path parameter specified the path of the url.
         Keyword arguments:
         apiurl -- use this url instead of the default apiurl
         schema -- path to schema file (default '')
+        parser -- if specified, the response is parsed (and validated) only
+                  once with this parser and the root element is available
+                  via the response's xml attribute; the response body is
+                  consumed (default None)
+        cache -- if True, the response might be served from (and is stored
+                 in) the response cache (if the request object has one)
+                 (default False)
+        if_none_match -- an ETag; if specified, a conditional request is
+                         issued (default '')
+        if_modified_since -- a http date; if specified, a conditional
+                             request is issued (default '')
+        validator_store -- a httpcache.ValidatorStore object; if specified,
+                           the stored validators for the url are used
+                           for a conditional request and the validators of
+                           the response are stored (default None)
         query -- optional query parameters
 
+        If the server answers a conditional request with 304, a response
+        with code 304 is returned (no exception is raised). Its xml
+        attribute is the value from the validator store (if any). If a
+        parser is specified and there is no stored value, a
+        NotModifiedError is raised.
+
         """
         raise NotImplementedError()
 
     def put(self, path, data=None, filename='', apiurl='', content_type='',
-            schema='', **query):
+            schema='', parser=None, progress=None, **query):
         """Issues a http PUT request to apiurl/path.
 
         Either data or file mustn't be None.
         Keyword arguments:
-        data -- a str or file-like object which should be PUTed (default None)
-        filename -- path to a file which should be PUTed (default None)
+        data -- a str, a file-like object or an iterable of strs which
+                should be PUTed; a file-like object or an iterable is
+                streamed (default None)
+        filename -- path to a file which should be PUTed (the file is
+                    streamed) (default None)
         apiurl -- use this url instead of the default apiurl
         content_type -- use this value for the Content-type header
         schema -- path to schema file (default '')
+        parser -- see get (default None)
+        progress -- a callable, which is called with the number of sent
+                    bytes and the total number of bytes (-1 if unknown)
+                    after each block that was passed to the connection
+                    (that is, the bytes were sent but not necessarily
+                    received or acknowledged by the server) (default None)
         query -- optional query parameters
 
         """
         raise NotImplementedError()
 
     def post(self, path, data=None, filename='', urlencoded=False, apiurl='',
-             content_type='', schema='', **query):
+             content_type='', schema='', parser=None, progress=None,
+             **query):
         """Issues a http POST request to apiurl/path.
 
         Either data or file mustn't be None.
         A ValueError is raised if content_type and urlencoded is specified.
         Keyword arguments:
-        data -- a str or file-like object which should be POSTed (default None)
+        data -- see put (default None)
         filename -- path to a file which should be POSTed (default None)
         apiurl -- use this url instead of the default apiurl
         content_type -- use this value for the Content-type header
         schema -- path to schema file (default '')
+        parser -- see get (default None)
+        progress -- see put (default None)
         urlencoded -- used to indicate if the data has to be urlencoded or not;
                       if set to True the requests's Content-Type is
-                      'application/x-www-form-urlencoded' (default: False,
-                      default Content-Type: 'application/octet-stream')
+                      'application/x-www-form-urlencoded' and data has to be
+                      a str (default: False, default Content-Type:
+                      'application/octet-stream')
         query -- optional query parameters
 
         """
         raise NotImplementedError()
 
-    def delete(self, path, apiurl='', schema='', **query):
+    def delete(self, path, apiurl='', schema='', parser=None, **query):
         """Issues a http DELETE request to apiurl/path.
 
         Keyword arguments:
         schema -- path to schema file (default '')
+        parser -- see get (default None)
         apiurl -- use this url instead of the default apiurl
         query -- optional query parameters
 
@@ -312,6 +452,254 @@ class Urllib2BasicAuthHandler(urllib2.BaseHandler):
     https_request = http_request
 
 
+class DecompressingFile(object):
+    """Decompresses a gzip or deflate encoded file-like object on the fly.
+
+    Only the read, readline and close methods are supported.
+
+    """
+
+    def __init__(self, fobj, encoding, bufsize=8192):
+        """Constructs a new DecompressingFile object.
+
+        fobj is the file-like object, which provides the compressed data,
+        and encoding is either 'gzip' or 'deflate'.
+
+        Keyword arguments:
+        bufsize -- size of each read request on fobj (default: 8192)
+
+        """
+        super(DecompressingFile, self).__init__()
+        self._fobj = fobj
+        self._bufsize = bufsize
+        self._raw_deflate = False
+        if encoding == 'deflate':
+            # try the zlib format first (see _decompress)
+            self._decomp = zlib.decompressobj()
+        else:
+            self._decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buf = ''
+        self._eof = False
+        self._first = True
+
+    def _decompress(self, data):
+        try:
+            res = self._decomp.decompress(data)
+        except zlib.error:
+            if not self._first or self._raw_deflate:
+                raise
+            # some servers send a "raw" deflate stream
+            self._raw_deflate = True
+            self._decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+            res = self._decomp.decompress(data)
+        self._first = False
+        return res
+
+    def _fill(self, size):
+        while not self._eof and (size < 0 or len(self._buf) < size):
+            data = self._fobj.read(self._bufsize)
+            if not data:
+                self._eof = True
+                self._buf += self._decomp.flush()
+            else:
+                self._buf += self._decompress(data)
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            size = len(self._buf)
+        data = self._buf[:size]
+        self._buf = self._buf[size:]
+        return data
+
+    def readline(self, size=-1):
+        while '\n' not in self._buf and not self._eof:
+            self._fill(len(self._buf) + self._bufsize)
+        i = self._buf.find('\n') + 1
+        if i == 0:
+            i = len(self._buf)
+        if size >= 0:
+            i = min(i, size)
+        return self.read(i)
+
+    def close(self):
+        self._fobj.close()
+
+
+class StreamingUpload(object):
+    """Provides the data of a streaming upload.
+
+    The data is read block by block from a file-like object or an
+    iterable of strs. If the size of the data is unknown, the data
+    is sent with chunked transfer encoding (the chunk framing is
+    done by the read method).
+
+    """
+
+    def __init__(self, data, size=-1, blocksize=1024 * 64, progress=None):
+        """Constructs a new StreamingUpload object.
+
+        data is a file-like object or an iterable of strs.
+
+        Keyword arguments:
+        size -- the size of the data in bytes (default: -1, that is the
+                size of a file-like object is determined, if possible,
+                otherwise chunked transfer encoding is used)
+        blocksize -- number of bytes which are read from a file-like
+                     object at once (default: 64 KiB)
+        progress -- see AbstractHTTPRequest.put (default None)
+
+        """
+        super(StreamingUpload, self).__init__()
+        self._data = data
+        self._blocksize = blocksize
+        self._progress = progress
+        self._iter = None
+        if not hasattr(data, 'read'):
+            self._iter = iter(data)
+        if size < 0 and self._iter is None:
+            size = self._file_size(data)
+        self.size = size
+        self._start = None
+        if hasattr(data, 'tell') and hasattr(data, 'seek'):
+            try:
+                self._start = data.tell()
+            except (IOError, OSError):
+                # for instance, a pipe (cannot be rewound)
+                pass
+        self._sent = 0
+        self._eof = False
+
+    @staticmethod
+    def _file_size(fobj):
+        try:
+            return os.fstat(fobj.fileno()).st_size - fobj.tell()
+        except (AttributeError, OSError, IOError):
+            pass
+        try:
+            pos = fobj.tell()
+            fobj.seek(0, os.SEEK_END)
+            size = fobj.tell() - pos
+            fobj.seek(pos, os.SEEK_SET)
+            return size
+        except (AttributeError, IOError):
+            return -1
+
+    @property
+    def chunked(self):
+        """True if chunked transfer encoding is used."""
+        return self.size < 0
+
+    @property
+    def rewindable(self):
+        """True if the data can be sent again (see rewind)."""
+        return self._start is not None
+
+    def rewind(self):
+        """Rewinds the data so that it can be sent again.
+
+        A ValueError is raised if the data cannot be rewound.
+
+        """
+        if not self.rewindable:
+            raise ValueError('data cannot be rewound')
+        self._data.seek(self._start, os.SEEK_SET)
+        self._sent = 0
+        self._eof = False
+
+    def _next_block(self):
+        if self._iter is None:
+            return self._data.read(self._blocksize)
+        # skip empty blocks (an empty chunk marks the end)
+        for block in self._iter:
+            if block:
+                return block
+        return ''
+
+    def read(self, size=-1):
+        """Returns the next block of the data (or '' at the end).
+
+        size is ignored; each call returns a single block (or chunk).
+
+        """
+        if self._eof:
+            return ''
+        block = self._next_block()
+        if not block:
+            self._eof = True
+            if self.chunked:
+                return '0\r\n\r\n'
+            return ''
+        self._sent += len(block)
+        if self._progress is not None:
+            self._progress(self._sent, self.size)
+        if self.chunked:
+            return '%x\r\n%s\r\n' % (len(block), block)
+        return block
+
+
+# header, which contains the Content-Length of a decompressed response
+ENCODED_LENGTH_HEADER = 'X-Osc-Encoded-Length'
+
+
+class Urllib2ContentDecodingProcessor(urllib2.BaseHandler):
+    """Requests compressed responses and decompresses them on the fly.
+
+    The response headers describe the decompressed body, that is
+    the Content-Encoding and Content-Length headers of a compressed
+    response are removed (the decompressed size is not known in advance).
+    The Content-Length of the compressed body is kept in the
+    X-Osc-Encoded-Length header (a lower bound for the decompressed
+    size, in general).
+
+    """
+    ACCEPT_HEADER = 'Accept-encoding'
+    ENCODED_LENGTH_HEADER = ENCODED_LENGTH_HEADER
+    ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'deflate': 'deflate'}
+
+    def http_request(self, request):
+        if not request.has_header(self.ACCEPT_HEADER):
+            request.add_unredirected_header(self.ACCEPT_HEADER,
+                                            'gzip, deflate')
+        return request
+
+    def http_response(self, request, response):
+        headers = response.info()
+        encoding = headers.get('Content-Encoding', '').strip().lower()
+        encoding = self.ENCODINGS.get(encoding)
+        if encoding is None:
+            return response
+        if 'Content-Length' in headers:
+            headers[self.ENCODED_LENGTH_HEADER] = headers['Content-Length']
+        for hdr in ('Content-Encoding', 'Content-Length'):
+            if hdr in headers:
+                del headers[hdr]
+        fobj = DecompressingFile(response, encoding)
+        new_response = urllib.addinfourl(fobj, headers, response.geturl(),
+                                         response.getcode())
+        new_response.msg = getattr(response, 'msg', '')
+        return new_response
+
+    https_request = http_request
+    https_response = http_response
+
+
+class Urllib2Request(urllib2.Request):
+    """A urllib2.Request which supports chunked uploads.
+
+    urllib2 insists on a Content-length header for requests with data,
+    which is not known for a chunked upload.
+
+    """
+
+    def has_header(self, header_name):
+        data = self.get_data()
+        if (header_name == 'Content-length'
+                and getattr(data, 'chunked', False)):
+            return True
+        return urllib2.Request.has_header(self, header_name)
+
+
 class Urllib2HTTPRequest(AbstractHTTPRequest):
     """Do http requests with urllib2.
 
@@ -321,8 +709,12 @@ class Urllib2HTTPRequest(AbstractHTTPRequest):
     """
 
     def __init__(self, apiurl, validate=False, username='', password='',
-                 cookie_filename='', debug=False, mmap=True,
-                 mmap_fsize=1024 * 512, handlers=None):
+                 cookie_filename='', debug=False, mmap=None,
+                 mmap_fsize=None, handlers=None,
+                 spool_size=1024 * 512, response_cache=None,
+                 compress=True, retry_policy=None, breaker_threshold=5,
+                 breaker_timeout=30, listener=None, request_limiter=None,
+                 upload_blocksize=1024 * 64):
         """constructs a new Urllib2HTTPRequest object.
 
         apiurl is the url which is used for every request.
@@ -335,22 +727,70 @@ class Urllib2HTTPRequest(AbstractHTTPRequest):
         password -- password which is used for basic authentification
                     (default '')
         debug -- log debug messages
-        mmap -- use mmap when POSTing or PUTing a file (default True)
-        mmap_fsize -- specifies the minimum filesize for using mmap
-                      (default 1024*512)
+        mmap -- deprecated and ignored (files are streamed); a
+                DeprecationWarning is issued if it is specified
+        mmap_fsize -- deprecated and ignored (see mmap)
         handlers -- list of additional urllib2 handlers (default None)
+        spool_size -- a response which has to be validated and which exceeds
+                      this size is spooled to a tmpfile instead of being
+                      kept in memory (default 1024*512)
+        response_cache -- a httpcache.ResponseCache object, which is used
+                          for GET requests that are issued with cache=True
+                          (default None)
+        compress -- request gzip/deflate compressed responses, which are
+                    transparently decompressed (default True)
+        retry_policy -- a httpretry.RetryPolicy object, which decides
+                        whether a failed request is retried (default None,
+                        that is RetryPolicy() is used)
+        breaker_threshold -- number of subsequent failed requests after
+                             which the circuit breaker of an apiurl is
+                             opened (0 disables the circuit breaker)
+                             (default 5)
+        breaker_timeout -- number of seconds after which a trial request
+                           is issued to an apiurl whose circuit breaker is
+                           open (default 30)
+        listener -- list of RequestListener instances (default: [])
+        request_limiter -- a httplimit.RequestLimiter object, which limits
+                           the request rate and the number of in-flight
+                           requests per apiurl (default None, that is
+                           no limits are applied)
+        upload_blocksize -- number of bytes which are read at once from a
+                            file or file-like object that is uploaded
+                            (default 64 KiB)
 
         """
         super(Urllib2HTTPRequest, self).__init__(apiurl, validate)
+        if mmap is not None or mmap_fsize is not None:
+            warnings.warn('the mmap and mmap_fsize arguments are ignored '
+                          '(files are streamed)', DeprecationWarning,
+                          stacklevel=2)
         self.debug = debug
-        self._use_mmap = mmap
-        self._mmap_fsize = mmap_fsize
+        self.upload_blocksize = upload_blocksize
+        self._spool_size = spool_size
+        self.response_cache = response_cache
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self._breaker_threshold = breaker_threshold
+        self._breaker_timeout = breaker_timeout
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        if listener is None:
+            listener = []
+        self._notifier = RequestNotifier(listener)
+        if request_limiter is None:
+            request_limiter = RequestLimiter()
+        self.request_limiter = request_limiter
         self._logger = logging.getLogger(__name__)
-        self._install_opener(username, password, cookie_filename, handlers)
+        self._install_opener(username, password, cookie_filename, handlers,
+                             compress)
 
-    def _install_opener(self, username, password, cookie_filename, handlers):
+    def _install_opener(self, username, password, cookie_filename, handlers,
+                        compress=True):
         if handlers is None:
             handlers = []
+        if compress:
+            handlers.append(Urllib2ContentDecodingProcessor())
         cookie_processor = self._setup_cookie_processor(cookie_filename)
         if cookie_processor is not None:
             handlers.append(cookie_processor)
@@ -386,50 +826,199 @@ class Urllib2HTTPRequest(AbstractHTTPRequest):
         if not apiurl:
             apiurl = self.apiurl
         url = build_url(apiurl, path, **query)
-        request = urllib2.Request(url)
+        request = Urllib2Request(url)
         request.get_method = lambda: method
         return request
 
-    def _validate_response(self, resp, schema_filename):
-        if not schema_filename or not self.validate:
+    def _validate_response(self, resp, schema_filename, parser=None):
+        validate = schema_filename and self.validate
+        if parser is not None:
+            # parse only once: the caller gets the validated tree
+            resp.xml = etree.parse(resp, parser).getroot()
+            if validate:
+                self._logger.debug("validate resp against schema: %s",
+                                   schema_filename)
+                assert_valid(schema_filename, resp.xml)
+            return bool(validate)
+        if not validate:
             return False
         # this is needed for validation so that we can seek to the "top" of
-        # the file again (after validation)
-        sio = cStringIO.StringIO(resp.read())
+        # the file again (after validation); large responses are spooled
+        # to disk
+        sio = SpooledTemporaryFile(max_size=self._spool_size)
+        copy_file(resp, sio)
+        sio.seek(0, os.SEEK_SET)
         resp._sio = sio
         self._logger.debug("validate resp against schema: %s", schema_filename)
-        root = etree.fromstring(resp.read())
+        root = etree.parse(resp._sio).getroot()
         resp._sio.seek(0, os.SEEK_SET)
-        if schema_filename.endswith('.rng'):
-            schema = etree.RelaxNG(file=schema_filename)
-        elif schema_filename.endswith('.xsd'):
-            schema = etree.XMLSchema(file=schema_filename)
-        else:
-            raise ValueError('unsupported schema file')
-        schema.assertValid(root)
+        assert_valid(schema_filename, root)
         return True
 
     def _new_response(self, resp):
         return Urllib2HTTPResponse(resp)
 
-    def _send_request(self, method, path, apiurl, schema, **query):
-        request = self._build_request(method, path, apiurl, **query)
-        self._logger.info(request.get_full_url())
+    def circuit_breaker(self, url):
+        """Returns the httpretry.CircuitBreaker object for url.
+
+        There is one circuit breaker per apiurl (scheme and host).
+        None is returned if the circuit breaker is disabled.
+
+        """
+        if self._breaker_threshold <= 0:
+            return None
+        apiurl = _apiurl(url)
+        with self._breakers_lock:
+            breaker = self._breakers.get(apiurl)
+            if breaker is None:
+                breaker = CircuitBreaker(self._breaker_threshold,
+                                         self._breaker_timeout)
+                self._breakers[apiurl] = breaker
+            return breaker
+
+    def _urlopen(self, request, data=None):
+        """Opens the request and retries it according to the retry policy.
+
+        The original urllib2 exception is raised if the request
+        finally fails.
+
+        """
+        method = request.get_method()
+        url = request.get_full_url()
+        policy = self.retry_policy
+        retry = policy.allows(method, data)
+        apiurl = _apiurl(url)
+        breaker = self.circuit_breaker(url)
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(url, apiurl)
+            try:
+                with self.request_limiter.slot(apiurl):
+                    start = time.time()
+                    f = urllib2.urlopen(request, data)
+            except RetryPolicy.ERRORS as e:
+                code = getattr(e, 'code', None)
+                self._notifier.finished(method, url, code, time.time() - start)
+                if breaker is not None:
+                    breaker.record(not policy.failure(e))
+                delay = None
+                if retry:
+                    delay = policy.delay(attempt, e)
+                if delay is None:
+                    raise
+                if getattr(e, 'fp', None) is not None:
+                    e.close()
+                if hasattr(data, 'rewind'):
+                    data.rewind()
+                attempt += 1
+                self._logger.debug("retry %d of %s %s in %.2fs: %s", attempt,
+                                   method, url, delay, e)
+                self._notifier.retry(method, url, attempt, delay, e)
+                policy.sleep(delay)
+                continue
+            except:
+                # for instance, a KeyboardInterrupt (otherwise, the trial
+                # request of a half-open breaker is never finished)
+                if breaker is not None:
+                    breaker.record(False)
+                raise
+            self._notifier.finished(method, url, f.getcode(),
+                                    time.time() - start)
+            if breaker is not None:
+                breaker.record(True)
+            return f
+
+    def _urlopen_cached(self, request):
+        cache = self.response_cache
+        url = request.get_full_url()
+        meta = cache.lookup(url)
+        if meta is not None and cache.fresh(meta):
+            try:
+                return cache.open(meta)
+            except IOError:
+                # the entry was evicted after the lookup
+                meta = None
+        etag = None
+        if meta is not None:
+            etag = meta['headers'].get('ETag')
+        if etag is not None:
+            request.add_header('If-None-Match', etag)
         try:
-            f = urllib2.urlopen(request)
+            f = self._urlopen(request)
         except urllib2.HTTPError as e:
-            raise Urllib2HTTPError(e)
+            if e.code != 304 or etag is None:
+                raise Urllib2HTTPError(e)
+            try:
+                return cache.revalidate(meta)
+            except IOError:
+                # the entry was evicted after the lookup, hence the
+                # body has to be fetched again
+                pass
+            # urllib2.Request capitalizes the header names
+            del request.headers['If-none-match']
+            try:
+                f = self._urlopen(request)
+            except urllib2.HTTPError as e:
+                raise Urllib2HTTPError(e)
+        return cache.store(url, f)
+
+    def _send_request(self, method, path, apiurl, schema, parser,
+                      cache=False, headers=None, validator_store=None,
+                      **query):
+        request = self._build_request(method, path, apiurl, **query)
+        url = request.get_full_url()
+        self._logger.info(url)
+        headers = dict(headers or {})
+        validators = None
+        if validator_store is not None:
+            validators = validator_store.get(url)
+        if validators is not None:
+            if not headers.get('If-None-Match'):
+                headers['If-None-Match'] = validators.etag
+            if not headers.get('If-Modified-Since'):
+                headers['If-Modified-Since'] = validators.last_modified
+        conditional = False
+        for hdr, val in headers.iteritems():
+            if val:
+                request.add_header(hdr, val)
+                conditional = conditional or hdr.startswith('If-')
+        if (cache and not conditional and method == 'GET'
+                and self.response_cache is not None):
+            f = self._urlopen_cached(request)
+        else:
+            try:
+                f = self._urlopen(request)
+            except urllib2.HTTPError as e:
+                if e.code != 304 or not conditional:
+                    raise Urllib2HTTPError(e)
+                if validators is not None:
+                    f = self._new_response(e)
+                    # the caller might modify the xml (for instance,
+                    # Package.list sets the project), hence each
+                    # response gets its own copy
+                    f.xml = copy.deepcopy(validators.value)
+                    return f
+                if parser is not None:
+                    # the caller expects the xml (and would fail later)
+                    raise NotModifiedError(e)
+                return self._new_response(e)
         f = self._new_response(f)
-        self._validate_response(f, schema)
+        self._validate_response(f, schema, parser)
+        if validator_store is not None:
+            validator_store.set(url, f.headers, copy.deepcopy(f.xml))
         return f
 
     def _send_data(self, request, data, filename, content_type, schema,
-                   urlencoded):
+                   urlencoded, parser=None, progress=None):
         self._logger.info(request.get_full_url())
         f = None
         if content_type and urlencoded:
             msg = 'content_type and urlencoded are mutually exclusive'
             raise ValueError(msg)
+        streaming = data is not None and not isinstance(data, basestring)
+        if urlencoded and streaming:
+            raise ValueError('urlencoded data has to be a str')
         if content_type:
             request.add_header('Content-type', content_type)
         elif urlencoded:
@@ -439,30 +1028,36 @@ class Urllib2HTTPRequest(AbstractHTTPRequest):
             request.add_header('Content-type', 'application/octet-stream')
         try:
             if filename:
-                f = self._send_file(request, filename, urlencoded)
+                f = self._send_file(request, filename, urlencoded, progress)
+            elif streaming:
+                data = StreamingUpload(data, blocksize=self.upload_blocksize,
+                                       progress=progress)
+                f = self._send_stream(request, data)
             else:
                 if urlencoded:
                     data = urllib.quote_plus(data)
-                f = urllib2.urlopen(request, data)
+                f = self._urlopen(request, data)
         except urllib2.HTTPError as e:
             raise Urllib2HTTPError(e)
         f = self._new_response(f)
-        self._validate_response(f, schema)
+        self._validate_response(f, schema, parser)
         return f
 
-    def _send_file(self, request, filename, urlencoded):
+    def _send_stream(self, request, data):
+        if data.chunked:
+            request.add_header('Transfer-encoding', 'chunked')
+        else:
+            request.add_header('Content-length', str(data.size))
+        return self._urlopen(request, data)
+
+    def _send_file(self, request, filename, urlencoded, progress=None):
         with open(filename, 'rb') as fobj:
-            fsize = os.path.getsize(filename)
-            if self._use_mmap and fsize >= self._mmap_fsize and not urlencoded:
-                self._logger.debug("using mmap for file: %s" % filename)
-                data = mmap.mmap(fobj.fileno(), fsize, mmap.MAP_SHARED,
-                                 mmap.PROT_READ)
-                data = buffer(data)
-            else:
-                data = fobj.read()
             if urlencoded:
-                data = urllib.quote_plus(data)
-            return urllib2.urlopen(request, data)
+                data = urllib.quote_plus(fobj.read())
+                return self._urlopen(request, data)
+            data = StreamingUpload(fobj, blocksize=self.upload_blocksize,
+                                   progress=progress)
+            return self._send_stream(request, data)
 
     def _check_put_post_args(self, data, filename):
         if filename and data is not None:
@@ -470,22 +1065,29 @@ class Urllib2HTTPRequest(AbstractHTTPRequest):
         elif filename and not os.path.isfile(filename):
             raise ValueError("filename %s does not exist" % filename)
 
-    def get(self, path, apiurl='', schema='', **query):
-        return self._send_request('GET', path, apiurl, schema, **query)
+    def get(self, path, apiurl='', schema='', parser=None, cache=False,
+            if_none_match='', if_modified_since='', validator_store=None,
+            **query):
+        headers = {'If-None-Match': if_none_match,
+                   'If-Modified-Since': if_modified_since}
+        return self._send_request('GET', path, apiurl, schema, parser,
+                                  cache, headers, validator_store, **query)
 
-    def delete(self, path, apiurl='', schema='', **query):
-        return self._send_request('DELETE', path, apiurl, schema, **query)
+    def delete(self, path, apiurl='', schema='', parser=None, **query):
+        return self._send_request('DELETE', path, apiurl, schema, parser,
+                                  **query)
 
     def put(self, path, data=None, filename='', apiurl='', content_type='',
-            schema='', **query):
+            schema='', parser=None, progress=None, **query):
         self._check_put_post_args(data, filename)
         request = self._build_request('PUT', path, apiurl, **query)
         return self._send_data(request, data, filename, content_type,
-                               schema, False)
+                               schema, False, parser, progress)
 
     def post(self, path, data=None, filename='', apiurl='', content_type='',
-             schema='', urlencoded=False, **query):
+             schema='', urlencoded=False, parser=None, progress=None,
+             **query):
         self._check_put_post_args(data, filename)
         request = self._build_request('POST', path, apiurl, **query)
         return self._send_data(request, data, filename, content_type,
-                               schema, urlencoded)
+                               schema, urlencoded, parser, progress)
@@ -0,0 +1,200 @@
+"""Provides a retry policy and a circuit breaker for http requests.
+
+Both are used by the Urllib2HTTPRequest class: a failed request, which
+failed due to a transient error (for instance a 503 response or a
+connection error), is retried (with an exponential backoff) and the
+circuit breaker of an apiurl is opened if too many subsequent requests
+failed.
+
+"""
+
+import time
+import random
+import socket
+import httplib
+import urllib2
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+__all__ = ['RetryPolicy', 'CircuitBreaker']
+
+
+class RetryPolicy(object):
+    """Decides whether and when a failed request is retried.
+
+    By default only requests with an idempotent method are retried.
+    The delay between two attempts grows exponentially (with "full
+    jitter", that is the delay is a random number between 0 and
+    backoff * 2**attempt). If the response has a Retry-After header,
+    its value is used as the delay.
+
+    """
+    # exceptions which might be transient
+    ERRORS = (urllib2.URLError, socket.error, httplib.HTTPException)
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30,
+                 status_codes=(429, 502, 503, 504),
+                 methods=('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'),
+                 sleep=time.sleep):
+        """Constructs a new RetryPolicy object.
+
+        Keyword arguments:
+        retries -- maximum number of retries (0 disables retries)
+                   (default: 3)
+        backoff -- base delay in seconds (default: 0.5)
+        max_backoff -- maximum delay in seconds; if a Retry-After header
+                       requests a longer delay, the request is not
+                       retried (default: 30)
+        status_codes -- http status codes which are retried
+                        (default: (429, 502, 503, 504))
+        methods -- http methods which are retried (default: the
+                   idempotent methods GET, HEAD, PUT, DELETE, OPTIONS)
+        sleep -- function which is called with the delay (default:
+                 time.sleep)
+
+        """
+        super(RetryPolicy, self).__init__()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.status_codes = status_codes
+        self.methods = methods
+        self.sleep = sleep
+
+    def allows(self, method, data=None):
+        """Returns True if a request can be retried, otherwise False.
+
+        A request, whose data is a file-like object, cannot be retried
+        (the data cannot be sent again), unless the data is rewindable
+        (see httprequest.StreamingUpload).
+
+        """
+        if self.retries <= 0:
+            return False
+        elif hasattr(data, 'read') and not getattr(data, 'rewindable', False):
+            return False
+        return method in self.methods
+
+    def transient(self, exc):
+        """Returns True if the exception exc might be transient."""
+        if isinstance(exc, urllib2.HTTPError):
+            return exc.code in self.status_codes
+        return isinstance(exc, RetryPolicy.ERRORS)
+
+    def failure(self, exc):
+        """Returns True if exc indicates a failure of the server.
+
+        Unlike transient, a 429 response (too many requests) is no
+        failure, because the server itself is fine.
+
+        """
+        if isinstance(exc, urllib2.HTTPError):
+            return exc.code >= 500
+        return isinstance(exc, RetryPolicy.ERRORS)
+
+    def _retry_after(self, exc):
+        headers = getattr(exc, 'hdrs', None)
+        if headers is None:
+            return None
+        value = headers.get('Retry-After')
+        if value is None:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - time.time())
+
+    def delay(self, attempt, exc):
+        """Returns the delay in seconds before the next attempt.
+
+        attempt is the number of the failed attempt (starting with 0)
+        and exc is the exception which was raised. None is returned
+        if the request should not be retried.
+
+        """
+        if attempt >= self.retries or not self.transient(exc):
+            return None
+        retry_after = self._retry_after(exc)
+        if retry_after is not None:
+            if retry_after > self.max_backoff:
+                return None
+            return retry_after
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """Stops issuing requests to a failing apiurl.
+
+    If failure_threshold subsequent requests failed, the breaker is
+    "open" and no further requests are allowed. After reset_timeout
+    seconds the breaker is "half-open": a single trial request is
+    allowed. If it succeeds, the breaker is "closed" again, otherwise
+    it is opened again.
+
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """Constructs a new CircuitBreaker object.
+
+        Keyword arguments:
+        failure_threshold -- number of subsequent failures which open
+                             the breaker (default: 5)
+        reset_timeout -- number of seconds after which a trial request
+                         is allowed (default: 30)
+
+        """
+        super(CircuitBreaker, self).__init__()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+
+    @property
+    def state(self):
+        """Returns the current state of the breaker."""
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened is None:
+            return CircuitBreaker.CLOSED
+        elif time.time() - self._opened < self.reset_timeout:
+            return CircuitBreaker.OPEN
+        return CircuitBreaker.HALF_OPEN
+
+    def allow(self):
+        """Returns True if a request is allowed, otherwise False."""
+        with self._lock:
+            state = self._state()
+            if state == CircuitBreaker.CLOSED:
+                return True
+            elif state == CircuitBreaker.OPEN or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record(self, success):
+        """Records the outcome of a request.
+
+        success is True if the request succeeded, otherwise False.
+
+        """
+        with self._lock:
+            self._trial = False
+            if success:
+                self._failures = 0
+                self._opened = None
+                return
+            self._failures += 1
+            if (self._opened is not None
+                    or self._failures >= self.failure_threshold):
+                self._opened = time.time()
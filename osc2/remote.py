@@ -18,8 +18,8 @@ from cStringIO import StringIO
 from lxml import etree, objectify
 
 from osc2.core import Osc
-from osc2.httprequest import HTTPError
-from osc2.util.xml import get_parser, fromstring, OscElement
+from osc2.httprequest import HTTPError, ENCODED_LENGTH_HEADER
+from osc2.util.xml import get_parser, fromstring, OscElement, assert_valid
 from osc2.util.io import copy_file, iter_read, mkstemp
 
 __all__ = ['RemoteModel', 'RemoteProject', 'RemotePackage', 'Request',
@@ -191,13 +191,7 @@ class RemoteModel(object):
         if not self._schema:
             return False
         self._logger.debug("validate modle against schema: %s", self._schema)
-        if self._schema.endswith('.rng'):
-            schema = etree.RelaxNG(file=self._schema)
-        elif self._schema.endswith('.xsd'):
-            schema = etree.XMLSchema(file=self._schema)
-        else:
-            raise ValueError('unsupported schema file')
-        schema.assertValid(self._xml)
+        assert_valid(self._schema, self._xml)
         return True
 
     def store(self, path, method='PUT', **kwargs):
@@ -238,6 +232,18 @@ class RemoteModel(object):
         xml_data = http_method(path, **kwargs).read()
         return cls(xml_data=xml_data)
 
+    @classmethod
+    def find_async(cls, *args, **kwargs):
+        """Get the remote model from the server without blocking.
+
+        A osc2.util.pool.Future object is returned, whose result is
+        the remote model. *args and **kwargs are passed to the find
+        method.
+
+        """
+        request = Osc.get_osc().get_async_reqobj()
+        return request.submit(cls.find, *args, **kwargs)
+
     @classmethod
     def exists(cls, *args, **kwargs):
         """Check if the remote resource exists.
@@ -533,7 +539,12 @@ class RORemoteFile(object):
         request = Osc.get_osc().get_reqobj()
         http_method = _get_http_method(request, self.method)
         self._fobj = http_method(self.path, **self.kwargs)
-        self._remote_size = int(self._fobj.headers.get('Content-Length', -1))
+        headers = self._fobj.headers
+        # a transparently decompressed response has no Content-Length
+        # (the size of the compressed data is a lower bound)
+        size = headers.get('Content-Length',
+                           headers.get(ENCODED_LENGTH_HEADER, -1))
+        self._remote_size = int(size)
 
     def _read(self, size=-1):
         """internal method which performs the read.
@@ -559,20 +570,36 @@ class RORemoteFile(object):
         if self._fobj is not None:
             self._fobj.close()
 
-    def write_to(self, dest, size=-1):
+    def write_to(self, dest, size=-1, hashes=()):
         """Write file to dest.
 
         If dest is a file-like object (that is it has a write(buf) method)
         it's write method will be called. If dest is a filename the data will
         be written to it (existing files will be overwritten, if the file
         doesn't exist it will be created).
+        Return a list which contains the hexdigest of each hash object in
+        hashes.
 
         Keyword arguments:
         size -- write only size bytes (default: -1 (means write everything))
+        hashes -- list of hash objects which are updated with the written
+                  data (default: ())
+
+        """
+        return copy_file(self, dest, mtime=self.mtime, mode=self.mode,
+                         bufsize=self.stream_bufsize, size=size,
+                         read_method='_read', hashes=hashes)
+
+    def write_to_async(self, dest, size=-1, hashes=()):
+        """Write file to dest without blocking.
+
+        A osc2.util.pool.Future object is returned, whose result is
+        the return value of the write_to method. For the arguments
+        see write_to.
 
         """
-        copy_file(self, dest, mtime=self.mtime, mode=self.mode,
-                  bufsize=self.stream_bufsize, size=size, read_method='_read')
+        request = Osc.get_osc().get_async_reqobj()
+        return request.submit(self.write_to, dest, size=size, hashes=hashes)
 
     def __iter__(self, size=-1):
         """Iterates over the file"""
@@ -587,6 +614,9 @@ class RWRemoteFile(RORemoteFile):
     If the remote file is small than 8096 bytes the file is represented by
     a StringIO object (the size is configurable, see __init__). Otherwise the
     file is represented by a temporary file, which is written to disk.
+    If the size of the remote file is unknown, a StringIO object is used
+    until the read data exceeds the size limit (then a temporary file is
+    used).
 
     """
 
@@ -634,6 +664,15 @@ class RWRemoteFile(RORemoteFile):
             new_fobj = mkstemp()
         else:
             new_fobj = StringIO()
+        if read_required and self._remote_size < 0 and not self.use_tmp:
+            # unknown size: switch to a tmpfile if the data exceeds tmp_size
+            self.write_to(new_fobj, size=self.tmp_size)
+            data = self._read(1)
+            if data:
+                tmp_fobj = mkstemp()
+                tmp_fobj.write(new_fobj.getvalue())
+                tmp_fobj.write(data)
+                new_fobj = tmp_fobj
         if read_required:
             # we read/write _everything_ (otherwise this class needs
             # a bit more logic - can be added if needed)
@@ -670,15 +709,18 @@ class RWRemoteFile(RORemoteFile):
         http_method = _get_http_method(request, self.wb_method)
         if 'schema' not in kwargs:
             kwargs['schema'] = self._schema
-        data = None
-        filename = ''
-        if hasattr(self._fobj, 'getvalue'):
-            data = self._fobj.getvalue()
-        else:
-            filename = self._fobj.name
         self._fobj.flush()
         wb_path = self.wb_path or self.path
-        http_method(wb_path, data=data, filename=filename, **kwargs)
+        if hasattr(self._fobj, 'getvalue'):
+            # stream the in-memory data (no copy via getvalue)
+            pos = self._fobj.tell()
+            self._fobj.seek(0, os.SEEK_SET)
+            try:
+                http_method(wb_path, data=self._fobj, **kwargs)
+            finally:
+                self._fobj.seek(pos, os.SEEK_SET)
+        else:
+            http_method(wb_path, filename=self._fobj.name, **kwargs)
         self._modified = False
 
     def close(self, **kwargs):
@@ -4,14 +4,75 @@ Currently only the search for requests is supported.
 
 """
 
+import re
+import copy
+import hashlib
+
 from lxml import etree
 
 from osc2.remote import Request, RemoteProject, RemotePackage
-from osc2.util.xml import fromstring, OscElement
+from osc2.util.xml import get_parser, OscElement, ElementClassLookup
 from osc2.core import Osc
 
 
-class ProjectCollection(OscElement):
+# a string literal or an absolute location path
+_ABS_PATH_RE = re.compile(r'("[^"]*"|\'[^\']*\'|(?:^|(?<=[\s\[(,=!<>|]))/)')
+
+
+def _relative_xpath(xpath):
+    """Returns the xpath relative to the context node.
+
+    The search xpath is evaluated by the server with each entry (for
+    instance a request) as the root, that is an absolute location path
+    like "/state" refers to a child of the entry. Each absolute location
+    path is turned into a relative path starting with "./".
+
+    """
+    def replace(match):
+        token = match.group(1)
+        if token == '/':
+            return './'
+        return token
+    return _ABS_PATH_RE.sub(replace, xpath)
+
+
+class Collection(OscElement):
+    """Base class for all search result collections.
+
+    Subclasses have to set the ENTRY_TAG attribute.
+
+    """
+    ENTRY_TAG = ''
+
+    def __iter__(self):
+        for r in self.iterfind(self.ENTRY_TAG):
+            yield r.real_obj()
+
+    def filter(self, xp):
+        """Returns a new collection with the entries which match the xpath.
+
+        The xpath is evaluated locally (no http request is issued).
+        It has the same semantics as the xpath which is passed to
+        the corresponding find_* function. The returned collection
+        is of the same type as this collection and contains copies
+        of the matching entries.
+        xp is either an Expression object or a string.
+
+        """
+        xpath = xp
+        if hasattr(xp, 'tostring'):
+            xpath = xp.tostring()
+        xpath = "%s[%s]" % (self.ENTRY_TAG, _relative_xpath(xpath))
+        collection = self.makeelement(self.tag, attrib=dict(self.attrib))
+        matches = self.findall(xpath)
+        for elm in matches:
+            collection.append(copy.deepcopy(elm))
+        if collection.get('matches') is not None:
+            collection.set('matches', str(len(matches)))
+        return collection
+
+
+class ProjectCollection(Collection):
     """Contains the project search results.
 
     All project objects are read only. In order to "work"
@@ -20,10 +81,7 @@ class ProjectCollection(OscElement):
 
     """
     SCHEMA = ''
-
-    def __iter__(self):
-        for r in self.iterfind('project'):
-            yield r.real_obj()
+    ENTRY_TAG = 'project'
 
 
 class ROProject(OscElement):
@@ -43,7 +101,7 @@ class ROProject(OscElement):
         return RemoteProject(xml_data=etree.tostring(self))
 
 
-class RequestCollection(OscElement):
+class RequestCollection(Collection):
     """Contains the request search results.
 
     All request objects are read only. In order to "work"
@@ -52,10 +110,7 @@ class RequestCollection(OscElement):
 
     """
     SCHEMA = ''
-
-    def __iter__(self):
-        for r in self.iterfind('request'):
-            yield r.real_obj()
+    ENTRY_TAG = 'request'
 
 
 class RORequest(OscElement):
@@ -75,7 +130,7 @@ class RORequest(OscElement):
         return Request(xml_data=etree.tostring(self))
 
 
-class PackageCollection(OscElement):
+class PackageCollection(Collection):
     """Contains the package search results.
 
     All package objects are read only. In order to "work"
@@ -84,10 +139,7 @@ class PackageCollection(OscElement):
 
     """
     SCHEMA = ''
-
-    def __iter__(self):
-        for r in self.iterfind('package'):
-            yield r.real_obj()
+    ENTRY_TAG = 'package'
 
 
 class ROPackage(OscElement):
@@ -107,7 +159,7 @@ class ROPackage(OscElement):
         return RemotePackage(xml_data=etree.tostring(self))
 
 
-def _find(path, xp, tag_class={}, **kwargs):
+def _find(path, xp, tag_class={}, collection=None, **kwargs):
     """Returns a Collection with objects which match the xpath.
 
     path is the remote path which is used for the http request.
@@ -118,6 +170,50 @@ def _find(path, xp, tag_class={}, **kwargs):
     tag_class -- a dict which maps tag names to classes
                  (see util.xml.fromstring for the details)
                  (default: {})
+    collection -- if specified, the xpath is evaluated locally against
+                  this collection instead of issuing a http request
+                  (see Collection.filter) (default: None)
+    **kwargs -- optional parameters for the http request
+
+    """
+    if collection is not None:
+        return collection.filter(xp)
+    request = Osc.get_osc().get_reqobj()
+    xpath = xp
+    if hasattr(xp, 'tostring'):
+        xpath = xp.tostring()
+    kwargs.setdefault('cache', True)
+    f = request.get(path, match=xpath, parser=get_parser(**tag_class),
+                    **kwargs)
+    return f.xml
+
+
+def _iterfind(path, xp, entry_tag, tag_class={}, page_size=0, **kwargs):
+    """Yields the entries which match the xpath.
+
+    In contrast to _find, the response is parsed incrementally and each
+    processed entry is removed from the tree, that is the memory usage
+    does not depend on the number of matches. Each yielded entry is an
+    independent copy.
+    Note: if the response is validated (that is, a schema is specified and
+    the request object validates responses), the complete response is
+    spooled (to a tmpfile, if it is large) and parsed by the validation,
+    hence the memory usage is only flat if no validation is done.
+    path is the remote path which is used for the http request.
+    xp is the xpath which is used for the search (either an
+    Expression object or a string).
+    entry_tag is the tag of the entries which are yielded.
+
+    Keyword arguments:
+    tag_class -- a dict which maps tag names to classes
+                 (see util.xml.fromstring for the details)
+                 (default: {})
+    page_size -- if > 0, the results are requested in pages of page_size
+                 entries (via the limit and offset query parameters);
+                 the paging stops if a page contains no new entries
+                 (a server which ignores the offset returns the same
+                 page again) (default: 0, that is everything is
+                 requested at once)
     **kwargs -- optional parameters for the http request
 
     """
@@ -125,8 +221,40 @@ def _find(path, xp, tag_class={}, **kwargs):
     xpath = xp
     if hasattr(xp, 'tostring'):
         xpath = xp.tostring()
-    f = request.get(path, match=xpath, **kwargs)
-    return fromstring(f.read(), **tag_class)
+    offset = 0
+    # digests of the entries of the previous page
+    prev_digests = set()
+    while True:
+        if page_size > 0:
+            kwargs['limit'] = str(page_size)
+            kwargs['offset'] = str(offset)
+        f = request.get(path, match=xpath, **kwargs)
+        count = 0
+        new = 0
+        digests = set()
+        try:
+            context = etree.iterparse(f, events=('end', ), tag=entry_tag)
+            context.set_element_class_lookup(ElementClassLookup(**tag_class))
+            for _, elm in context:
+                count += 1
+                if page_size > 0:
+                    digest = hashlib.md5(etree.tostring(elm)).digest()
+                    digests.add(digest)
+                if page_size <= 0 or digest not in prev_digests:
+                    new += 1
+                    yield copy.deepcopy(elm)
+                # free the memory of the processed entries
+                elm.clear()
+                while elm.getprevious() is not None:
+                    elm.getparent().remove(elm.getprevious())
+        finally:
+            f.close()
+        # a server which does not support paging returns more entries
+        # (or the same page again, if it ignores the offset)
+        if page_size <= 0 or count != page_size or not new:
+            break
+        prev_digests = digests
+        offset += page_size
 
 
 def find_request(xp, **kwargs):
@@ -136,6 +264,9 @@ def find_request(xp, **kwargs):
     Expression object or a string).
 
     Keyword arguments:
+    collection -- a RequestCollection; if specified, the xpath is
+                  evaluated locally against it (no http request is
+                  issued) (default: None)
     **kwargs -- optional parameters for the http request
 
     """
@@ -146,6 +277,28 @@ def find_request(xp, **kwargs):
     return _find(path, xp, tag_class, **kwargs)
 
 
+def iterfind_request(xp, page_size=0, **kwargs):
+    """Yields RORequest objects which match the xpath.
+
+    In contrast to find_request the response is parsed incrementally,
+    which keeps the memory usage flat (unless the response is validated
+    against a schema, see _iterfind).
+    xp is the xpath which is used for the search (either an
+    Expression object or a string).
+
+    Keyword arguments:
+    page_size -- if > 0, the results are requested in pages of
+                 page_size entries (default: 0)
+    **kwargs -- optional parameters for the http request
+
+    """
+    path = '/search/request'
+    if 'schema' not in kwargs:
+        kwargs['schema'] = RequestCollection.SCHEMA
+    tag_class = {'collection': RequestCollection, 'request': RORequest}
+    return _iterfind(path, xp, 'request', tag_class, page_size, **kwargs)
+
+
 def find_project(xp, **kwargs):
     """Returns a ProjectCollection with objects which match the xpath.
 
@@ -153,6 +306,9 @@ def find_project(xp, **kwargs):
     Expression object or a string).
 
     Keyword arguments:
+    collection -- a ProjectCollection; if specified, the xpath is
+                  evaluated locally against it (no http request is
+                  issued) (default: None)
     **kwargs -- optional parameters for the http request
 
     """
@@ -163,6 +319,28 @@ def find_project(xp, **kwargs):
     return _find(path, xp, tag_class, **kwargs)
 
 
+def iterfind_project(xp, page_size=0, **kwargs):
+    """Yields ROProject objects which match the xpath.
+
+    In contrast to find_project the response is parsed incrementally,
+    which keeps the memory usage flat (unless the response is validated
+    against a schema, see _iterfind).
+    xp is the xpath which is used for the search (either an
+    Expression object or a string).
+
+    Keyword arguments:
+    page_size -- if > 0, the results are requested in pages of
+                 page_size entries (default: 0)
+    **kwargs -- optional parameters for the http request
+
+    """
+    path = '/search/project'
+    if 'schema' not in kwargs:
+        kwargs['schema'] = ProjectCollection.SCHEMA
+    tag_class = {'collection': ProjectCollection, 'project': ROProject}
+    return _iterfind(path, xp, 'project', tag_class, page_size, **kwargs)
+
+
 def find_package(xp, **kwargs):
     """Returns a PackageCollection with objects which match the xpath.
 
@@ -170,6 +348,9 @@ def find_package(xp, **kwargs):
     Expression object or a string).
 
     Keyword arguments:
+    collection -- a PackageCollection; if specified, the xpath is
+                  evaluated locally against it (no http request is
+                  issued) (default: None)
     **kwargs -- optional parameters for the http request
 
     """
@@ -178,3 +359,25 @@ def find_package(xp, **kwargs):
         kwargs['schema'] = PackageCollection.SCHEMA
     tag_class = {'collection': PackageCollection, 'package': ROPackage}
     return _find(path, xp, tag_class, **kwargs)
+
+
+def iterfind_package(xp, page_size=0, **kwargs):
+    """Yields ROPackage objects which match the xpath.
+
+    In contrast to find_package the response is parsed incrementally,
+    which keeps the memory usage flat (unless the response is validated
+    against a schema, see _iterfind).
+    xp is the xpath which is used for the search (either an
+    Expression object or a string).
+
+    Keyword arguments:
+    page_size -- if > 0, the results are requested in pages of
+                 page_size entries (default: 0)
+    **kwargs -- optional parameters for the http request
+
+    """
+    path = '/search/package'
+    if 'schema' not in kwargs:
+        kwargs['schema'] = PackageCollection.SCHEMA
+    tag_class = {'collection': PackageCollection, 'package': ROPackage}
+    return _iterfind(path, xp, 'package', tag_class, page_size, **kwargs)
@@ -1,7 +1,7 @@
 """Provides classes to access the source
 route"""
 
-from osc2.util.xml import fromstring, OscElement
+from osc2.util.xml import get_parser, OscElement
 from osc2.remote import RORemoteFile
 from osc2.core import Osc
 
@@ -77,8 +77,9 @@ class Project(object):
         path = '/source/' + self.name
         if 'schema' not in kwargs:
             kwargs['schema'] = Project.LIST_SCHEMA
-        f = request.get(path, **kwargs)
-        entries = fromstring(f.read())
+        kwargs.setdefault('cache', True)
+        f = request.get(path, parser=get_parser(), **kwargs)
+        entries = f.xml
         r = []
         # using an xml representation for the <entry /> makes no
         # sense
@@ -86,6 +87,24 @@ class Project(object):
             r.append(Package(self.name, e.get('name')))
         return r
 
+    def info(self, **kwargs):
+        """Returns the source info of all packages in this project.
+
+        A list of <sourceinfo /> elements is returned (each element
+        has a package and a srcmd5 attribute, for instance).
+        A single request is needed to retrieve the srcmd5 of all
+        packages.
+
+        Keyword arguments:
+        **kwargs -- optional parameters for the http request
+
+        """
+        request = Osc.get_osc().get_reqobj()
+        path = '/source/' + self.name
+        kwargs.setdefault('cache', True)
+        f = request.get(path, parser=get_parser(), view='info', **kwargs)
+        return list(f.xml.iterfind('sourceinfo'))
+
 
 class Package(object):
     """Class used to access /source/project/package data"""
@@ -117,13 +136,27 @@ class Package(object):
         path = "/source/%s/%s" % (self.project, self.name)
         if 'schema' not in kwargs:
             kwargs['schema'] = Package.LIST_SCHEMA
-        f = request.get(path, **kwargs)
-        directory = fromstring(f.read(), directory=Directory, entry=File,
-                               linkinfo=Linkinfo)
+        parser = get_parser(directory=Directory, entry=File,
+                            linkinfo=Linkinfo)
+        kwargs.setdefault('cache', True)
+        f = request.get(path, parser=parser, **kwargs)
+        directory = f.xml
         # this is needed by the file class
         directory.set('project', self.project)
         return directory
 
+    def list_async(self, **kwargs):
+        """List all files for this package without blocking.
+
+        A osc2.util.pool.Future object is returned, whose result is
+        the return value of the list method.
+        Keyword arguments:
+        **kwargs -- optional parameters for the http request
+
+        """
+        request = Osc.get_osc().get_async_reqobj()
+        return request.submit(self.list, **kwargs)
+
     def log(self, **kwargs):
         """Get the commit log.
 
@@ -135,5 +168,5 @@ class Package(object):
         path = "/source/%s/%s/_history" % (self.project, self.name)
         if 'schema' not in kwargs:
             kwargs['schema'] = Package.HISTORY_SCHEMA
-        f = request.get(path, **kwargs)
-        return fromstring(f.read())
+        f = request.get(path, parser=get_parser(), **kwargs)
+        return f.xml
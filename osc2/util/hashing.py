@@ -0,0 +1,158 @@
+"""Provides functions to compute the md5sums of files.
+
+The md5sums of many files can be computed concurrently by a MD5Hasher
+object (either in a thread pool or in a process pool). By default, the
+working copy code shares a single MD5Hasher object (see default_hasher).
+
+Example usage:
+ hasher = MD5Hasher(workers=4)
+ md5s = hasher.md5sums(filenames)
+ print md5s[filenames[0]]
+
+"""
+
+import os
+import mmap
+import hashlib
+import threading
+import multiprocessing
+
+from osc2.util.pool import ThreadPool
+
+__all__ = ['file_md5', 'MD5Hasher', 'default_hasher']
+
+# files which are smaller than this are read instead of mmap'ed
+MMAP_THRESHOLD = 64 * 1024
+
+_default_hasher = None
+_default_hasher_lock = threading.Lock()
+
+# number of bytes which are read at once (a small buffer is reused by
+# the allocator and does not evict the cache)
+_READ_SIZE = 1024 * 1024
+
+# number of bytes of a mmap'ed file which are passed to a single md5
+# update call (the GIL is released during the update)
+_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def file_md5(filename, use_mmap=False):
+    """Returns the md5sum of filename's content.
+
+    A ValueError is raised if filename does not exist or is no file.
+
+    Keyword arguments:
+    use_mmap -- mmap large files (this avoids copying the data into a
+                userspace buffer); only use it for files which are not
+                modified concurrently, because the process is killed by
+                a SIGBUS if the file is truncated (default: False)
+
+    """
+    if not os.path.isfile(filename):
+        msg = "filename \"%s\" does not exist or is no file" % filename
+        raise ValueError(msg)
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not use_mmap or size < MMAP_THRESHOLD:
+            data = f.read(_READ_SIZE)
+            while data:
+                md5.update(data)
+                data = f.read(_READ_SIZE)
+            return md5.hexdigest()
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(0, len(mm), _CHUNK_SIZE):
+                md5.update(buffer(mm, offset, _CHUNK_SIZE))
+        finally:
+            mm.close()
+    return md5.hexdigest()
+
+
+def default_hasher():
+    """Returns the MD5Hasher object, which is shared by default.
+
+    It is created on demand (with the default number of workers).
+
+    """
+    global _default_hasher
+    with _default_hasher_lock:
+        if _default_hasher is None:
+            _default_hasher = MD5Hasher()
+        return _default_hasher
+
+
+class MD5Hasher(object):
+    """Computes the md5sums of many files concurrently.
+
+    By default, a thread pool is used (hashlib releases the GIL while
+    it hashes the data). Alternatively, a process pool can be used.
+    The process pool is created by the constructor, because forking a
+    process while other threads are running may deadlock the child
+    (hence, construct such a hasher before any threads are started
+    and close it, if it is not needed anymore). The thread pool is
+    shared by all md5sums calls, so that at most workers files are
+    hashed concurrently, even if md5sums is called by several threads.
+
+    """
+
+    def __init__(self, workers=4, processes=False):
+        """Constructs a new MD5Hasher object.
+
+        A ValueError is raised if workers is less than 1.
+
+        Keyword arguments:
+        workers -- number of files which are hashed concurrently
+                   (default: 4)
+        processes -- use a process pool instead of a thread pool; the
+                     worker processes are forked immediately
+                     (default: False)
+
+        """
+        super(MD5Hasher, self).__init__()
+        if workers < 1:
+            raise ValueError('workers must be greater than 0')
+        self.workers = workers
+        self.processes = processes
+        self._pool = None
+        self._lock = threading.Lock()
+        if processes:
+            self._pool = multiprocessing.Pool(workers)
+
+    def close(self):
+        """Terminates the worker processes (if any).
+
+        Afterwards, md5sums must not be called anymore (the thread pool
+        needs no cleanup, because it consists of daemon threads).
+
+        """
+        with self._lock:
+            if self.processes and self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def _thread_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # the worker threads are started on demand
+                self._pool = ThreadPool(self.workers)
+            return self._pool
+
+    def md5sums(self, filenames):
+        """Returns a dict, which maps each filename to its md5sum.
+
+        If a file does not exist or is no file, a ValueError is raised
+        (see file_md5).
+
+        """
+        filenames = list(set(filenames))
+        if len(filenames) <= 1 or self.workers == 1:
+            md5s = [file_md5(filename) for filename in filenames]
+        elif self.processes:
+            if self._pool is None:
+                raise ValueError('hasher is closed')
+            md5s = self._pool.map(file_md5, filenames)
+        else:
+            md5s = self._thread_pool().map(file_md5, filenames)
+        return dict(zip(filenames, md5s))
@@ -6,7 +6,12 @@ Additionally it provides some convenience methods.
 """
 
 import os
+import stat
+import errno
+import fcntl
 import shutil
+import ctypes
+import ctypes.util
 from tempfile import NamedTemporaryFile, mkdtemp as orig_mkdtemp
 
 from osc2.util.delegation import StringifiedDelegator, Delegator
@@ -15,18 +20,181 @@ from osc2.util.delegation import StringifiedDelegator, Delegator
 __all__ = ['copy_file', 'iter_read']
 
 
+# ioctl request number of FICLONE (_IOW(0x94, 9, int), see ioctl_ficlone(2))
+_FICLONE = 0x40049409
+
+# errnos which indicate that a kernel-assisted copy is not supported for
+# the given fds (in this case, we fall back to the buffered copy)
+_FALLBACK_ERRNOS = (errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EBADF,
+                    errno.EOPNOTSUPP, errno.ENOTTY, errno.ETXTBSY,
+                    errno.EPERM)
+
+# max number of bytes that are copied by a single syscall
+_MAX_CHUNK = 1024 * 1024 * 1024
+
+
+def _load_libc_copy_func(name, argtypes):
+    """Returns a wrapper for the libc function name or None.
+
+    argtypes are the ctypes argtypes of the function. The
+    returned wrapper raises an OSError if the function fails.
+    None is returned if libc does not provide the function.
+
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = argtypes
+    func.restype = ctypes.c_ssize_t
+
+    def call(*args):
+        ret = func(*args)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+    return call
+
+
+def _load_sendfile():
+    """Returns a sendfile(out_fd, in_fd, count) callable or None."""
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is not None:
+        return lambda out_fd, in_fd, count: sendfile(out_fd, in_fd, None,
+                                                     count)
+    func = _load_libc_copy_func('sendfile', (ctypes.c_int, ctypes.c_int,
+                                             ctypes.c_void_p,
+                                             ctypes.c_size_t))
+    if func is None:
+        return None
+    return lambda out_fd, in_fd, count: func(out_fd, in_fd, None, count)
+
+
+def _load_copy_file_range():
+    """Returns a copy_file_range(out_fd, in_fd, count) callable or None."""
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is not None:
+        return lambda out_fd, in_fd, count: copy_file_range(in_fd, out_fd,
+                                                            count)
+    func = _load_libc_copy_func('copy_file_range',
+                                (ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                                 ctypes.c_void_p, ctypes.c_size_t,
+                                 ctypes.c_uint))
+    if func is None:
+        return None
+    return lambda out_fd, in_fd, count: func(in_fd, None, out_fd, None,
+                                             count, 0)
+
+
+# kernel-assisted copy functions (tried in this order); the list can
+# be cleared in order to disable the fast path
+_KERNEL_COPY_FUNCS = [f for f in (_load_copy_file_range(), _load_sendfile())
+                      if f is not None]
+
+
+def _reflink(src_fd, dst_fd):
+    """Clones the complete src_fd into dst_fd (FICLONE).
+
+    Return True if the reflink was successfully created and
+    False if the filesystem does not support reflinks.
+
+    """
+    try:
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+    except (IOError, OSError) as e:
+        if e.errno not in _FALLBACK_ERRNOS:
+            raise
+        return False
+    return True
+
+
+def _kernel_copy(src_fd, dst_fd, size):
+    """Copies size bytes from src_fd to dst_fd without userspace buffers.
+
+    If size is -1, everything until EOF is copied. The copy starts at the
+    current offsets of src_fd and dst_fd.
+    Return the number of copied bytes or None if no kernel-assisted
+    copy is possible (in this case, nothing was copied).
+
+    """
+    for func in _KERNEL_COPY_FUNCS:
+        copied = 0
+        try:
+            while size == -1 or copied < size:
+                count = _MAX_CHUNK
+                if size > -1:
+                    count = min(count, size - copied)
+                ret = func(dst_fd, src_fd, count)
+                if not ret:
+                    break
+                copied += ret
+        except OSError as e:
+            if copied or e.errno not in _FALLBACK_ERRNOS:
+                raise
+            continue
+        return copied
+    return None
+
+
+def _fast_copy_file(fsource_obj, fdest_obj, size, clone=False):
+    """Copies fsource_obj to fdest_obj in the kernel (if possible).
+
+    fsource_obj and fdest_obj have to be file objects. The data is
+    copied from the current position of fsource_obj to the current
+    position of fdest_obj (afterwards, both file objects are positioned
+    after the copied data).
+    Return True if the data was copied, otherwise False is returned
+    (in this case, both file objects are left untouched).
+
+    Keyword arguments:
+    clone -- try to reflink the source file (only used if fdest_obj is
+             empty and everything is copied) (default: False)
+
+    """
+    if not isinstance(fsource_obj, file) or not isinstance(fdest_obj, file):
+        return False
+    src_fd = fsource_obj.fileno()
+    dst_fd = fdest_obj.fileno()
+    if not stat.S_ISREG(os.fstat(src_fd).st_mode):
+        return False
+    fdest_obj.flush()
+    src_pos = fsource_obj.tell()
+    dst_pos = fdest_obj.tell()
+    os.lseek(src_fd, src_pos, os.SEEK_SET)
+    os.lseek(dst_fd, dst_pos, os.SEEK_SET)
+    if (clone and size == -1 and src_pos == 0 and dst_pos == 0
+            and _reflink(src_fd, dst_fd)):
+        copied = os.fstat(src_fd).st_size
+        os.lseek(dst_fd, copied, os.SEEK_SET)
+    else:
+        copied = _kernel_copy(src_fd, dst_fd, size)
+    if copied is None:
+        fsource_obj.seek(src_pos, os.SEEK_SET)
+        return False
+    # resync the file objects with the fds' offsets
+    fsource_obj.seek(src_pos + copied, os.SEEK_SET)
+    fdest_obj.seek(dst_pos + copied, os.SEEK_SET)
+    return True
+
+
 def _copy_file(fsource_obj, fdest_obj, bufsize, size,
-               read_method, write_method):
+               read_method, write_method, clone=False, hashes=()):
     """Read from fsource_obj and write to fdest_obj"""
+    # the kernel-assisted copy cannot be used if the data has to be hashed
+    if (not hashes and read_method == 'read' and write_method == 'write'
+            and _fast_copy_file(fsource_obj, fdest_obj, size, clone)):
+        return
     write = getattr(fdest_obj, write_method)
     for data in iter_read(fsource_obj, bufsize=bufsize, size=size,
-                          read_method=read_method):
+                          read_method=read_method, hashes=hashes):
         write(data)
 
 
 def copy_file(source, dest, mode=0644, mtime=None, bufsize=8096,
               size=-1, uid=-1, gid=-1, read_method='read',
-              write_method='write'):
+              write_method='write', hashes=()):
     """Copy a file source to file dest.
 
     source is a file-like object or a filename.
@@ -37,6 +205,12 @@ def copy_file(source, dest, mode=0644, mtime=None, bufsize=8096,
     be closed.
     No error is raised if the user has insufficient permissions
     to set uid or gid.
+    If the data is copied from a file to a file (either passed as
+    filenames or as real file objects), the copy is done in the kernel
+    (reflink, copy_file_range or sendfile), if possible. Otherwise, the
+    data is copied in chunks of bufsize bytes.
+    Return a list which contains the hexdigest of each hash object
+    in hashes (in the same order).
 
     Keyword arguments:
     mode -- the mode of file dest (default: 0644)
@@ -54,6 +228,8 @@ def copy_file(source, dest, mode=0644, mtime=None, bufsize=8096,
     write_method -- name of the method which should be called on
                     the source file-like object to perform a read
                     (default: write)
+    hashes -- list of hash objects (for instance, hashlib.md5()), which
+              are updated with the copied data (default: ())
 
     mode and mtime are only used if dest is a filename.
 
@@ -70,8 +246,8 @@ def copy_file(source, dest, mode=0644, mtime=None, bufsize=8096,
         dest_flike = True
     if source_flike and dest_flike:
         _copy_file(fsource_obj, fdest_obj, bufsize,
-                   size, read_method, write_method)
-        return
+                   size, read_method, write_method, hashes=hashes)
+        return [h.hexdigest() for h in hashes]
     if not source_flike and not os.path.isfile(source):
         raise ValueError("source \"%s\" is no file" % source)
     if not dest_flike:
@@ -98,8 +274,13 @@ def copy_file(source, dest, mode=0644, mtime=None, bufsize=8096,
             fdest_obj = NamedTemporaryFile(dir=dirname, prefix=filename,
                                            delete=False)
             tmp_filename = fdest_obj.name
-        _copy_file(fsource_obj, fdest_obj, bufsize,
-                   size, read_method, write_method)
+        fdest = fdest_obj
+        if tmp_filename:
+            # unwrap the tmpfile so that the kernel-assisted copy can be
+            # used (a caller supplied dest object is never unwrapped)
+            fdest = fdest_obj.file
+        _copy_file(fsource_obj, fdest, bufsize, size, read_method,
+                   write_method, clone=not source_flike, hashes=hashes)
         if tmp_filename:
             fdest_obj.flush()
             os.rename(tmp_filename, dest)
@@ -123,9 +304,11 @@ def copy_file(source, dest, mode=0644, mtime=None, bufsize=8096,
         if mtime is not None:
             os.utime(dest, (-1, mtime))
         os.chmod(dest, mode)
+    return [h.hexdigest() for h in hashes]
 
 
-def iter_read(fsource, bufsize=8096, size=-1, read_method='read'):
+def iter_read(fsource, bufsize=8096, size=-1, read_method='read',
+              hashes=()):
     """Iterate over fsource and yield at most bufsize bytes.
 
     source is a file-like object or a filename.
@@ -140,6 +323,9 @@ def iter_read(fsource, bufsize=8096, size=-1, read_method='read'):
     read_method -- name of the method which should be called on
                    the source file-like object to perform a read
                    (default: read)
+    hashes -- list of hash objects (for instance, hashlib.md5()), which
+              are updated with each chunk before it is yielded
+              (default: ())
 
     """
     fsource_obj = None
@@ -158,6 +344,8 @@ def iter_read(fsource, bufsize=8096, size=-1, read_method='read'):
             rsize = size
         data = read(rsize)
         while data:
+            for h in hashes:
+                h.update(data)
             yield data
             size -= len(data)
             if size == 0:
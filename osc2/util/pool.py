@@ -0,0 +1,238 @@
+"""Provides a simple thread pool and futures.
+
+Example usage:
+ with ThreadPool(max_workers=4) as pool:
+     futures = [pool.submit(hash_file, fname) for fname in filenames]
+     for future in as_completed(futures):
+         print future.result()
+
+"""
+
+import sys
+import logging
+import threading
+import Queue
+
+__all__ = ['Future', 'ThreadPool', 'as_completed', 'wait_all']
+
+
+def logger():
+    """Returns a logging.Logger object."""
+    return logging.getLogger(__name__)
+
+
+class Future(object):
+    """Represents the result of an asynchronous computation."""
+
+    def __init__(self):
+        super(Future, self).__init__()
+        self._cond = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        """Returns True if the computation is finished, otherwise False."""
+        with self._cond:
+            return self._done
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise RuntimeError('timeout')
+
+    def result(self, timeout=None):
+        """Returns the result of the computation.
+
+        If the computation raised an exception, it is reraised.
+        The call blocks until the computation is finished (or timeout
+        seconds elapsed; in this case a RuntimeError is raised).
+
+        Keyword arguments:
+        timeout -- number of seconds to wait (default: None)
+
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Returns the exception raised by the computation (or None).
+
+        Keyword arguments:
+        timeout -- see result (default: None)
+
+        """
+        self._wait(timeout)
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def add_done_callback(self, fn):
+        """Calls fn with the future if the computation is finished.
+
+        If the computation is already finished, fn is called immediately.
+        An exception, which is raised by fn, is logged and ignored if fn
+        is called when the computation finishes.
+
+        """
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, result, exc_info):
+        with self._cond:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            self._cond.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                # do not kill the worker thread (and do not skip the
+                # remaining callbacks)
+                logger().exception('exception in done callback %r', fn)
+
+    def set_result(self, result):
+        """Sets the result of the computation."""
+        self._finish(result, None)
+
+    def set_exception(self, exc_info):
+        """Sets the exception of the computation.
+
+        exc_info is a tuple as returned by sys.exc_info().
+
+        """
+        self._finish(None, exc_info)
+
+
+class ThreadPool(object):
+    """Executes callables in a fixed number of worker threads.
+
+    The worker threads are started on demand.
+
+    """
+
+    def __init__(self, max_workers=8):
+        """Constructs a new ThreadPool object.
+
+        A ValueError is raised if max_workers is less than 1.
+
+        Keyword arguments:
+        max_workers -- maximum number of worker threads (default: 8)
+
+        """
+        super(ThreadPool, self).__init__()
+        if max_workers < 1:
+            raise ValueError('max_workers must be greater than 0')
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        # number of submitted but not yet finished callables
+        self._pending = 0
+        self._shutdown = False
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.put(None)
+                return
+            future, fn, args, kwargs = item
+            try:
+                try:
+                    result = fn(*args, **kwargs)
+                except:
+                    future.set_exception(sys.exc_info())
+                else:
+                    future.set_result(result)
+            finally:
+                del item, future
+                with self._lock:
+                    self._pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules fn(*args, **kwargs) and returns a Future object.
+
+        A RuntimeError is raised if the pool was already shut down.
+
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('pool is shut down')
+            self._pending += 1
+            if len(self._threads) < min(self._pending, self.max_workers):
+                t = threading.Thread(target=self._worker)
+                t.daemon = True
+                self._threads.append(t)
+                t.start()
+            self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def map(self, fn, *iterables):
+        """Returns the results of fn for each item (in order).
+
+        Like the builtin map, but the calls are executed in the pool.
+
+        """
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        """Shuts down the pool.
+
+        The already submitted callables are still executed.
+
+        Keyword arguments:
+        wait -- wait until all worker threads are finished (default: True)
+
+        """
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = self._threads[:]
+        self._queue.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+def as_completed(futures):
+    """Yields each future in futures as soon as it is finished."""
+    queue = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(queue.put)
+    for _ in futures:
+        yield queue.get()
+
+
+def wait_all(futures):
+    """Waits until all futures are finished and returns their results.
+
+    If a computation raised an exception, the first exception is
+    reraised (after all futures are finished).
+
+    """
+    futures = list(futures)
+    for future in futures:
+        future.exception()
+    return [future.result() for future in futures]
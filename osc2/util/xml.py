@@ -1,10 +1,78 @@
 """xml utility functions"""
 
-from collections import Sequence
+import os
+import threading
+from collections import Sequence, OrderedDict
 
 from lxml import etree, objectify
 
-__all__ = ['ElementClassLookup', 'get_parser']
+__all__ = ['ElementClassLookup', 'get_parser', 'get_schema', 'assert_valid']
+
+
+class _XPathCache(object):
+    """LRU cache for compiled xpath expressions.
+
+    An entry is keyed by the xpath expression string. If first is True,
+    the expression is compiled so that its evaluation stops at the first
+    match (in document order).
+
+    """
+
+    def __init__(self, maxsize=256):
+        """Constructs a new _XPathCache object.
+
+        Keyword arguments:
+        maxsize -- maximum number of cached xpath objects (default: 256)
+
+        """
+        super(_XPathCache, self).__init__()
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._xpaths = OrderedDict()
+
+    def get(self, xp, first=False):
+        """Returns a compiled xpath object for expression xp.
+
+        None is returned if first is True and xp cannot be restricted
+        to its first match.
+
+        Keyword arguments:
+        first -- if True, the expression only returns the first match
+                 (default: False)
+
+        """
+        key = (xp, first)
+        with self._lock:
+            if key in self._xpaths:
+                xpath = self._xpaths.pop(key)
+                self._xpaths[key] = xpath
+                return xpath
+        if first:
+            try:
+                xpath = etree.XPath('(%s)[1]' % xp)
+            except etree.XPathSyntaxError:
+                xpath = None
+        else:
+            xpath = etree.XPath(xp)
+        self.put(xp, xpath, first)
+        return xpath
+
+    def put(self, xp, xpath, first=False):
+        """Adds or replaces the cache entry for expression xp."""
+        key = (xp, first)
+        with self._lock:
+            self._xpaths.pop(key, None)
+            self._xpaths[key] = xpath
+            while len(self._xpaths) > self._maxsize:
+                self._xpaths.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        with self._lock:
+            self._xpaths.clear()
+
+
+_xpath_cache = _XPathCache()
 
 
 class XPathFindMixin:
@@ -15,10 +83,22 @@ class XPathFindMixin:
     inherits from ElementBase, whose __init__ must not be
     overriden by subclasses (see comment in lxml/classlookup.pxi).
 
+    The compiled xpath expressions are cached.
+
     """
 
     def find(self, xp):
-        elms = self.findall(xp)
+        xpath = _xpath_cache.get(xp, first=True)
+        elms = None
+        if xpath is not None:
+            try:
+                elms = xpath(self)
+            except etree.XPathEvalError:
+                # do not try this again
+                _xpath_cache.put(xp, None, first=True)
+                xpath = None
+        if xpath is None:
+            elms = self.findall(xp)
         if isinstance(elms, Sequence):
             if elms:
                 return elms[0]
@@ -27,7 +107,7 @@ class XPathFindMixin:
         return elms
 
     def findall(self, xp):
-        return self.xpath(xp)
+        return _xpath_cache.get(xp)(self)
 
 
 class OscElement(XPathFindMixin, objectify.ObjectifiedElement):
@@ -64,6 +144,10 @@ class ElementClassLookup(etree.PythonElementClassLookup):
         return None
 
 
+# per thread parser cache (see get_parser)
+_parsers = threading.local()
+
+
 def get_parser(tree_class=None, empty_data_class=None,
                lookup_class=ElementClassLookup, **tag_class):
     """Returns an objectify parser object.
@@ -79,10 +163,22 @@ def get_parser(tree_class=None, empty_data_class=None,
     lookup_class -- class which is used for the element lookup
                     (default: ElementClassLookup)
 
+    The parser objects are memoized per thread (a parser must not be
+    used by more than one thread at the same time), that is subsequent
+    calls with the same arguments return the same parser object.
+
     """
-    parser = objectify.makeparser()
-    lookup = lookup_class(tree_class, empty_data_class, **tag_class)
-    parser.set_element_class_lookup(lookup)
+    key = (tree_class, empty_data_class, lookup_class,
+           frozenset(tag_class.iteritems()))
+    parsers = getattr(_parsers, 'parsers', None)
+    if parsers is None:
+        parsers = _parsers.parsers = {}
+    parser = parsers.get(key)
+    if parser is None:
+        parser = objectify.makeparser()
+        lookup = lookup_class(tree_class, empty_data_class, **tag_class)
+        parser.set_element_class_lookup(lookup)
+        parsers[key] = parser
     return parser
 
 
@@ -100,3 +196,82 @@ def fromstring(data, parser=None, **kwargs):
     if parser is None:
         parser = get_parser(**kwargs)
     return objectify.fromstring(data, parser=parser)
+
+
+class _SchemaCache(object):
+    """Process-wide cache for compiled schema objects.
+
+    Compiling a RelaxNG or XMLSchema schema is expensive, therefore each
+    schema file is compiled only once. An entry is keyed by the absolute
+    path of the schema file and is recompiled if the file's mtime changes.
+
+    """
+
+    def __init__(self):
+        super(_SchemaCache, self).__init__()
+        self._lock = threading.Lock()
+        # abspath => (mtime, schema, lock)
+        self._schemas = {}
+
+    def _schema_class(self, filename):
+        if filename.endswith('.rng'):
+            return etree.RelaxNG
+        elif filename.endswith('.xsd'):
+            return etree.XMLSchema
+        raise ValueError('unsupported schema file')
+
+    def entry(self, filename):
+        """Returns a (schema, lock) tuple for the schema file filename.
+
+        The lock has to be held while the schema is used for a validation
+        (a schema object stores the errors of the last validation).
+        A ValueError is raised if filename is no RelaxNG or XMLSchema
+        file.
+
+        """
+        schema_class = self._schema_class(filename)
+        key = os.path.abspath(filename)
+        mtime = os.stat(key).st_mtime
+        with self._lock:
+            entry = self._schemas.get(key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1:]
+        # compile outside the lock (if two threads compile the same
+        # schema concurrently, the last one wins - which does not harm)
+        entry = (mtime, schema_class(file=filename), threading.Lock())
+        with self._lock:
+            self._schemas[key] = entry
+        return entry[1:]
+
+    def clear(self):
+        """Removes all compiled schemas from the cache."""
+        with self._lock:
+            self._schemas.clear()
+
+
+_schema_cache = _SchemaCache()
+
+
+def get_schema(filename):
+    """Returns a compiled schema object for the schema file filename.
+
+    The schema is compiled only once (unless the schema file is modified)
+    and shared by all threads. Supported schema files are RelaxNG (.rng)
+    and XMLSchema (.xsd) files (a ValueError is raised otherwise).
+    Note: use assert_valid if the schema is used by several threads.
+
+    """
+    return _schema_cache.entry(filename)[0]
+
+
+def assert_valid(filename, root):
+    """Validates the element or tree root against the schema file filename.
+
+    An etree.DocumentInvalid exception is raised if root is invalid.
+    A ValueError is raised if filename is no supported schema file
+    (see get_schema).
+
+    """
+    schema, lock = _schema_cache.entry(filename)
+    with lock:
+        schema.assertValid(root)
@@ -8,6 +8,10 @@ This module is mainly inspired by https://github.com/jnicklas/xpath
 
 """
 
+import re
+
+from lxml import etree
+
 
 def children(minimum, maximum):
     """Decorator which checks the number of an expression's children.
@@ -48,6 +52,42 @@ def no_dummy(f):
     return checker
 
 
+def cached_string(f):
+    """Decorator which caches the result of a tostring method.
+
+    The cached string is invalidated if the expression or one of
+    its descendants is modified (see Tree._version).
+
+    """
+    def tostring(self):
+        # read the version before the string is computed (a tree
+        # operation, which runs meanwhile, invalidates the result)
+        version = self._version
+        cached = self._string
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        res = f(self)
+        self._string = (version, res)
+        return res
+    tostring.func_name = f.func_name
+    return tostring
+
+
+def literal_tostring(literal):
+    """Returns the xpath representation of literal.
+
+    If the literal is a string (it is treated as a string if it
+    has a "upper" attribute/method (this was arbitrarily chosen))
+    it sourrunded with "". Otherwise its str representation is
+    returned.
+
+    """
+    if hasattr(literal, 'upper'):
+        # treat it as a string
+        return "\"%s\"" % str(literal)
+    return str(literal)
+
+
 class XPathSyntaxError(SyntaxError):
     """Raised if the expression tree is (syntactically) invalid."""
     pass
@@ -107,6 +147,15 @@ class XPathBuilder(object):
         kwargs.setdefault('in_pred', True)
         return self._factory.create_AttributeExpression(*args, **kwargs)
 
+    def var(self, name):
+        """Returns a new VariableExpression object.
+
+        name is the name of the xpath variable ($name). The value
+        is bound when the expression is evaluated (see XPathTemplate).
+
+        """
+        return self._factory.create_VariableExpression(name)
+
     def dummy(self):
         """Returns a new DummyExpression object.
 
@@ -209,6 +258,16 @@ class XPathFactory(object):
         kwargs.setdefault('factory', self)
         return LiteralExpression(*args, **kwargs)
 
+    def create_VariableExpression(self, *args, **kwargs):
+        """Constructs a new VariableExpression object.
+
+        *args and **kwargs are additional arguments for the
+        VariableExpression's __init__ method.
+
+        """
+        kwargs.setdefault('factory', self)
+        return VariableExpression(*args, **kwargs)
+
     def create_GeneratorPathDelegate(self, *args, **kwargs):
         """Constructs a new GeneratorPathDelegate object.
 
@@ -296,9 +355,14 @@ class Tree(object):
     In the tree mode it is guaranteed that only the methods and
     attributes which are defined in this class will be invoked
     (except if a subclass modified these methods).
+    If the children of a node are modified, the _version attribute of
+    the node and its ancestors is incremented. It is used to invalidate
+    cached data that depends on the structure of the node's subtree.
 
     """
 
+    _version = 0
+
     def tree_op():
         """Decorator which is used to decorate all tree methods.
 
@@ -359,6 +423,9 @@ class Tree(object):
         """
         self._children.append(child)
         child.reparent(self)
+        # invalidate after the modification (otherwise, data that is
+        # computed meanwhile is cached as valid)
+        self._invalidate()
 
     @tree_op()
     def remove_child(self, child):
@@ -370,6 +437,14 @@ class Tree(object):
         if child in self._children:
             self._children.remove(child)
             child.reparent(None)
+            self._invalidate()
+
+    def _invalidate(self):
+        """Increments the version of self and all its ancestors."""
+        node = self
+        while node is not None:
+            node._version += 1
+            node = node._parent
 
     def tree_mode(self, on, obj):
         """Enables or disables the tree mode for this (self) object.
@@ -427,6 +502,8 @@ class Expression(Tree):
         """
         super(Expression, self).__init__(children)
         self._factory = factory
+        # (version, str) tuple (see cached_string)
+        self._string = None
 
     @no_dummy
     def log_and(self, expr):
@@ -638,6 +715,7 @@ class PathExpression(Expression):
     def __enter__(self):
         return self._factory.create_GeneratorPathDelegate(self)
 
+    @cached_string
     @children(0, 1)
     def tostring(self):
         res = ''
@@ -685,6 +763,7 @@ class AttributeExpression(Expression):
                                                        in_pred=self._in_pred,
                                                        children=[])
 
+    @cached_string
     def tostring(self):
         if self._in_pred:
             return '@' + self._name
@@ -700,10 +779,7 @@ class LiteralExpression(Expression):
         """Constructs a new LiteralExpression object.
 
         literal is the literal which should be represented
-        by this object. If the literal is a string (it is treated
-        as a string if it has a "upper" attribute/method (this was
-        arbitrarily chosen)) it sourrunded with "". Otherwise its
-        str representation is returned.
+        by this object (see literal_tostring).
         **kwargs are the arguments for the superclass'
         __init__ method.
 
@@ -711,12 +787,30 @@ class LiteralExpression(Expression):
         super(LiteralExpression, self).__init__(**kwargs)
         self._literal = literal
 
+    @cached_string
+    @children(0, 0)
+    def tostring(self):
+        return literal_tostring(self._literal)
+
+
+class VariableExpression(Expression):
+    """Represents a xpath variable reference ($name)."""
+
+    def __init__(self, name, **kwargs):
+        """Constructs a new VariableExpression object.
+
+        name is the name of the variable.
+        **kwargs are the arguments for the superclass'
+        __init__ method.
+
+        """
+        super(VariableExpression, self).__init__(**kwargs)
+        self._name = name
+
+    @cached_string
     @children(0, 0)
     def tostring(self):
-        if hasattr(self._literal, 'upper'):
-            # treat it as a string
-            return "\"%s\"" % str(self._literal)
-        return str(self._literal)
+        return '$' + self._name
 
 
 class PredicateExpression(PathExpression):
@@ -731,6 +825,7 @@ class PredicateExpression(PathExpression):
         """
         super(PredicateExpression, self).__init__('', **kwargs)
 
+    @cached_string
     @children(2, 2)
     def tostring(self):
         return "%s[%s]" % (self._children[0].tostring(),
@@ -753,6 +848,7 @@ class BinaryExpression(Expression):
         super(BinaryExpression, self).__init__(**kwargs)
         self._op = op
 
+    @cached_string
     @children(2, 2)
     def tostring(self):
         return "%s %s %s" % (self._children[0].tostring(), self._op,
@@ -785,6 +881,7 @@ class FunctionExpression(Expression):
             expr = self._expression_or_literal(p)
             self._params.append(expr)
 
+    @cached_string
     def tostring(self):
         res = ''
         if self._children:
@@ -808,6 +905,7 @@ class ParenthesizedExpression(Expression):
         """
         super(ParenthesizedExpression, self).__init__(**kwargs)
 
+    @cached_string
     @children(1, 1)
     def tostring(self):
         return "(%s)" % self._children[0].tostring()
@@ -874,3 +972,77 @@ class DummyExpression(object):
 
     def __nonzero__(self):
         return False
+
+
+class XPathTemplate(object):
+    """Represents an immutable (and hashable) xpath expression.
+
+    The expression might contain xpath variables (see XPathBuilder.var),
+    which are bound when the template is evaluated or serialized. The
+    expression is compiled only once.
+    Two templates are equal if their string representations are equal.
+
+    """
+
+    # a string literal or a variable reference
+    _TOKEN_RE = re.compile(r'("[^"]*"|\'[^\']*\'|\$[A-Za-z_][\w.-]*)')
+
+    def __init__(self, xp):
+        """Constructs a new XPathTemplate object.
+
+        xp is an Expression object or a str.
+
+        """
+        super(XPathTemplate, self).__init__()
+        if hasattr(xp, 'tostring'):
+            xp = xp.tostring()
+        self._xpath = xp
+        self._compiled = None
+
+    def tostring(self, **variables):
+        """String representation of the template.
+
+        The variables which are specified via **variables are replaced
+        by their literal value (see literal_tostring). All other
+        variable references are kept.
+
+        """
+        if not variables:
+            return self._xpath
+
+        def replace(match):
+            token = match.group(1)
+            if token.startswith('$') and token[1:] in variables:
+                return literal_tostring(variables[token[1:]])
+            return token
+        return self._TOKEN_RE.sub(replace, self._xpath)
+
+    def compile(self):
+        """Returns the compiled xpath (an etree.XPath object)."""
+        if self._compiled is None:
+            self._compiled = etree.XPath(self._xpath)
+        return self._compiled
+
+    def __call__(self, elm, **variables):
+        """Evaluates the template with elm as the context node.
+
+        **variables are the values of the xpath variables.
+
+        """
+        return self.compile()(elm, **variables)
+
+    def __eq__(self, other):
+        if not isinstance(other, XPathTemplate):
+            return NotImplemented
+        return self._xpath == other._xpath
+
+    def __ne__(self, other):
+        if not isinstance(other, XPathTemplate):
+            return NotImplemented
+        return self._xpath != other._xpath
+
+    def __hash__(self):
+        return hash(self._xpath)
+
+    def __str__(self):
+        return self._xpath
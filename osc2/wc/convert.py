@@ -1,4 +1,9 @@
-"""Convert old working copy format to the new format."""
+"""Convert old working copy format to the new format.
+
+Additionally, the store of a working copy can be converted to another
+store backend (see osc2.wc.store).
+
+"""
 
 import os
 
@@ -8,7 +13,9 @@ from osc2.wc.util import (wc_read_files, wc_pkg_data_filename, _storefile,
                           _write_storefile, _VERSION, wc_read_project,
                           _read_storefile, wc_read_packages,
                           missing_storepaths, wc_read_apiurl,
-                          wc_pkg_data_mkdir, _storedir)
+                          wc_pkg_data_mkdir, _storedir, wc_lock,
+                          wc_is_project, wc_is_package)
+from osc2.wc.store import get_store, STORES
 
 
 def convert_package(path, ext_storedir=None, **kwargs):
@@ -105,3 +112,53 @@ def convert_project(path, project='', apiurl='', **package_states):
         storedir = wc_pkg_data_mkdir(path, package)
         convert_package(package_path, project=project, package=package,
                         apiurl=apiurl, ext_storedir=storedir)
+
+
+def convert_store(path, backend):
+    """Convert the store of a working copy to another store backend.
+
+    path is the path to the project or package working copy and
+    backend is the name of the new store backend. If path is a
+    project working copy, the storedirs of its packages are converted,
+    too. A ValueError is raised if path is no working copy or if
+    backend is not supported.
+
+    """
+    if backend not in STORES:
+        raise ValueError("unsupported store backend \"%s\"" % backend)
+    if not wc_is_project(path) and not wc_is_package(path):
+        raise ValueError("path \"%s\" is no working copy" % path)
+    with wc_lock(path):
+        packages = []
+        if wc_is_project(path):
+            for entry in wc_read_packages(path):
+                storedir = wc_pkg_data_filename(path, entry.get('name'))
+                if os.path.isdir(storedir):
+                    packages.append((entry.get('name'), storedir))
+        _convert_storedir(_storedir(path), backend)
+        for package, storedir in packages:
+            pkg_path = os.path.join(path, package)
+            if not wc_is_package(pkg_path):
+                # missing or not materialized: nobody can lock it
+                _convert_storedir(storedir, backend)
+                continue
+            # the package wc might be used concurrently (Package objects
+            # lock the package wc and not the project wc)
+            with wc_lock(pkg_path):
+                _convert_storedir(storedir, backend)
+
+
+def _convert_storedir(storedir, backend):
+    """Convert the storefiles of storedir to the new backend.
+
+    The new store is completely populated before the old store is
+    removed (the new backend is selected as soon as the database
+    file exists or vanishes, respectively).
+
+    """
+    old = get_store(storedir)
+    if old.name == backend:
+        return
+    data = dict([(fname, old.read(fname)) for fname in old.filenames()])
+    STORES[backend].create(storedir, data)
+    old.destroy()
@@ -10,12 +10,15 @@ from difflib import unified_diff
 from lxml import etree
 
 from osc2.core import Osc
+from osc2.httpcache import ValidatorStore
 from osc2.source import File, Directory, Linkinfo
 from osc2.source import Package as SourcePackage
 from osc2.remote import RWLocalFile
 from osc2.util.xml import fromstring
 from osc2.util.io import copy_file
 from osc2.util.listinfo import ListInfo
+from osc2.util.pool import ThreadPool, as_completed
+from osc2.util.hashing import file_md5, default_hasher
 from osc2.wc.base import (WorkingCopy, UpdateStateMixin, CommitStateMixin,
                           FileConflictError, PendingTransactionError,
                           no_pending_transaction)
@@ -25,27 +28,12 @@ from osc2.wc.util import (wc_read_package, wc_read_project, wc_read_apiurl,
                           missing_storepaths, WCInconsistentError,
                           wc_pkg_data_filename, XMLTransactionState,
                           wc_diff_mkdir, _storedir, _PKG_DATA,
-                          wc_verify_format, wc_write_version)
+                          wc_verify_format, wc_write_version,
+                          wc_store_transaction)
 
-
-def file_md5(filename):
-    """Return the md5sum of filename's content.
-
-    A ValueError is raised if filename does not exist or
-    is no file.
-
-    """
-    if not os.path.isfile(filename):
-        msg = "filename \"%s\" does not exist or is no file" % filename
-        raise ValueError(msg)
-    bufsize = 1024 * 1024
-    md5 = hashlib.md5()
-    with open(filename, 'rb') as f:
-        data = f.read(bufsize)
-        while data:
-            md5.update(data)
-            data = f.read(bufsize)
-    return md5.hexdigest()
+# validators of the "rev=latest" listings (see Package.latest_revision);
+# only the listings of the most recently used packages are kept
+_latest_validators = ValidatorStore(maxsize=64)
 
 
 def is_binaryfile(filename):
@@ -477,7 +465,8 @@ class Package(WorkingCopy):
     """Represents a package working copy."""
 
     def __init__(self, path, skip_handlers=None, commit_policies=None,
-                 merge_class=Merge, verify_format=True, **kwargs):
+                 merge_class=Merge, verify_format=True, upload_workers=1,
+                 hasher=None, **kwargs):
         """Constructs a new package object.
 
         path is the path to the working copy.
@@ -494,6 +483,12 @@ class Package(WorkingCopy):
         merge_class -- class which is used for a file merge
                        (default: Merge)
         verify_format -- verify working copy format (default: True)
+        upload_workers -- number of files which are uploaded concurrently
+                          during a commit (default: 1)
+        hasher -- a MD5Hasher object, which computes the md5sums of
+                  several files at once (default: None, that is
+                  the shared MD5Hasher object is used (see
+                  osc2.util.hashing.default_hasher))
         **kwargs -- see class WorkingCopy for the details
 
         """
@@ -508,6 +503,10 @@ class Package(WorkingCopy):
         self.skip_handlers = skip_handlers or []
         self.commit_policies = commit_policies or []
         self.merge_class = merge_class
+        self.upload_workers = upload_workers
+        if hasher is None:
+            hasher = default_hasher()
+        self.hasher = hasher
         with wc_lock(path):
             self._files = wc_read_files(path)
         # call super at the end due to finish_pending_transaction
@@ -538,22 +537,72 @@ class Package(WorkingCopy):
         '?' -- filename is not tracked
 
         """
+        return self._status(filename)
+
+    def states(self, *filenames):
+        """Returns a dict, which maps each filename to its status.
+
+        If no filenames are specified, all tracked files are
+        considered. Unlike status, the md5sums of all files are
+        computed at once (see MD5Hasher).
+
+        """
+        if not filenames:
+            filenames = self.files()
+        candidates = []
+        for filename in filenames:
+            entry = self._files.find(filename)
+            if entry is None or entry.get('state') != ' ':
+                continue
+            fname = os.path.join(self.path, filename)
+            if not os.path.isfile(fname) or self._size_differs(entry, fname):
+                continue
+            candidates.append(fname)
+        md5s = self.hasher.md5sums(candidates)
+        return dict([(f, self._status(f, md5s)) for f in filenames])
+
+    def _status(self, filename, md5s=None):
         fname = os.path.join(self.path, filename)
-        exists = os.path.exists(fname)
         entry = self._files.find(filename)
         if entry is None:
             return '?'
         st = entry.get('state')
         if st == 'D':
             return 'D'
-        elif st != 'S' and not exists:
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            stat = None
+        if st != 'S' and stat is None:
             return '!'
-        elif st == ' ' and entry.get('md5') != file_md5(fname):
+        elif st == ' ' and self._modified(entry, fname, stat, md5s):
             return 'M'
         return st
 
+    def _size_differs(self, entry, fname, stat=None):
+        size = entry.get('size')
+        if size is None or not size.isdigit():
+            return False
+        if stat is None:
+            stat = os.stat(fname)
+        return stat.st_size != int(size)
+
+    def _modified(self, entry, fname, stat, md5s=None):
+        """Returns True if the file fname differs from the file entry.
+
+        stat is the stat result of fname. If the sizes differ, the md5
+        of the file is not computed. md5s is an optional dict, which
+        maps a filename to its already computed md5sum.
+
+        """
+        if self._size_differs(entry, fname, stat):
+            return True
+        if md5s is not None and fname in md5s:
+            return entry.get('md5') != md5s[fname]
+        return entry.get('md5') != file_md5(fname)
+
     def has_conflicts(self):
-        return [c for c in self.files() if self.status(c) == 'C']
+        return _conflicted_files(self.path, self._files)
 
     def _calculate_updateinfo(self, revision='', remote_files=None, **kwargs):
         unchanged = []
@@ -565,7 +614,7 @@ class Package(WorkingCopy):
         if remote_files is None:
             spkg = SourcePackage(self.project, self.name)
             remote_files = spkg.list(rev=revision, apiurl=self.apiurl,
-                                     **kwargs)
+                                     cache=False, **kwargs)
         local_files = self.files()
         data = {}
         for rfile in remote_files:
@@ -737,7 +786,8 @@ class Package(WorkingCopy):
             store_md5 = ''
             st = self.status(filename)
             if os.path.exists(store_filename):
-                store_md5 = file_md5(store_filename)
+                # the storefile is only modified with the wc lock held
+                store_md5 = file_md5(store_filename, use_mmap=True)
             if (os.path.isfile(wc_filename)
                     and file_md5(wc_filename) == store_md5):
                 os.unlink(wc_filename)
@@ -767,8 +817,9 @@ class Package(WorkingCopy):
         wc_filenames = self.files()
         if not filenames:
             filenames = wc_filenames
+        states = self.states(*wc_filenames)
         for filename in wc_filenames:
-            st = self.status(filename)
+            st = states[filename]
             if filename not in filenames:
                 # no 'A' state because unchanged files are part
                 # of the commit
@@ -821,6 +872,8 @@ class Package(WorkingCopy):
 
         If no filenames are specified all tracked files
         are committed.
+        A pending commit transaction is resumed (the files, which were
+        already uploaded, are not uploaded again).
 
         Keyword arguments:
         **kwargs -- optional parameters for the final commit
@@ -837,6 +890,9 @@ class Package(WorkingCopy):
             elif (cstate is not None
                     and cstate.state == CommitStateMixin.STATE_COMMITTING):
                 self._commit(cstate)
+            elif cstate is not None and cstate.name == 'commit':
+                # resume an interrupted transfer
+                self._commit(cstate, **kwargs)
             else:
                 cinfo = self._calculate_commitinfo(*filenames)
                 self._apply_commit_policies(cinfo)
@@ -860,7 +916,7 @@ class Package(WorkingCopy):
         cinfo = cstate.info
         # FIXME: validation
         if cstate.state == CommitStateMixin.STATE_TRANSFER:
-            cfilelist = self._calculate_commit_filelist(cinfo)
+            cfilelist = self._calculate_commit_filelist(cinfo, cstate)
             missing = self._commit_filelist(cfilelist, **kwargs)
             send_filenames = self._read_send_files(missing)
             if send_filenames:
@@ -870,7 +926,17 @@ class Package(WorkingCopy):
                 filelist = missing
             cstate.append_filelist(filelist)
             cstate.state = CommitStateMixin.STATE_COMMITTING
-        # only local changes left
+        # only local changes left (they can be redone if the commit is
+        # resumed, hence the storefile writes are batched)
+        with wc_store_transaction(self.path):
+            self._commit_local(cstate)
+        # the transaction state is removed after the batched writes are
+        # committed
+        cstate.cleanup()
+        self.notifier.finished('commit', aborted=False)
+
+    def _commit_local(self, cstate):
+        cinfo = cstate.info
         for filename in cinfo.deleted:
             store_filename = wc_pkg_data_filename(self.path, filename)
             # it might be already removed (if we resume a commit)
@@ -878,6 +944,8 @@ class Package(WorkingCopy):
                 os.unlink(store_filename)
             cstate.processed(filename, None)
             self.notifier.processed(filename, None)
+        # md5s of the copied files (avoids rereading them in the mtime fixup)
+        md5s = {}
         for filename in os.listdir(cstate.location):
             wc_filename = os.path.join(self.path, filename)
             store_filename = wc_pkg_data_filename(self.path, filename)
@@ -885,12 +953,18 @@ class Package(WorkingCopy):
             if os.path.exists(store_filename):
                 # just to reduce disk space usage
                 os.unlink(store_filename)
-            copy_file(commit_filename, wc_filename)
+            md5s[filename], = copy_file(commit_filename, wc_filename,
+                                        hashes=[hashlib.md5()])
             os.rename(commit_filename, store_filename)
         self._files.merge(cstate.entrystates, cstate.filelist)
         # fixup mtimes
         for filename in self.files():
-            if self.status(filename) != ' ':
+            if filename in md5s:
+                entry = self._files.find(filename)
+                if (entry.get('state') != ' '
+                        or entry.get('md5') != md5s[filename]):
+                    continue
+            elif self.status(filename) != ' ':
                 continue
             entry = self._files.find(filename)
             wc_filename = os.path.join(self.path, filename)
@@ -898,10 +972,8 @@ class Package(WorkingCopy):
             mtime = int(entry.get('mtime'))
             os.utime(wc_filename, (-1, mtime))
             os.utime(store_filename, (-1, mtime))
-        cstate.cleanup()
-        self.notifier.finished('commit', aborted=False)
 
-    def _calculate_commit_filelist(self, cinfo):
+    def _calculate_commit_filelist(self, cinfo, cstate=None):
         def _append_entry(xml, entry):
             xml.append(xml.makeelement('entry', name=entry.get('name'),
                                        md5=entry.get('md5')))
@@ -912,10 +984,21 @@ class Package(WorkingCopy):
                 # skip added files
                 continue
             _append_entry(xml, self._files.find(filename))
+        upload_filenames = []
         for filename in cinfo.added + cinfo.modified:
-            wc_filename = os.path.join(self.path, filename)
-            md5 = file_md5(wc_filename)
-            _append_entry(xml, {'name': filename, 'md5': md5})
+            wc_filename = self._upload_filename(cstate, filename)
+            upload_filenames.append((filename, wc_filename))
+        if cstate is not None:
+            # files which were already uploaded (resumed commit)
+            states = cstate.entrystates
+            for filename in sorted(os.listdir(cstate.location)):
+                if states.get(filename) != ' ':
+                    continue
+                commit_filename = os.path.join(cstate.location, filename)
+                upload_filenames.append((filename, commit_filename))
+        md5s = self.hasher.md5sums([f for _, f in upload_filenames])
+        for filename, wc_filename in upload_filenames:
+            _append_entry(xml, {'name': filename, 'md5': md5s[wc_filename]})
         xml_data = etree.tostring(xml, pretty_print=True)
         return xml_data
 
@@ -941,24 +1024,76 @@ class Package(WorkingCopy):
             send_filenames.append(entry.get('name'))
         return send_filenames
 
-    def _commit_files(self, cstate, send_filenames):
-        for filename in send_filenames:
-            st = self.status(filename)
-            wc_filename = os.path.join(self.path, filename)
-            path = "/source/%s/%s/%s" % (self.project, self.name, filename)
-            lfile = RWLocalFile(wc_filename, wb_path=path, append=True)
-            self.notifier.transfer('upload', filename)
-            lfile.write_back(force=True, rev='repository', apiurl=self.apiurl)
-            cstate.processed(filename, ' ')
+    def _upload_filename(self, cstate, filename):
+        """Returns the path to the file which is uploaded.
+
+        If the commit is resumed, a file might have been moved into the
+        transaction dir already.
+
+        """
+        wc_filename = os.path.join(self.path, filename)
+        if cstate is not None and not os.path.exists(wc_filename):
             commit_filename = os.path.join(cstate.location, filename)
+            if os.path.exists(commit_filename):
+                return commit_filename
+        return wc_filename
+
+    def _upload_file(self, cstate, filename):
+        """Uploads the file filename (without committing it).
+
+        This method is possibly called concurrently by several threads.
+
+        """
+        path = "/source/%s/%s/%s" % (self.project, self.name, filename)
+        lfile = RWLocalFile(self._upload_filename(cstate, filename),
+                            wb_path=path, append=True)
+        lfile.write_back(force=True, rev='repository', apiurl=self.apiurl)
+        lfile.close()
+
+    def _file_uploaded(self, cstate, filename, st):
+        wc_filename = os.path.join(self.path, filename)
+        commit_filename = os.path.join(cstate.location, filename)
+        # a file in the transaction dir was already processed (that is
+        # a resumed commit uploaded it again)
+        if os.path.exists(wc_filename):
+            cstate.processed(filename, ' ')
             # move wcfile into transaction dir
-            os.rename(lfile.path, commit_filename)
-            self.notifier.processed(filename, ' ', st)
+            os.rename(wc_filename, commit_filename)
+        self.notifier.processed(filename, ' ', st)
+
+    def _commit_files(self, cstate, send_filenames):
+        states = dict([(f, self.status(f)) for f in send_filenames])
+        if self.upload_workers <= 1:
+            for filename in send_filenames:
+                self.notifier.transfer('upload', filename)
+                self._upload_file(cstate, filename)
+                self._file_uploaded(cstate, filename, states[filename])
+            return
+        # the uploads are done concurrently, but the transaction state
+        # is only modified by this thread
+        futures = {}
+        failed = None
+        with ThreadPool(self.upload_workers) as pool:
+            for filename in send_filenames:
+                self.notifier.transfer('upload', filename)
+                future = pool.submit(self._upload_file, cstate, filename)
+                futures[future] = filename
+            for future in as_completed(futures.keys()):
+                if future.exception() is not None:
+                    # the remaining uploads are still recorded so that
+                    # a resumed commit does not upload them again
+                    failed = failed or future
+                    continue
+                filename = futures[future]
+                self._file_uploaded(cstate, filename, states[filename])
+        if failed is not None:
+            failed.result()
 
     def latest_revision(self):
         """Return the latest remote revision."""
         spkg = SourcePackage(self.project, self.name)
-        directory = spkg.list(rev='latest', apiurl=self.apiurl)
+        directory = spkg.list(rev='latest', apiurl=self.apiurl, cache=False,
+                              validator_store=_latest_validators)
         if self.is_link():
             if directory.linkinfo.has_error():
                 # FIXME: proper error handling
@@ -997,8 +1132,9 @@ class Package(WorkingCopy):
             filenames = [f for f in self.files() if self.status(f) != 'S']
         super(Package, self).revert(*filenames)
         with wc_lock(self.path):
-            for filename in filenames:
-                self._revert(filename)
+            with wc_store_transaction(self.path):
+                for filename in filenames:
+                    self._revert(filename)
 
     def _revert(self, filename):
         st = self.status(filename)
@@ -1129,7 +1265,8 @@ class Package(WorkingCopy):
         diff.revision_data = self._files.revision_data()
         if revision:
             spkg = SourcePackage(self.project, self.name)
-            directory = spkg.list(rev=revision, apiurl=self.apiurl)
+            directory = spkg.list(rev=revision, apiurl=self.apiurl,
+                                  cache=False)
             info = self._calculate_updateinfo(remote_files=directory)
             consider_filenames(info, filenames)
             # swap added and deleted
@@ -1228,7 +1365,7 @@ class Package(WorkingCopy):
         apiurl = wc_read_apiurl(path)
         if '_files' in missing or xml_data:
             spkg = SourcePackage(project, package)
-            directory = spkg.list(rev=revision, apiurl=apiurl)
+            directory = spkg.list(rev=revision, apiurl=apiurl, cache=False)
             xml_data = etree.tostring(directory, pretty_print=True)
             wc_write_files(path, xml_data)
         if '_version' in missing:
@@ -1260,13 +1397,115 @@ class Package(WorkingCopy):
         ext_storedir -- path to the storedir (default: None).
                         If not specified a "flat" package is created,
                         otherwise path/.osc is a symlink to storedir.
+        backend -- the name of the store backend (default: 'file')
         kwargs -- optional keyword args which are passed to Package's
                   __init__ method
 
         """
-        wc_init(path, ext_storedir=ext_storedir)
+        backend = kwargs.pop('backend', 'file')
+        wc_init(path, ext_storedir=ext_storedir, backend=backend)
         wc_write_project(path, project)
         wc_write_package(path, package)
         wc_write_apiurl(path, apiurl)
         wc_write_files(path, '<directory/>')
         return Package(path, **kwargs)
+
+
+def _conflicted_files(path, files):
+    """Returns the names of the conflicted files (status 'C').
+
+    path is the path to the package working copy and files is its
+    XMLFileTracker object. A conflicted file, which is missing, has
+    status '!' (see Package.status).
+
+    """
+    return [entry.get('name') for entry in files
+            if entry.get('state') == 'C'
+            and os.path.exists(os.path.join(path, entry.get('name')))]
+
+
+class LazyPackage(object):
+    """A lightweight handle for a package working copy.
+
+    Read-only queries like files, has_conflicts, is_updateable and
+    is_commitable only read the store files they need. The full Package
+    object is constructed on demand, that is if an attribute, which is
+    not provided by this class, is accessed (for instance, update or
+    commit). Note: the consistency checks of the working copy are
+    deferred until the full Package object is constructed.
+
+    """
+
+    def __init__(self, path, args=(), kwargs=None, read_files=None):
+        """Constructs a new LazyPackage object.
+
+        path is the path to the package working copy.
+
+        Keyword arguments:
+        args -- positional arguments for the Package's __init__ method
+                (default: ())
+        kwargs -- keyword arguments for the Package's __init__ method
+                  (default: None)
+        read_files -- a function, which is called with the path and
+                      returns a XMLFileTracker object (this can be
+                      used to cache the parsed _files) (default: None,
+                      that is wc_read_files is used)
+
+        """
+        super(LazyPackage, self).__init__()
+        self._package = None
+        self.path = path
+        self._args = args
+        self._kwargs = kwargs or {}
+        self._read_files = read_files
+        self._files = None
+        self._name = None
+
+    @property
+    def name(self):
+        if self._package is not None:
+            return self._package.name
+        if self._name is None:
+            self._name = wc_read_package(self.path)
+        return self._name
+
+    def package(self):
+        """Returns the full Package object."""
+        if self._package is None:
+            self._package = Package(self.path, *self._args, **self._kwargs)
+        return self._package
+
+    def _tracker(self):
+        if self._package is not None:
+            return self._package._files
+        if self._files is None:
+            if self._read_files is not None:
+                self._files = self._read_files(self.path)
+            else:
+                with wc_lock(self.path):
+                    self._files = wc_read_files(self.path)
+        return self._files
+
+    def _needs_package(self):
+        # the Package object might finish a pending transaction
+        return (self._package is not None
+                or PackageCommitState.read_state(self.path) is not None)
+
+    def files(self):
+        return [entry.get('name') for entry in self._tracker()]
+
+    def has_conflicts(self):
+        return _conflicted_files(self.path, self._tracker())
+
+    def is_updateable(self, rollback=False):
+        if rollback or self._needs_package():
+            return self.package().is_updateable(rollback)
+        return not self.has_conflicts()
+
+    def is_commitable(self, rollback=False):
+        if rollback or self._needs_package():
+            return self.package().is_commitable(rollback)
+        return not self.has_conflicts()
+
+    def __getattr__(self, name):
+        return getattr(self.package(), name)
@@ -2,20 +2,26 @@
 
 import os
 import shutil
+import threading
 
 from osc2.wc.base import (WorkingCopy, UpdateStateMixin, CommitStateMixin,
                           PendingTransactionError, FileConflictError)
-from osc2.wc.package import Package
+from osc2.wc.package import Package, LazyPackage
 from osc2.wc.util import (wc_read_project, wc_read_apiurl, wc_read_packages,
                           wc_init, wc_write_apiurl, wc_write_project,
                           wc_write_packages, missing_storepaths, wc_lock,
                           WCInconsistentError, wc_is_project, wc_is_package,
                           wc_pkg_data_mkdir, XMLTransactionState, _storedir,
                           _STORE, wc_pkg_data_filename, wc_verify_format,
-                          _PKG_DATA, wc_write_version)
+                          _PKG_DATA, wc_write_version, wc_read_files,
+                          wc_store_backend, _storefile_stamp,
+                          wc_store_transaction)
+from osc2.wc.store import clear_store_cache
 from osc2.source import Project as SourceProject
 from osc2.remote import RemotePackage
 from osc2.util.listinfo import ListInfo
+from osc2.util.pool import ThreadPool, as_completed
+from osc2.util.hashing import default_hasher
 
 
 class PackageUpdateInfo(ListInfo):
@@ -127,12 +133,58 @@ class ProjectCommitState(XMLTransactionState, CommitStateMixin):
         return False
 
 
+class _SynchronizedListener(object):
+    """Serializes the calls to a transaction listener.
+
+    All wrappers which share the same lock are mutually exclusive, that
+    is, a listener is never called by two threads at the same time.
+
+    """
+
+    def __init__(self, listener, lock):
+        super(_SynchronizedListener, self).__init__()
+        self._listener = listener
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._listener, name)
+        if not callable(attr):
+            return attr
+
+        def synchronized(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return synchronized
+
+
+class ProjectCommitError(Exception):
+    """Raised if the commit of some packages failed.
+
+    The other packages were committed nevertheless.
+
+    """
+
+    def __init__(self, errors):
+        """Constructs a new ProjectCommitError object.
+
+        errors is a dict, which maps a package name to the exception
+        that was raised during its commit.
+
+        """
+        super(ProjectCommitError, self).__init__()
+        self.errors = errors
+
+    def __str__(self):
+        return "commit failed for: %s" % ', '.join(sorted(self.errors))
+
+
 class Project(WorkingCopy):
     """Represents a project working copy."""
 
     PACKAGES_SCHEMA = ''
 
-    def __init__(self, path, verify_format=True, **kwargs):
+    def __init__(self, path, verify_format=True, commit_workers=1,
+                 skip_unchanged=False, **kwargs):
         """Constructs a new project object.
 
         path is the path to the working copy.
@@ -143,6 +195,11 @@ class Project(WorkingCopy):
 
         Keyword arguments:
         verify_format -- verify working copy format (default: True)
+        commit_workers -- number of packages which are committed
+                          concurrently (default: 1)
+        skip_unchanged -- do not update packages whose srcmd5 did not
+                          change (the srcmd5s of all packages are
+                          retrieved with a single request) (default: False)
         kwargs -- see class WorkingCopy for the details
 
         """
@@ -153,6 +210,12 @@ class Project(WorkingCopy):
             raise WCInconsistentError(path, meta, xml_data, pkg_data)
         self.apiurl = wc_read_apiurl(path)
         self.name = wc_read_project(path)
+        self.commit_workers = commit_workers
+        self.skip_unchanged = skip_unchanged
+        # maps the path of a package to a (stamp, thread ident,
+        # XMLFileTracker) tuple
+        self._files_cache = {}
+        self._files_cache_lock = threading.Lock()
         with wc_lock(path):
             self._packages = wc_read_packages(path)
         super(Project, self).__init__(path, ProjectUpdateState,
@@ -176,6 +239,7 @@ class Project(WorkingCopy):
         'A' -- pkg will be added to the project
         'D' -- pkg is marked for deletion
         '!' -- pkg is missing (e.g. removed by non-osc command)
+        'N' -- pkg is not materialized (sparse checkout)
         '?' -- pkg is not tracked
 
         """
@@ -185,44 +249,114 @@ class Project(WorkingCopy):
         if entry is None:
             return '?'
         st = entry.get('state')
-        if not exists and st != 'D':
+        if not exists and st not in ('D', 'N'):
             return '!'
         return st
 
     def has_conflicts(self):
         return []
 
-    def _calculate_updateinfo(self, *packages):
+    def package_states(self, *packages, **kwargs):
+        """Yields the status of each package and its files.
+
+        If no packages are specified, all packages are considered.
+        A 3-tuple (package, package_state, states) is yielded for each
+        package, where package_state is the package's status and states
+        is a dict, which maps a filename to its status (it is empty if
+        the package is missing or not materialized). The states are
+        computed concurrently; the tuples are yielded in the order of
+        packages as soon as they are available.
+        Specified packages, which are not materialized (state 'N'), are
+        checked out first.
+
+        Keyword arguments:
+        untracked -- also include the untracked files and directories
+                     of each package (default: False)
+        workers -- number of packages whose states are computed
+                   concurrently (default: 8)
+        hasher -- a MD5Hasher object, which is shared by all packages
+                  (default: None, that is the shared MD5Hasher object
+                  is used (see osc2.util.hashing.default_hasher))
+
+        """
+        untracked = kwargs.get('untracked', False)
+        hasher = kwargs.get('hasher')
+        if hasher is None:
+            # a single hasher bounds the number of hashing threads
+            hasher = default_hasher()
+        if not packages:
+            packages = self.packages()
+        else:
+            sparse = [p for p in packages if self._status(p) == 'N']
+            if sparse:
+                self.update(*sparse)
+        with ThreadPool(kwargs.get('workers', 8)) as pool:
+            futures = [pool.submit(self._package_states, package, untracked,
+                                   hasher)
+                       for package in packages]
+            for package, future in zip(packages, futures):
+                yield package, self._status(package), future.result()
+
+    def _package_states(self, package, untracked, hasher):
+        pkg = self._package_handle(package, hasher=hasher)
+        if pkg is None:
+            return {}
+        filenames = pkg.files()
+        if untracked:
+            filenames.extend([f for f in os.listdir(pkg.path)
+                              if not f.startswith('.')
+                              and f not in filenames])
+        return pkg.states(*filenames)
+
+    def _calculate_updateinfo(self, *packages, **kwargs):
+        skip_unchanged = kwargs.get('skip_unchanged', False)
         added = []
         deleted = []
         candidates = []
         conflicted = []
         sprj = SourceProject(self.name)
-        remote_pkgs = [pkg.name for pkg in sprj.list(apiurl=self.apiurl)]
+        if skip_unchanged:
+            srcmd5s = {}
+            remote_pkgs = []
+            for info in sprj.info(apiurl=self.apiurl, cache=False):
+                package = info.get('package')
+                remote_pkgs.append(package)
+                # for a link, lsrcmd5 is the srcmd5 of the unexpanded
+                # sources
+                srcmd5s[package] = (info.get('srcmd5'), info.get('lsrcmd5'))
+        else:
+            remote_pkgs = [pkg.name for pkg in sprj.list(apiurl=self.apiurl,
+                                                         cache=False)]
         local_pkgs = self.packages()
         for package in remote_pkgs:
-            if package in local_pkgs:
-                candidates.append(package)
-            else:
+            if package not in local_pkgs:
                 added.append(package)
+            elif self._status(package) == 'N':
+                # only materialize explicitly specified packages
+                if package in packages:
+                    added.append(package)
+            else:
+                candidates.append(package)
         for package in local_pkgs:
             st = self._status(package)
-            pkg = self.package(package)
+            pkg = self._package_handle(package)
             if pkg is not None and not pkg.is_updateable():
                 conflicted.append(package)
             elif st != 'A' and package not in remote_pkgs:
                 deleted.append(package)
         # check for conflicts
         for package in candidates[:]:
-            pkg = self.package(package)
+            pkg = self._package_handle(package)
             if (self._status(package) in ('A', '!')
                     or not pkg.is_updateable()):
                 conflicted.append(package)
                 candidates.remove(package)
+            elif skip_unchanged and self._unchanged(pkg, srcmd5s[package]):
+                candidates.remove(package)
         for package in added[:]:
             path = os.path.join(self.path, package)
             st = self._status(package)
-            if st == '?' and os.path.exists(path):
+            if st in ('?', 'N') and os.path.exists(path):
                 conflicted.append(package)
                 added.remove(package)
         if packages:
@@ -234,6 +368,15 @@ class Project(WorkingCopy):
         return PackageUpdateInfo(self.name, candidates, added, deleted,
                                  conflicted)
 
+    def _unchanged(self, pkg, srcmd5s):
+        """Returns True if the package pkg is up to date.
+
+        srcmd5s is a tuple, which contains the remote srcmd5 and lsrcmd5.
+
+        """
+        local = pkg._files.revision_data().get('srcmd5')
+        return local is not None and local in srcmd5s
+
     def _clear_uinfo(self, ustate):
         self._clear_info(ustate, 'candidates', 'added', 'deleted',
                          'conflicted')
@@ -261,10 +404,20 @@ class Project(WorkingCopy):
         will be updated.
 
         Keyword arguments:
+        sparse -- do not check out newly added packages; they are
+                  registered with state 'N' (not materialized) and
+                  checked out on first access (default: False)
         **kwargs -- optional keyword arguments which will be passed
                     to the Package's update method
 
+        A package with state 'N' is only checked out, if it is
+        specified in *packages.
+        Unchanged packages are only skipped (see skip_unchanged) if no
+        kwargs are specified (that is, if the packages are updated to
+        the latest revision).
+
         """
+        sparse = kwargs.pop('sparse', False)
         with wc_lock(self.path):
             ustate = ProjectUpdateState.read_state(self.path)
             if not self.is_updateable(rollback=True):
@@ -274,7 +427,9 @@ class Project(WorkingCopy):
                 self._clear_uinfo(ustate)
                 self._update(ustate)
             else:
-                uinfo = self._calculate_updateinfo(*packages)
+                skip_unchanged = self.skip_unchanged and not kwargs
+                uinfo = self._calculate_updateinfo(
+                    *packages, skip_unchanged=skip_unchanged)
                 conflicts = uinfo.conflicted
                 if conflicts:
                     # a package might be in conflicts because
@@ -284,6 +439,8 @@ class Project(WorkingCopy):
                     return
                 states = dict([(p, self._status(p)) for p in self.packages()])
                 ustate = ProjectUpdateState(self.path, uinfo=uinfo, **states)
+                if sparse:
+                    self._perform_sparse_adds(ustate)
                 self._update(ustate, **kwargs)
                 self.notifier.finished('prj_update', aborted=False)
 
@@ -304,6 +461,7 @@ class Project(WorkingCopy):
                 os.mkdir(storedir)
                 pkg = Package.init(tmp_dir, self.name, package,
                                    self.apiurl, storedir,
+                                   backend=wc_store_backend(self.path),
                                    transaction_listener=tl)
                 pkg.update(**kwargs)
                 ustate.state = UpdateStateMixin.STATE_UPDATING
@@ -319,6 +477,14 @@ class Project(WorkingCopy):
             ustate.processed(package, ' ')
             self.notifier.processed(package, ' ', None)
 
+    def _perform_sparse_adds(self, ustate):
+        uinfo = ustate.info
+        # no package is materialized, hence the state writes are batched
+        with wc_store_transaction(self.path):
+            for package in uinfo.added:
+                ustate.processed(package, 'N')
+                self.notifier.processed(package, 'N', None)
+
     def _perform_deletes(self, ustate):
         global _STORE
         uinfo = ustate.info
@@ -337,7 +503,7 @@ class Project(WorkingCopy):
         uinfo = ustate.info
         tl = self.notifier.listener
         for package in uinfo.candidates:
-            pkg = self.package(package, transaction_listener=tl)
+            pkg = self._package_handle(package, transaction_listener=tl)
             # pkg should never ever be None at this point
             if pkg is None:
                 msg = "package \"%s\" is an invalid candidate." % package
@@ -349,7 +515,7 @@ class Project(WorkingCopy):
             self.notifier.processed(package, ' ', ' ')
 
     def _remove_wc_dir(self, package, notify=False):
-        pkg = self.package(package)
+        pkg = self._package_handle(package)
         if pkg is not None:
             for filename in pkg.files():
                 st = pkg.status(filename)
@@ -365,6 +531,7 @@ class Project(WorkingCopy):
         store = wc_pkg_data_filename(self.path, package)
         if os.path.exists(store):
             shutil.rmtree(store)
+            clear_store_cache()
 
     def _calculate_commitinfo(self, *packages):
         unchanged = []
@@ -376,11 +543,13 @@ class Project(WorkingCopy):
             packages = self.packages()
         for package in packages:
             st = self._status(package)
-            pkg = self.package(package)
+            pkg = self._package_handle(package)
             if st == 'A':
                 added.append(package)
             elif st == 'D':
                 deleted.append(package)
+            elif st == 'N':
+                unchanged.append(package)
             elif pkg is None:
                 conflicted.append(package)
             else:
@@ -401,6 +570,16 @@ class Project(WorkingCopy):
         If *packages are specified only the specified
         packages will be commited. Otherwise all packages
         will be updated.
+        If commit_workers is greater than 1, the packages are committed
+        concurrently. If the commit of a package fails, the remaining
+        packages are committed nevertheless and a ProjectCommitError
+        is raised afterwards. The commit transaction stays pending, so
+        that a subsequent commit call resumes it (this requires
+        finish_pending_transaction=False; by default, the pending
+        transaction is rolled back when the project is opened again.
+        Since the states of the committed packages are kept, a
+        subsequent commit only commits the remaining packages).
+        The transaction listeners are never called concurrently.
 
         Keyword arguments:
         package_filenames -- a dict which maps a package to a list
@@ -417,6 +596,12 @@ class Project(WorkingCopy):
                     and cstate.state == CommitStateMixin.STATE_COMMITTING):
                 self._clear_cinfo(cstate)
                 self._commit(cstate, {}, '')
+            elif cstate is not None and cstate.name == 'commit':
+                # resume a partially committed project
+                self._clear_cinfo(cstate)
+                self._commit(cstate, kwargs.get('package_filenames', {}),
+                             kwargs.get('comment', ''))
+                self.notifier.finished('prj_commit', aborted=False)
             else:
                 package_filenames = kwargs.get('package_filenames', {})
                 if [p for p in packages if p in package_filenames]:
@@ -438,12 +623,87 @@ class Project(WorkingCopy):
                 self.notifier.finished('prj_commit', aborted=False)
 
     def _commit(self, cstate, package_filenames, comment):
-        self._commit_adds(cstate, package_filenames, comment)
-        self._commit_deletes(cstate)
-        self._commit_modified(cstate, package_filenames, comment)
+        if (self.commit_workers > 1
+                and cstate.state == CommitStateMixin.STATE_TRANSFER):
+            errors = self._commit_concurrently(cstate, package_filenames,
+                                               comment)
+            self._commit_deletes(cstate)
+            if errors:
+                # keep the states of the committed packages but leave
+                # the transaction pending
+                self._packages.merge(cstate.entrystates)
+                raise ProjectCommitError(errors)
+        else:
+            self._commit_adds(cstate, package_filenames, comment)
+            self._commit_deletes(cstate)
+            self._commit_modified(cstate, package_filenames, comment)
         self._packages.merge(cstate.entrystates)
         cstate.cleanup()
 
+    def _commit_package(self, package, filenames, comment, added,
+                        listener=None):
+        """Commits the package package.
+
+        This method is called concurrently by several threads.
+        listener is the list of transaction listeners which is passed
+        to the package (default: the project's listeners).
+
+        """
+        if added:
+            # check if package was created in the meantime
+            exists = RemotePackage.exists(self.name, package,
+                                          apiurl=self.apiurl)
+            if not exists:
+                pkg = RemotePackage(self.name, package)
+                pkg.store(apiurl=self.apiurl)
+        if listener is None:
+            listener = self.notifier.listener
+        pkg = self._package_handle(package, transaction_listener=listener)
+        if not added and not pkg.is_modified():
+            # already committed (resumed commit)
+            return
+        pkg.commit(*filenames, comment=comment)
+
+    def _commit_concurrently(self, cstate, package_filenames, comment):
+        """Commits the added and modified packages concurrently.
+
+        The project's transaction state is only modified by the calling
+        thread. The transaction listeners are serialized, because the
+        packages notify them from the worker threads. A dict, which maps
+        a package to the exception that was raised during its commit, is
+        returned.
+
+        """
+        cinfo = cstate.info
+        old_states = {}
+        for package in cinfo.added:
+            old_states[package] = 'A'
+        for package in cinfo.modified:
+            old_states[package] = ' '
+        lock = threading.RLock()
+        listener = [_SynchronizedListener(l, lock)
+                    for l in self.notifier.listener]
+        futures = {}
+        errors = {}
+        with ThreadPool(self.commit_workers) as pool:
+            for package in cinfo.added + cinfo.modified:
+                filenames = package_filenames.get(package, [])
+                added = old_states[package] == 'A'
+                future = pool.submit(self._commit_package, package,
+                                     filenames, comment, added,
+                                     listener=listener)
+                futures[future] = package
+            for future in as_completed(futures.keys()):
+                package = futures[future]
+                if future.exception() is not None:
+                    errors[package] = future.exception()
+                    continue
+                cstate.processed(package, ' ')
+                with lock:
+                    self.notifier.processed(package, ' ',
+                                            old_states[package])
+        return errors
+
     def _commit_adds(self, cstate, package_filenames, comment):
         cinfo = cstate.info
         tl = self.notifier.listener
@@ -455,7 +715,7 @@ class Project(WorkingCopy):
                 if not exists:
                     pkg = RemotePackage(self.name, package)
                     pkg.store(apiurl=self.apiurl)
-                pkg = self.package(package, transaction_listener=tl)
+                pkg = self._package_handle(package, transaction_listener=tl)
                 filenames = package_filenames.get(package, [])
                 pkg.commit(*filenames, comment=comment)
                 cstate.state = CommitStateMixin.STATE_COMMITTING
@@ -477,7 +737,7 @@ class Project(WorkingCopy):
         tl = self.notifier.listener
         for package in cinfo.modified:
             if cstate.state == CommitStateMixin.STATE_TRANSFER:
-                pkg = self.package(package, transaction_listener=tl)
+                pkg = self._package_handle(package, transaction_listener=tl)
                 filenames = package_filenames.get(package, [])
                 pkg.commit(*filenames, comment=comment)
                 cstate.state = CommitStateMixin.STATE_COMMITTING
@@ -496,8 +756,9 @@ class Project(WorkingCopy):
             packages = self.packages()
         super(Project, self).revert(*packages)
         with wc_lock(self.path):
-            for package in packages:
-                self._revert(package)
+            with wc_store_transaction(self.path):
+                for package in packages:
+                    self._revert(package)
 
     def _revert(self, package):
         global _STORE
@@ -508,6 +769,9 @@ class Project(WorkingCopy):
         if st == '?':
             msg = "cannot revert untracked package: %s" % package
             raise ValueError(msg)
+        elif st == 'N':
+            # nothing to revert
+            return
         elif st == 'A':
             path = os.path.join(self.path, package)
             store = os.path.join(path, _STORE)
@@ -518,17 +782,18 @@ class Project(WorkingCopy):
             store = wc_pkg_data_filename(self.path, package)
             if os.path.exists(store):
                 shutil.rmtree(store)
+                clear_store_cache()
             self._packages.remove(package)
             self._packages.write()
             return
         # just revert the package
-        pkg = self.package(package)
+        pkg = self._package_handle(package)
         if pkg is None:
             path = os.path.join(self.path, package)
             storedir = wc_pkg_data_filename(self.path, package)
             wc_init(path, ext_storedir=storedir)
             # now the package can be obtained
-            pkg = self.package(package)
+            pkg = self._package_handle(package)
         pkg.revert()
         if st != ' ':
             self._packages.set(package, ' ')
@@ -568,7 +833,8 @@ class Project(WorkingCopy):
                 raise ValueError(msg)
             storedir = wc_pkg_data_mkdir(self.path, package)
             pkg = Package.init(pkg_path, self.name, package, self.apiurl,
-                               ext_storedir=storedir)
+                               ext_storedir=storedir,
+                               backend=wc_store_backend(self.path))
             self._packages.add(package, state='A')
             self._packages.write()
             if no_files:
@@ -576,8 +842,9 @@ class Project(WorkingCopy):
             elif not filenames:
                 filenames = [f for f in os.listdir(pkg.path)
                              if os.path.isfile(os.path.join(pkg.path, f))]
-            for filename in filenames:
-                pkg.add(filename)
+            with wc_store_transaction(pkg.path):
+                for filename in filenames:
+                    pkg.add(filename)
 
     def remove(self, package):
         """Mark a package for deletion.
@@ -597,7 +864,7 @@ class Project(WorkingCopy):
                 self._remove_wc_dir(package, notify=False)
                 self._packages.remove(package)
             else:
-                pkg = self.package(package)
+                pkg = self._package_handle(package)
                 if pkg is not None:
                     # only remove files
                     for filename in pkg.files():
@@ -606,20 +873,52 @@ class Project(WorkingCopy):
             self._packages.write()
 
     def package(self, package, *args, **kwargs):
-        """Return a Package object for package package.
+        """Return a LazyPackage object for package package.
 
+        The returned object behaves like a Package object, but the
+        Package object itself is only constructed if it is needed
+        (see class LazyPackage).
         None is returned if package is missing (has state '!')
         or if package is untracked.
+        If the package is not materialized (state 'N'), it is
+        checked out first.
 
         *args and **kwargs are additional arguments for the
         Package's __init__ method.
 
         """
+        if self._status(package) == 'N':
+            self.update(package)
+        return self._package_handle(package, *args, **kwargs)
+
+    def _package_handle(self, package, *args, **kwargs):
+        # like package but a package with state 'N' is not materialized
         path = os.path.join(self.path, package)
         st = self._status(package)
         if st in ('!', '?') or not wc_is_package(path):
             return None
-        return Package(path, *args, **kwargs)
+        return LazyPackage(path, args, kwargs, read_files=self._read_files)
+
+    def _read_files(self, path):
+        """Returns the XMLFileTracker object of the package at path.
+
+        The parsed object is cached until the _files storefile changes.
+        It must not be modified. A cached object is only returned to
+        the thread which read it (that is, the worker threads of
+        package_states do not share a tracker).
+
+        """
+        key = _storefile_stamp(path, '_files')
+        ident = threading.current_thread().ident
+        with self._files_cache_lock:
+            cached = self._files_cache.get(path)
+        if cached is not None and cached[:2] == (key, ident):
+            return cached[2]
+        with wc_lock(path):
+            files = wc_read_files(path)
+        with self._files_cache_lock:
+            self._files_cache[path] = (key, ident, files)
+        return files
 
     @classmethod
     def wc_check(cls, path):
@@ -642,7 +941,8 @@ class Project(WorkingCopy):
             packages = wc_read_packages(path)
         except ValueError:
             return (missing, wc_read_packages(path, raw=True), [])
-        packages = [p.get('name') for p in packages]
+        # a package, which is not materialized, has no pkg data
+        packages = [p.get('name') for p in packages if p.get('state') != 'N']
         pkg_data = missing_storepaths(path, *packages, data=True, dirs=True)
         return (missing, '', pkg_data)
 
@@ -708,8 +1008,13 @@ class Project(WorkingCopy):
         *args and **kwargs are additional arguments for the
         Project's __init__ method.
 
+        Keyword arguments:
+        backend -- the name of the store backend; the packages of
+                   the project use the same backend (default: 'file')
+
         """
-        wc_init(path)
+        backend = kwargs.pop('backend', 'file')
+        wc_init(path, backend=backend)
         wc_write_project(path, project)
         wc_write_apiurl(path, apiurl)
         wc_write_packages(path, '<packages/>')
@@ -0,0 +1,552 @@
+"""Provides the store backends of a working copy.
+
+A store backend reads and writes the metadata storefiles (_apiurl,
+_project, _package, _files, _packages and the transaction state) of a
+storedir. By default, each storefile is a plain file in the storedir
+(FileStore). Alternatively, all storefiles are kept in a single SQLite
+database in the storedir (SQLiteStore): this saves the open/write/rename
+cycle for each storefile and the number of inodes of large checkouts.
+The _version storefile, the lock file and the data dirs are always
+plain files/dirs (the format of a storedir can be verified without
+knowing its backend).
+
+The backend of a storedir is determined by the presence of the
+database file. The backend of a storedir is cached; the cache is
+cleared if a database is created or removed in this process, or if
+storedirs are removed (see clear_store_cache).
+
+Several writes to the storefiles of a storedir can be batched in a
+store transaction: the writes are coalesced (only the last write to a
+storefile is performed) and are committed at the end of the transaction.
+How durable the commit of a store transaction is depends on the
+durability level (see set_durability). Unbatched writes are not synced.
+
+Example usage:
+ with transaction(storedir):
+     for package in packages:
+         ustate.processed(package, 'N')
+
+"""
+
+import os
+import uuid
+import errno
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from osc2.wc.base import AbstractTransactionState
+from osc2.util.io import mkstemp
+
+__all__ = ['FileStore', 'SQLiteStore', 'get_store', 'transaction',
+           'set_durability', 'get_durability', 'clear_store_cache',
+           'STORES']
+
+# the storefiles which are managed by the store backend
+STOREFILES = ('_apiurl', '_project', '_package', '_files', '_packages',
+              AbstractTransactionState.FILENAME)
+
+# maximum number of cached database connections
+_MAX_CONNECTIONS = 32
+# maximum number of cached storedir backends
+_MAX_BACKENDS = 1024
+
+# durability levels (of the store transaction commits):
+# none: the data is written (and renamed) but not synced
+# file: the data is synced before it is renamed
+# full: additionally, the storedir is synced after the rename
+DURABILITY_LEVELS = ('none', 'file', 'full')
+_durability = 'file'
+
+# maps a durability level to the corresponding sqlite synchronous pragma
+# (OFF is not used, because the database might be corrupted by a crash)
+_SQLITE_SYNCHRONOUS = {'none': 'NORMAL', 'file': 'NORMAL', 'full': 'FULL'}
+
+
+def set_durability(level):
+    """Sets the durability level of the store transaction commits.
+
+    level is one of 'none', 'file' (default) or 'full'. A ValueError
+    is raised if level is not supported. Unbatched storefile writes
+    are never synced (this is as durable as before the levels were
+    introduced, and a sync per storefile write is too expensive).
+
+    """
+    global _durability
+    if level not in DURABILITY_LEVELS:
+        raise ValueError("unsupported durability level \"%s\"" % level)
+    _durability = level
+
+
+def get_durability():
+    """Returns the current durability level."""
+    return _durability
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        # the dir might be removed already (for instance, _transaction)
+        if e.errno != errno.ENOENT:
+            raise
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileStore(object):
+    """Stores each storefile as a plain file in the storedir."""
+    name = 'file'
+
+    def __init__(self, storedir):
+        """Constructs a new FileStore object.
+
+        storedir is the path to the storedir.
+
+        """
+        super(FileStore, self).__init__()
+        self.storedir = storedir
+
+    def _filename(self, filename):
+        return os.path.join(self.storedir, filename)
+
+    def read(self, filename):
+        """Returns the data of the storefile filename.
+
+        None is returned if the storefile does not exist.
+
+        """
+        try:
+            with open(self._filename(filename), 'r') as f:
+                return f.read()
+        except IOError as e:
+            if e.errno not in (errno.ENOENT, errno.EISDIR, errno.ENOTDIR):
+                raise
+        return None
+
+    def write(self, filename, data):
+        """Writes data to the storefile filename.
+
+        The storefile is replaced atomically.
+
+        """
+        self.commit({filename: data})
+
+    def remove(self, filename):
+        """Removes the storefile filename (if it exists)."""
+        self.commit({filename: None})
+
+    def commit(self, changes, durability='none'):
+        """Commits the changes to the store.
+
+        changes maps a storefile to its new data (if the data is None,
+        the storefile is removed). If the changes is an ordered dict,
+        the changes are committed in this order.
+
+        Keyword arguments:
+        durability -- the durability level of the commit (see
+                      set_durability) (default: 'none')
+
+        """
+        dirs = set()
+        for filename, data in changes.iteritems():
+            fname = self._filename(filename)
+            if data is None:
+                self._unlink(fname)
+            else:
+                self._replace(fname, data, durability != 'none')
+            dirs.add(os.path.dirname(fname))
+        if durability == 'full':
+            for path in dirs:
+                _fsync_dir(path)
+
+    def _replace(self, fname, data, sync):
+        tmpfile = None
+        try:
+            tmpfile = mkstemp(dir=self.storedir, delete=False)
+            tmpfile.write(data)
+            if sync:
+                tmpfile.flush()
+                os.fsync(tmpfile.fileno())
+        finally:
+            if tmpfile is not None:
+                tmpfile.close()
+                os.rename(tmpfile, fname)
+
+    def _unlink(self, fname):
+        try:
+            os.unlink(fname)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def exists(self, filename):
+        """Returns True if the storefile filename exists."""
+        return os.path.isfile(self._filename(filename))
+
+    def stamp(self, filename):
+        """Returns a value which changes if the storefile is modified.
+
+        An OSError is raised if the storefile does not exist.
+
+        """
+        st = os.stat(self._filename(filename))
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def filenames(self):
+        """Returns the names of the existing storefiles."""
+        return [fname for fname in STOREFILES if self.exists(fname)]
+
+    def destroy(self):
+        """Removes all storefiles."""
+        for filename in self.filenames():
+            self.remove(filename)
+
+    @classmethod
+    def create(cls, storedir, data=None):
+        """Creates a store in storedir and returns it.
+
+        Keyword arguments:
+        data -- dict, which maps a storefile to its initial data
+                (default: None)
+
+        """
+        store = cls(storedir)
+        for filename, fdata in (data or {}).iteritems():
+            store.write(filename, fdata)
+        return store
+
+
+class SQLiteStore(FileStore):
+    """Stores the storefiles in a single SQLite database.
+
+    The database connection is opened on demand and can be shared
+    between threads.
+
+    """
+    name = 'sqlite'
+    DBNAME = '_store.db'
+    # storefiles which are still plain files
+    PLAIN = ('_version', )
+
+    def __init__(self, storedir):
+        """Constructs a new SQLiteStore object.
+
+        storedir is the path to the storedir.
+
+        """
+        super(SQLiteStore, self).__init__(storedir)
+        self._lock = threading.RLock()
+        self._conn = None
+
+    @property
+    def dbfile(self):
+        return self._filename(SQLiteStore.DBNAME)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.dbfile,
+                                         check_same_thread=False)
+            self._conn.text_factory = str
+        return self._conn
+
+    def _query(self, sql, *args):
+        with self._lock:
+            return self._connection().execute(sql, args).fetchall()
+
+    def read(self, filename):
+        if filename in SQLiteStore.PLAIN:
+            return super(SQLiteStore, self).read(filename)
+        rows = self._query('SELECT data FROM storefiles WHERE name = ?',
+                           filename)
+        if not rows:
+            return None
+        return str(rows[0][0])
+
+    def commit(self, changes, durability='none'):
+        # all changes are committed in a single database transaction
+        plain = OrderedDict()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('PRAGMA synchronous = %s'
+                         % _SQLITE_SYNCHRONOUS[durability])
+            with conn:
+                for filename, data in changes.iteritems():
+                    if filename in SQLiteStore.PLAIN:
+                        plain[filename] = data
+                    elif data is None:
+                        conn.execute('DELETE FROM storefiles WHERE name = ?',
+                                     (filename, ))
+                    else:
+                        conn.execute('INSERT OR REPLACE INTO storefiles '
+                                     'VALUES (?, ?)',
+                                     (filename, sqlite3.Binary(data)))
+                conn.execute('UPDATE generation SET value = value + 1')
+        if plain:
+            super(SQLiteStore, self).commit(plain, durability)
+
+    def exists(self, filename):
+        if filename in SQLiteStore.PLAIN:
+            return super(SQLiteStore, self).exists(filename)
+        rows = self._query('SELECT 1 FROM storefiles WHERE name = ?',
+                           filename)
+        return bool(rows)
+
+    def stamp(self, filename):
+        # the generation is incremented by each commit (the id
+        # distinguishes the databases, which were created for the
+        # storedir)
+        if filename in SQLiteStore.PLAIN:
+            return super(SQLiteStore, self).stamp(filename)
+        rows = self._query('SELECT id, value, (SELECT COUNT(*) FROM '
+                           'storefiles WHERE name = ?) FROM generation',
+                           filename)
+        if not rows or not rows[0][2]:
+            raise OSError(errno.ENOENT, 'no such storefile', filename)
+        return (rows[0][0], rows[0][1])
+
+    def filenames(self):
+        return [row[0] for row in self._query('SELECT name FROM storefiles')]
+
+    def close(self):
+        """Closes the database connection.
+
+        It is reopened on demand.
+
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def destroy(self):
+        """Removes the database."""
+        self.close()
+        os.unlink(self.dbfile)
+        clear_store_cache()
+
+    @classmethod
+    def create(cls, storedir, data=None):
+        # the database is populated before it is moved into place (its
+        # presence selects the backend)
+        tmpfile = mkstemp(dir=storedir, delete=False)
+        tmpfile.close()
+        conn = sqlite3.connect(str(tmpfile))
+        try:
+            with conn:
+                conn.execute('CREATE TABLE storefiles (name TEXT PRIMARY '
+                             'KEY, data BLOB NOT NULL)')
+                conn.execute('CREATE TABLE generation (id TEXT NOT NULL, '
+                             'value INTEGER NOT NULL)')
+                conn.execute('INSERT INTO generation VALUES (?, 0)',
+                             (uuid.uuid4().hex, ))
+                for filename, fdata in (data or {}).iteritems():
+                    conn.execute('INSERT INTO storefiles VALUES (?, ?)',
+                                 (filename, sqlite3.Binary(fdata)))
+        finally:
+            conn.close()
+        os.rename(tmpfile, os.path.join(storedir, SQLiteStore.DBNAME))
+        clear_store_cache()
+        return get_store(storedir)
+
+
+class StoreBatch(object):
+    """Coalesces the writes to the storefiles of a store.
+
+    The pending writes are visible to all reads via this object. They
+    are committed by the commit method; afterwards, all operations are
+    directly performed on the wrapped store.
+
+    """
+
+    def __init__(self, store):
+        """Constructs a new StoreBatch object.
+
+        store is the wrapped store object.
+
+        """
+        super(StoreBatch, self).__init__()
+        self.store = store
+        self.name = store.name
+        self._lock = threading.RLock()
+        self._changes = OrderedDict()
+        self._committed = False
+        # incremented by each write (used by stamp)
+        self._version = 0
+
+    def read(self, filename):
+        with self._lock:
+            if filename in self._changes:
+                return self._changes[filename]
+        return self.store.read(filename)
+
+    def write(self, filename, data):
+        self._change(filename, data)
+
+    def remove(self, filename):
+        self._change(filename, None)
+
+    def _change(self, filename, data):
+        with self._lock:
+            if self._committed:
+                return self.store.commit({filename: data})
+            # the changes are committed in the order of their last write
+            self._changes.pop(filename, None)
+            self._changes[filename] = data
+            self._version += 1
+
+    def exists(self, filename):
+        with self._lock:
+            if filename in self._changes:
+                return self._changes[filename] is not None
+        return self.store.exists(filename)
+
+    def stamp(self, filename):
+        with self._lock:
+            if filename not in self._changes:
+                return self.store.stamp(filename)
+            elif self._changes[filename] is None:
+                raise OSError(errno.ENOENT, 'no such storefile', filename)
+            return ('batch', id(self), self._version)
+
+    def filenames(self):
+        with self._lock:
+            filenames = [fname for fname in self.store.filenames()
+                         if fname not in self._changes]
+            filenames.extend([fname for fname, data in self._changes.items()
+                              if data is not None])
+        return filenames
+
+    def commit(self):
+        """Commits the pending writes to the wrapped store.
+
+        The commit is as durable as the current durability level.
+
+        """
+        with self._lock:
+            self._committed = True
+            changes = self._changes
+            self._changes = OrderedDict()
+            if changes:
+                self.store.commit(changes, get_durability())
+
+
+STORES = {FileStore.name: FileStore, SQLiteStore.name: SQLiteStore}
+
+_connections = OrderedDict()
+_connections_lock = threading.Lock()
+# maps a storedir (as passed to get_store) to its store object
+_backends = OrderedDict()
+# maps a thread ident to a dict, which maps the realpath of a storedir
+# to the thread's active StoreBatch object
+_batches = {}
+_batches_lock = threading.Lock()
+
+
+def clear_store_cache():
+    """Clears the cached backends of the storedirs.
+
+    This has to be called if a storedir is removed (the cache is
+    cleared automatically if a database is created or removed).
+
+    """
+    with _connections_lock:
+        _backends.clear()
+
+
+def _batch(storedir):
+    batches = _batches.get(threading.current_thread().ident)
+    if not batches:
+        return None
+    # the realpath is only computed if the calling thread has an active
+    # store transaction
+    return batches.get(os.path.realpath(storedir))
+
+
+def get_store(storedir):
+    """Returns the store object for the storedir.
+
+    The store object of a storedir is cached. The SQLiteStore objects
+    are shared by all paths of a database (the key is the inode of the
+    database file), so that subsequent calls share the connection.
+    If the calling thread has an active store transaction for the
+    storedir, its StoreBatch object is returned.
+
+    """
+    if _batches:
+        batch = _batch(storedir)
+        if batch is not None:
+            return batch
+    with _connections_lock:
+        store = _backends.pop(storedir, None)
+        if store is not None:
+            _backends[storedir] = store
+            return store
+    try:
+        st = os.stat(os.path.join(storedir, SQLiteStore.DBNAME))
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        store = FileStore(storedir)
+    else:
+        key = (st.st_dev, st.st_ino)
+        with _connections_lock:
+            store = _connections.pop(key, None)
+            if store is None:
+                store = SQLiteStore(storedir)
+                if len(_connections) >= _MAX_CONNECTIONS:
+                    _connections.popitem(last=False)[1].close()
+                    # the cached backends might refer to the closed store
+                    _backends.clear()
+            # the database might be reachable via several paths (for
+            # instance, a package wc is renamed during a project update)
+            store.storedir = storedir
+            _connections[key] = store
+    with _connections_lock:
+        _backends[storedir] = store
+        if len(_backends) > _MAX_BACKENDS:
+            _backends.popitem(last=False)
+    return store
+
+
+@contextmanager
+def transaction(storedir):
+    """Batches the writes to the storefiles of storedir.
+
+    The writes, which happen in the with block (in the calling thread),
+    are coalesced and committed when the block is left (also if an
+    exception is raised). A nested transaction for the same storedir
+    is merged into the outer transaction. The transactions are kept
+    per thread: the writes of other threads are not batched (and
+    they do not see the pending writes), and a transaction, which is
+    started by another thread, is an outer transaction on its own.
+    Note: a crash before the commit loses all writes of the transaction.
+    Hence, the transaction state of an operation, which performs
+    non-idempotent steps, should not be batched.
+
+    """
+    ident = threading.current_thread().ident
+    key = os.path.realpath(storedir)
+    with _batches_lock:
+        batches = _batches.setdefault(ident, {})
+        outer = key not in batches
+        if outer:
+            batch = StoreBatch(get_store(storedir))
+            batches[key] = batch
+    if not outer:
+        yield
+        return
+    try:
+        yield
+    finally:
+        try:
+            batch.commit()
+        finally:
+            with _batches_lock:
+                del batches[key]
+                if not batches:
+                    del _batches[ident]
@@ -12,10 +12,11 @@ import shutil
 from lxml import etree, objectify
 
 from osc2.wc.base import AbstractTransactionState
+from osc2.wc.store import (get_store, transaction, clear_store_cache,
+                           STORES)
 from osc2.source import File, Directory, Linkinfo
-from osc2.util.io import mkstemp
 from osc2.util.xml import fromstring
-from osc2.util.xpath import XPathBuilder
+from osc2.util.xpath import XPathBuilder, XPathTemplate
 
 __all__ = ['wc_is_project', 'wc_is_package', 'wc_read_project',
            'wc_read_package', 'wc_read_apiurl']
@@ -194,6 +195,11 @@ class AbstractEntryTracker(object):
         raise NotImplementedError()
 
 
+# maps an entry tag to the XPathTemplate, which finds an entry of a
+# XMLEntryTracker (the templates are shared by all trackers)
+_FIND_ENTRY_XPATHS = {}
+
+
 class XMLEntryTracker(AbstractEntryTracker):
     """Can be used for trackers which are backed up by a xml.
 
@@ -218,6 +224,13 @@ class XMLEntryTracker(AbstractEntryTracker):
         # XXX: validation
         self._xml = self._fromstring(xml_data)
         self._tag = entry_tag
+        find_xpath = _FIND_ENTRY_XPATHS.get(entry_tag)
+        if find_xpath is None:
+            xpb = XPathBuilder()
+            xp = xpb.descendant(entry_tag)[xpb.attr('name') == xpb.var('name')]
+            find_xpath = _FIND_ENTRY_XPATHS.setdefault(entry_tag,
+                                                       XPathTemplate(xp))
+        self._find_xpath = find_xpath
 
     def add(self, name, state):
         if self.find(name) is not None:
@@ -233,9 +246,10 @@ class XMLEntryTracker(AbstractEntryTracker):
         self._xml.remove(elm)
 
     def find(self, name):
-        xpb = XPathBuilder()
-        xp = xpb.descendant(self._tag)[xpb.attr('name') == name]
-        return self._xml.find(xp.tostring())
+        elms = self._find_xpath(self._xml, name=name)
+        if elms:
+            return elms[0]
+        return None
 
     def set(self, name, new_state):
         entry = self.find(name)
@@ -473,6 +487,7 @@ class XMLTransactionState(AbstractTransactionState):
         path = _storefile(self._path, XMLTransactionState.DIR)
         if os.path.exists(path):
             shutil.rmtree(path)
+        _remove_storefile(self._path, XMLTransactionState.FILENAME)
 
     @classmethod
     def read_state(cls, path):
@@ -504,6 +519,11 @@ def _storefile(path, filename):
     return os.path.join(_storedir(path), filename)
 
 
+def _store(path):
+    """Return the store object of the storedir (internal function)"""
+    return get_store(_storedir(path))
+
+
 def _has_storedir(path):
     """Test if path has a storedir (internal function)"""
     storedir = _storedir(path)
@@ -528,6 +548,9 @@ def missing_storepaths(path, *paths, **kwargs):
     data = kwargs.get('data', False)
     if not _has_storedir(path):
         return list(paths)
+    if not dirs and not data:
+        store = _store(path)
+        return [p for p in paths if not store.exists(p)]
     storedir = _storedir(path)
     if data:
         storedir = _storefile(path, _PKG_DATA)
@@ -551,12 +574,14 @@ def _read_storefile(path, filename):
     Leading and trailing whitespaces, tabs etc. are stripped.
 
     """
-    if missing_storepaths(path, filename):
+    data = None
+    if _has_storedir(path):
+        data = _store(path).read(filename)
+    if data is None:
         # file does not exist or is no file
         msg = "'%s' is no valid storefile" % filename
         raise ValueError(msg)
-    storefile = _storefile(path, filename)
-    return _read_file(storefile)
+    return data.strip()
 
 
 def _read_file(filename):
@@ -581,17 +606,29 @@ def _write_storefile(path, filename, data):
     """
     if not _has_storedir(path):
         raise ValueError("path \"%s\" has no storedir" % path)
-    fname = _storefile(path, filename)
-    tmpfile = None
-    try:
-        tmpfile = mkstemp(dir=_storedir(path), delete=False)
-        tmpfile.write(data)
-        if data:
-            tmpfile.write('\n')
-    finally:
-        if tmpfile is not None:
-            tmpfile.close()
-            os.rename(tmpfile, fname)
+    if data:
+        data += '\n'
+    _store(path).write(filename, data)
+
+
+def _remove_storefile(path, filename):
+    """Remove a wc file (if it exists).
+
+    path is the path to the working copy and filename is the
+    name of the storefile.
+
+    """
+    if _has_storedir(path):
+        _store(path).remove(filename)
+
+
+def _storefile_stamp(path, filename):
+    """Return a value which changes if the storefile is modified.
+
+    An OSError is raised if the storefile does not exist.
+
+    """
+    return _store(path).stamp(filename)
 
 
 def wc_lock(path):
@@ -752,7 +789,30 @@ def wc_write_version(path):
     _write_storefile(path, '_version', str(_VERSION))
 
 
-def wc_init(path, ext_storedir=None):
+def wc_store_transaction(path):
+    """Return a context manager, which batches the storefile writes.
+
+    path is the path to the working copy. All writes to the storefiles
+    of the working copy, which happen in the with block, are coalesced
+    and committed at the end of the block (see osc2.wc.store.transaction).
+    Raises a ValueError if path has no storedir.
+
+    """
+    if not _has_storedir(path):
+        raise ValueError("path \"%s\" has no storedir" % path)
+    return transaction(_storedir(path))
+
+
+def wc_store_backend(path):
+    """Return the name of the working copy's store backend.
+
+    path is the path to the working copy.
+
+    """
+    return _store(path).name
+
+
+def wc_init(path, ext_storedir=None, backend='file'):
     """Initialize path as a working copy.
 
     path is the path to the new working copy. If path
@@ -767,9 +827,14 @@ def wc_init(path, ext_storedir=None):
     ext_storedir -- path to an external storedir (default: None).
                     If specified the path/.osc dir is a symlink to
                     ext_storedir.
+    backend -- the name of the store backend (see osc2.wc.store);
+               it is ignored if ext_storedir is an already
+               initialized storedir (default: 'file')
 
     """
     global _PKG_DATA
+    if backend not in STORES:
+        raise ValueError("unsupported store backend \"%s\"" % backend)
     write_version = True
     if ext_storedir is not None:
         # some sanity checks
@@ -805,7 +870,10 @@ def wc_init(path, ext_storedir=None):
         os.symlink(ext_storedir, storedir)
     else:
         os.mkdir(storedir)
+    # a removed storedir might be reachable via the same path
+    clear_store_cache()
     if write_version:
+        STORES[backend].create(storedir)
         wc_write_version(path)
     data_path = _storefile(path, _PKG_DATA)
     if not os.path.isdir(data_path):
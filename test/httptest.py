@@ -3,12 +3,15 @@ import cStringIO
 import unittest
 import urllib2
 import shutil
+import threading
 from difflib import unified_diff
 
 from osc2.util.io import mkdtemp
 from test.xmltest import compare_xml
 
 EXPECTED_REQUESTS = []
+# protects EXPECTED_REQUESTS (requests might be issued concurrently)
+_EXPECTED_REQUESTS_LOCK = threading.Lock()
 
 
 class RequestWrongOrder(Exception):
@@ -95,11 +98,29 @@ class MyHTTPHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
         # HTTPHandler's inheritance hierarchy extends object
         urllib2.HTTPHandler.__init__(self, *args, **kwargs)
 
+    def _pop_request(self, req):
+        """Returns the expected request for req.
+
+        Usually, the expected requests are issued in order. An expected
+        request, which was specified with unordered=True, can be issued
+        before the preceding requests (this is needed for concurrently
+        issued requests). The unordered requests for the same url
+        (and method) are issued in order.
+
+        """
+        with _EXPECTED_REQUESTS_LOCK:
+            for i, r in enumerate(self._exp_requests):
+                if (req.get_full_url() == r[1] and req.get_method() == r[0]
+                        and (i == 0 or r[2].get('unordered', False))):
+                    self._exp_requests.pop(i)
+                    return r
+            r = self._exp_requests.pop(0)
+        raise RequestWrongOrder(req.get_full_url(), r[1], req.get_method(),
+                                r[0])
+
     def http_open(self, req):
-        r = self._exp_requests.pop(0)
-        if req.get_full_url() != r[1] or req.get_method() != r[0]:
-            raise RequestWrongOrder(req.get_full_url(), r[1], req.get_method(),
-                                    r[0])
+        r = self._pop_request(req)
+        r[2].pop('unordered', None)
         if req.get_method() in ('GET', 'DELETE'):
             return self._mock_GET(req, **r[2])
         elif req.get_method() in ('PUT', 'POST'):
@@ -126,7 +147,10 @@ class MyHTTPHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
         exp_content_type = kwargs.pop('exp_content_type', '')
         if exp_content_type:
             assert content_type == exp_content_type
-        data = str(req.get_data())
+        data = req.get_data()
+        if hasattr(data, 'read'):
+            data = self._read_stream(req, data)
+        data = str(data)
         if content_type == 'application/xml' and exp is not None:
             if not compare_xml(exp, data):
                 raise RequestDataMismatch(req.get_full_url(), exp, data)
@@ -135,6 +159,26 @@ class MyHTTPHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
                                       repr(exp))
         return self._get_response(req, **kwargs)
 
+    def _read_stream(self, req, fobj):
+        data = ''
+        while True:
+            block = fobj.read(8192)
+            if not block:
+                break
+            data += block
+        if req.get_header('Transfer-encoding') != 'chunked':
+            return data
+        # decode the chunks
+        chunks = []
+        while True:
+            size, data = data.split('\r\n', 1)
+            size = int(size, 16)
+            if not size:
+                break
+            chunks.append(data[:size])
+            data = data[size + 2:]
+        return ''.join(chunks)
+
     def _get_response(self, req, **kwargs):
         self._check_headers(req, kwargs.pop('exp_headers', {}))
         f = None
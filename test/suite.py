@@ -18,6 +18,8 @@ from test.util import test_cpio
 from test.util import test_xml
 from test.util import test_io
 from test.util import test_delegation
+from test.util import test_pool
+from test.util import test_hashing
 from test.cli.util import test_shell
 
 
@@ -40,6 +42,8 @@ def additional_tests():
     suite.addTests(test_xml.suite())
     suite.addTests(test_io.suite())
     suite.addTests(test_delegation.suite())
+    suite.addTests(test_pool.suite())
+    suite.addTests(test_hashing.suite())
     suite.addTests(test_shell.suite())
     return suite
 
@@ -1,10 +1,23 @@
+import os
+import stat
+import gzip
+import threading
+import zlib
 import unittest
+import warnings
 import urllib2
+from cStringIO import StringIO
 
 from lxml import etree
 
 from test.osctest import OscTest
-from osc2.httprequest import Urllib2HTTPRequest, HTTPError
+from osc2.httprequest import (Urllib2HTTPRequest, HTTPError, DecompressingFile,
+                              CircuitOpenError, RequestListener,
+                              StreamingUpload, NotModifiedError)
+from osc2.httpcache import ResponseCache, ValidatorStore
+from osc2.httpretry import RetryPolicy, CircuitBreaker
+from osc2.httplimit import TokenBucket, RequestLimiter
+from osc2.httpasync import AsyncHTTPRequest, AsyncHTTPResponse
 from test.httptest import GET, PUT, POST, DELETE
 
 
@@ -12,6 +25,26 @@ def suite():
     return unittest.makeSuite(TestHTTPRequest)
 
 
+def _gzip(data):
+    sio = StringIO()
+    f = gzip.GzipFile(fileobj=sio, mode='wb')
+    f.write(data)
+    f.close()
+    return sio.getvalue()
+
+
+class RecordingListener(RequestListener):
+    def __init__(self):
+        self.retries = []
+        self.codes = []
+
+    def retry(self, method, url, attempt, delay, exc):
+        self.retries.append((method, attempt, exc.code))
+
+    def finished(self, method, url, code, duration):
+        self.codes.append(code)
+
+
 class TestHTTPRequest(OscTest):
     def __init__(self, *args, **kwargs):
         kwargs['fixtures_dir'] = 'test_httprequest_fixtures'
@@ -225,6 +258,645 @@ class TestHTTPRequest(OscTest):
                      z=[''], a=['', None])
         self.assertEqual(resp.read(), 'foo')
 
+    @GET('http://localhost/source', file='prj_list.xml')
+    def test_parser1(self):
+        """get with parser and response validation (parse once)"""
+        r = Urllib2HTTPRequest('http://localhost', True, '', '', '', False)
+        resp = r.get('/source', schema=self.fixture_file('directory.xsd'),
+                     parser=etree.XMLParser())
+        self.assertIsNone(resp._sio)
+        self.assertEqual(resp.xml.tag, 'directory')
+        self.assertEqual(resp.xml.get('count'), '2')
+        self.assertEqual(len(resp.xml.findall('entry')), 2)
+
+    @GET('http://localhost/source', text='<foo />')
+    def test_parser2(self):
+        """get with parser and response validation (validation fails)"""
+        r = Urllib2HTTPRequest('http://localhost', True, '', '', '', False)
+        self.assertRaises(etree.DocumentInvalid, r.get, '/source',
+                          schema=self.fixture_file('directory.xsd'),
+                          parser=etree.XMLParser())
+
+    @POST('http://localhost/source', exp='foo', text='<foo />')
+    def test_parser3(self):
+        """post with parser (no validation)"""
+        r = Urllib2HTTPRequest('http://localhost', False, '', '', '', False)
+        resp = r.post('/source', data='foo',
+                      schema=self.fixture_file('directory.xsd'),
+                      parser=etree.XMLParser())
+        self.assertEqual(resp.xml.tag, 'foo')
+
+    @GET('http://localhost/source', file='prj_list.xml')
+    def test_spool1(self):
+        """validated response is spooled to a tmpfile"""
+        r = Urllib2HTTPRequest('http://localhost', True, '', '', '', False,
+                               spool_size=10)
+        resp = r.get('/source', schema=self.fixture_file('directory.xsd'))
+        self.assertTrue(resp._sio._rolled)
+        self.assertEqual(resp.read(), self.read_file('prj_list.xml'))
+
+    @GET('http://localhost/source', file='prj_list.xml')
+    def test_spool2(self):
+        """validated response is kept in memory (small response)"""
+        r = Urllib2HTTPRequest('http://localhost', True, '', '', '', False)
+        resp = r.get('/source', schema=self.fixture_file('directory.xsd'))
+        self.assertFalse(resp._sio._rolled)
+        self.assertEqual(resp.read(), self.read_file('prj_list.xml'))
+
+    def _cache(self, **kwargs):
+        return ResponseCache(os.path.join(self._tmp_dir, 'cache'), **kwargs)
+
+    @GET('http://localhost/source?foo=bar', text='foobar', ETag='"abc"')
+    def test_cache1(self):
+        """cache a response (second request is a hit)"""
+        cache = self._cache()
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        resp = r.get('/source', cache=True, foo='bar')
+        self.assertEqual(resp.read(), 'foobar')
+        resp = r.get('/source', cache=True, foo='bar')
+        self.assertEqual(resp.read(), 'foobar')
+        self.assertEqual(resp.headers.get('ETag'), '"abc"')
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['hits'], 1)
+
+    @GET('http://localhost/source', file='prj_list.xml', ETag='"abc"')
+    @GET('http://localhost/source', code=304, text='',
+         exp_headers={'If-None-Match': '"abc"'})
+    def test_cache2(self):
+        """revalidate a stale entry (304 response)"""
+        cache = self._cache(ttl=0)
+        r = Urllib2HTTPRequest('http://localhost', True, response_cache=cache)
+        schema = self.fixture_file('directory.xsd')
+        resp = r.get('/source', cache=True, schema=schema)
+        self.assertEqual(resp.read(), self.read_file('prj_list.xml'))
+        resp = r.get('/source', cache=True, schema=schema,
+                     parser=etree.XMLParser())
+        self.assertEqual(resp.xml.get('count'), '2')
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['revalidations'], 1)
+        self.assertEqual(cache.stats['hits'], 1)
+
+    @GET('http://localhost/source', text='foo', ETag='"abc"')
+    @GET('http://localhost/source', text='bar', ETag='"def"',
+         exp_headers={'If-None-Match': '"abc"'})
+    @GET('http://localhost/source', text='bar',
+         exp_headers={'If-None-Match': '"def"'})
+    def test_cache3(self):
+        """stale entry is replaced by a new response"""
+        cache = self._cache(ttl=0)
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        self.assertEqual(r.get('/source', cache=True).read(), 'foo')
+        self.assertEqual(r.get('/source', cache=True).read(), 'bar')
+        self.assertEqual(r.get('/source', cache=True).read(), 'bar')
+        self.assertEqual(cache.stats['misses'], 3)
+        self.assertEqual(cache.stats['hits'], 0)
+
+    @GET('http://localhost/source', text='foobar')
+    @GET('http://localhost/source', text='foobar')
+    @GET('http://localhost/source', text='foobar')
+    def test_cache4(self):
+        """do not cache too large responses and requests without cache"""
+        cache = self._cache(max_entry_size=5)
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        resp = r.get('/source', cache=True)
+        self.assertEqual(resp.headers.get('Content-Length'), '6')
+        self.assertEqual(resp.read(), 'foobar')
+        self.assertEqual(r.get('/source', cache=True).read(), 'foobar')
+        self.assertEqual(r.get('/source').read(), 'foobar')
+        self.assertEqual(cache.stats['misses'], 2)
+        self.assertEqual(os.listdir(os.path.join(self._tmp_dir, 'cache')), [])
+
+    @GET('http://localhost/foo', text='foo')
+    @GET('http://localhost/bar', text='bar')
+    @GET('http://localhost/foo', text='foo')
+    def test_cache5(self):
+        """evict the least recently used entries"""
+        cache = self._cache(max_size=5)
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        self.assertEqual(r.get('/foo', cache=True).read(), 'foo')
+        self.assertEqual(r.get('/bar', cache=True).read(), 'bar')
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(r.get('/bar', cache=True).read(), 'bar')
+        self.assertEqual(r.get('/foo', cache=True).read(), 'foo')
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 3)
+        cache.clear()
+        self.assertEqual(os.listdir(os.path.join(self._tmp_dir, 'cache')), [])
+
+    @GET('http://localhost/source', text='foo')
+    @GET('http://localhost/source', text='bar')
+    def test_cache6(self):
+        """entries are private and not shared between users"""
+        cache_dir = os.path.join(self._tmp_dir, 'cache')
+        cache = self._cache(user='foo')
+        self.assertEqual(stat.S_IMODE(os.stat(cache_dir).st_mode), 0700)
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        self.assertEqual(r.get('/source', cache=True).read(), 'foo')
+        for name in os.listdir(cache_dir):
+            st = os.stat(os.path.join(cache_dir, name))
+            self.assertEqual(stat.S_IMODE(st.st_mode), 0600)
+        cache = self._cache(user='bar')
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        self.assertEqual(r.get('/source', cache=True).read(), 'bar')
+        self.assertEqual(cache.stats['misses'], 1)
+        # a leftover temporary file (for instance, after a crash)
+        open(os.path.join(cache_dir, 'abc.42.43.tmp'), 'w').close()
+        cache.clear()
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_cache7(self):
+        """no temporary file is left behind if the store fails"""
+        class BrokenResponse(object):
+            def info(self):
+                return {}
+
+            def read(self, *args):
+                raise IOError('connection reset')
+
+            def close(self):
+                pass
+
+        cache = self._cache()
+        self.assertRaises(IOError, cache.store, 'http://localhost/source',
+                          BrokenResponse())
+        self.assertEqual(os.listdir(os.path.join(self._tmp_dir, 'cache')), [])
+
+    def _evict_after_lookup(self, cache):
+        lookup = cache.lookup
+
+        def evicting_lookup(url):
+            meta = lookup(url)
+            cache.clear()
+            return meta
+        cache.lookup = evicting_lookup
+
+    @GET('http://localhost/foo', text='foo')
+    @GET('http://localhost/foo', text='bar',
+         exp_headers={'If-None-Match': None})
+    def test_cache8(self):
+        """fresh entry is evicted between the lookup and the open"""
+        cache = self._cache()
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        self.assertEqual(r.get('/foo', cache=True).read(), 'foo')
+        self._evict_after_lookup(cache)
+        self.assertEqual(r.get('/foo', cache=True).read(), 'bar')
+        self.assertEqual(cache.stats['hits'], 0)
+        self.assertEqual(cache.stats['misses'], 2)
+
+    @GET('http://localhost/foo', text='foo', ETag='"abc"')
+    @GET('http://localhost/foo', code=304, text='',
+         exp_headers={'If-None-Match': '"abc"'})
+    @GET('http://localhost/foo', text='bar',
+         exp_headers={'If-None-Match': None})
+    def test_cache9(self):
+        """stale entry is evicted between the lookup and the revalidation"""
+        cache = self._cache(ttl=0)
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        self.assertEqual(r.get('/foo', cache=True).read(), 'foo')
+        self._evict_after_lookup(cache)
+        self.assertEqual(r.get('/foo', cache=True).read(), 'bar')
+        self.assertEqual(cache.stats['misses'], 2)
+
+    @GET('http://localhost/foo', text='foo')
+    @GET('http://localhost/bar', text='bar')
+    @GET('http://localhost/baz', text='baz')
+    def test_cache10(self):
+        """the eviction does not scan the cache directory on each store"""
+        cache = self._cache(max_size=6)
+        r = Urllib2HTTPRequest('http://localhost', response_cache=cache)
+        self.assertEqual(r.get('/foo', cache=True).read(), 'foo')
+
+        def scan():
+            raise AssertionError('unexpected scan')
+        cache._scan = scan
+        self.assertEqual(r.get('/bar', cache=True).read(), 'bar')
+        self.assertEqual(cache.stats['evictions'], 0)
+        self.assertEqual(r.get('/baz', cache=True).read(), 'baz')
+        self.assertEqual(cache.stats['evictions'], 1)
+        # foo was evicted
+        self.assertIsNone(cache.lookup('http://localhost/foo'))
+        self.assertIsNotNone(cache.lookup('http://localhost/bar'))
+
+    @GET('http://localhost/source', code=304, text='',
+         exp_headers={'If-None-Match': '"abc"',
+                      'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'})
+    def test_conditional1(self):
+        """conditional get (not modified)"""
+        r = Urllib2HTTPRequest('http://localhost')
+        resp = r.get('/source', if_none_match='"abc"',
+                     if_modified_since='Sat, 01 Jan 2000 00:00:00 GMT')
+        self.assertEqual(resp.code, 304)
+        self.assertIsNone(resp.xml)
+
+    @GET('http://localhost/source', text='foo', exp_headers={
+         'If-None-Match': '"abc"', 'If-Modified-Since': None})
+    def test_conditional2(self):
+        """conditional get (modified)"""
+        r = Urllib2HTTPRequest('http://localhost')
+        resp = r.get('/source', if_none_match='"abc"')
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(resp.read(), 'foo')
+
+    @GET('http://localhost/source', code=304, text='',
+         exp_headers={'If-None-Match': None})
+    def test_conditional3(self):
+        """a 304 response without a conditional request is an error"""
+        r = Urllib2HTTPRequest('http://localhost')
+        self.assertRaises(HTTPError, r.get, '/source')
+
+    @GET('http://localhost/source', file='prj_list.xml', ETag='"abc"',
+         exp_headers={'If-None-Match': None})
+    @GET('http://localhost/source', code=304, text='',
+         exp_headers={'If-None-Match': '"abc"', 'If-Modified-Since': None})
+    @GET('http://localhost/source', text='<directory count="0"/>',
+         Last_Modified='Sat, 01 Jan 2000 00:00:00 GMT',
+         exp_headers={'If-None-Match': '"abc"'})
+    @GET('http://localhost/source', text='<directory count="0"/>',
+         exp_headers={'If-None-Match': None,
+                      'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'})
+    @GET('http://localhost/source', text='<directory count="0"/>',
+         exp_headers={'If-None-Match': None, 'If-Modified-Since': None})
+    def test_conditional4(self):
+        """conditional get with a validator store"""
+        store = ValidatorStore()
+        r = Urllib2HTTPRequest('http://localhost', True)
+        schema = self.fixture_file('directory.xsd')
+        resp = r.get('/source', schema=schema, parser=etree.XMLParser(),
+                     validator_store=store)
+        xml = resp.xml
+        self.assertEqual(xml.get('count'), '2')
+        # modifying the response's xml does not modify the stored xml
+        xml.set('count', '42')
+        resp = r.get('/source', schema=schema, parser=etree.XMLParser(),
+                     validator_store=store)
+        self.assertEqual(resp.code, 304)
+        self.assertTrue(resp.xml is not xml)
+        self.assertEqual(resp.xml.get('count'), '2')
+        resp = r.get('/source', schema=schema, parser=etree.XMLParser(),
+                     validator_store=store)
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(resp.xml.get('count'), '0')
+        # no validators in the response: the entry is removed
+        r.get('/source', validator_store=store)
+        self.assertIsNone(store.get('http://localhost/source'))
+        r.get('/source', validator_store=store)
+
+    @GET('http://localhost/source', code=304, text='',
+         exp_headers={'If-None-Match': '"abc"'})
+    def test_conditional5(self):
+        """304 response for a parsed request without a stored value"""
+        r = Urllib2HTTPRequest('http://localhost')
+        self.assertRaises(NotModifiedError, r.get, '/source',
+                          parser=etree.XMLParser(), if_none_match='"abc"')
+
+    @GET('http://localhost/source', text=_gzip('foo\nbar' * 10000),
+         Content_Encoding='gzip', Content_Length='42',
+         exp_headers={'Accept-Encoding': 'gzip, deflate'})
+    def test_compress1(self):
+        """gzip compressed response"""
+        r = Urllib2HTTPRequest('http://localhost')
+        resp = r.get('/source')
+        self.assertIsNone(resp.headers.get('Content-Length'))
+        self.assertIsNone(resp.headers.get('Content-Encoding'))
+        self.assertEqual(resp.headers.get('X-Osc-Encoded-Length'), '42')
+        self.assertEqual(resp.read(5), 'foo\nb')
+        self.assertEqual(resp.read(), 'ar' + 'foo\nbar' * 9999)
+        self.assertEqual(resp.read(), '')
+
+    @GET('http://localhost/source', text=zlib.compress(open(__file__).read()),
+         Content_Encoding='deflate')
+    def test_compress2(self):
+        """deflate compressed response"""
+        r = Urllib2HTTPRequest('http://localhost', True)
+        resp = r.get('/source')
+        self.assertEqual(resp.read(), open(__file__).read())
+
+    @GET('http://localhost/source', file='prj_list.xml', Content_Length='10',
+         exp_headers={'Accept-Encoding': None})
+    def test_compress3(self):
+        """compression disabled"""
+        r = Urllib2HTTPRequest('http://localhost', True, compress=False)
+        resp = r.get('/source', schema=self.fixture_file('directory.xsd'),
+                     parser=etree.XMLParser())
+        self.assertEqual(resp.headers['Content-Length'], '10')
+        self.assertEqual(resp.xml.get('count'), '2')
+
+    def test_decompressing_file1(self):
+        """test readline and raw deflate data"""
+        data = 'foo\nbar\n\nbaz'
+        comp = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw = comp.compress(data) + comp.flush()
+        f = DecompressingFile(StringIO(raw), 'deflate', bufsize=2)
+        self.assertEqual(f.readline(), 'foo\n')
+        self.assertEqual(f.readline(2), 'ba')
+        self.assertEqual(f.readline(), 'r\n')
+        self.assertEqual(f.readline(), '\n')
+        self.assertEqual(f.readline(), 'baz')
+        self.assertEqual(f.readline(), '')
+        f = DecompressingFile(StringIO('garbage'), 'gzip')
+        self.assertRaises(zlib.error, f.read)
+
+    def _retry_policy(self, sleeps, **kwargs):
+        return RetryPolicy(sleep=sleeps.append, **kwargs)
+
+    @GET('http://localhost/test', text='error', code=503)
+    @GET('http://localhost/test', text='foo')
+    def test_retry1(self):
+        """retry a GET request after a 503 response"""
+        sleeps = []
+        listener = RecordingListener()
+        r = Urllib2HTTPRequest('http://localhost',
+                               retry_policy=self._retry_policy(sleeps),
+                               listener=[listener])
+        resp = r.get('/test')
+        self.assertEqual(resp.read(), 'foo')
+        self.assertEqual(len(sleeps), 1)
+        self.assertTrue(0 <= sleeps[0] <= 0.5)
+        self.assertEqual(listener.retries, [('GET', 1, 503)])
+        self.assertEqual(listener.codes, [503, 200])
+
+    @GET('http://localhost/test', text='error', code=503, Retry_After='7')
+    @GET('http://localhost/test', text='error', code=429, Retry_After='60')
+    def test_retry2(self):
+        """honour the Retry-After header"""
+        sleeps = []
+        r = Urllib2HTTPRequest('http://localhost',
+                               retry_policy=self._retry_policy(sleeps))
+        # the second Retry-After exceeds max_backoff
+        self.assertRaises(HTTPError, r.get, '/test')
+        self.assertEqual(sleeps, [7.0])
+
+    @POST('http://localhost/test', text='error', code=503, exp='foo')
+    def test_retry3(self):
+        """a POST request is not retried (by default)"""
+        sleeps = []
+        r = Urllib2HTTPRequest('http://localhost',
+                               retry_policy=self._retry_policy(sleeps))
+        with self.assertRaises(HTTPError) as cm:
+            r.post('/test', data='foo')
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(sleeps, [])
+
+    @PUT('http://localhost/test', text='error', code=502, exp='foo')
+    @PUT('http://localhost/test', text='error', code=504, exp='foo')
+    def test_retry4(self):
+        """give up after the maximum number of retries"""
+        sleeps = []
+        listener = RecordingListener()
+        policy = self._retry_policy(sleeps, retries=1)
+        r = Urllib2HTTPRequest('http://localhost', retry_policy=policy,
+                               listener=[listener])
+        with self.assertRaises(HTTPError) as cm:
+            r.put('/test', data='foo')
+        self.assertEqual(cm.exception.code, 504)
+        self.assertEqual(len(sleeps), 1)
+        self.assertEqual(listener.retries, [('PUT', 1, 502)])
+        self.assertEqual(listener.codes, [502, 504])
+
+    @GET('http://localhost/test', text='error', code=404)
+    def test_retry5(self):
+        """a 404 response is not retried"""
+        sleeps = []
+        r = Urllib2HTTPRequest('http://localhost',
+                               retry_policy=self._retry_policy(sleeps))
+        self.assertRaises(HTTPError, r.get, '/test')
+        self.assertEqual(sleeps, [])
+
+    @GET('http://localhost/test', text='error', code=503)
+    @GET('http://localhost/test', text='error', code=500)
+    @GET('http://localhost/test', text='foo')
+    def test_circuit_breaker1(self):
+        """open the circuit breaker after subsequent failures"""
+        r = Urllib2HTTPRequest('http://localhost', breaker_threshold=2,
+                               retry_policy=RetryPolicy(retries=0))
+        self.assertRaises(HTTPError, r.get, '/test')
+        breaker = r.circuit_breaker('http://localhost/foo')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertRaises(HTTPError, r.get, '/test')
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        # no request is issued
+        with self.assertRaises(CircuitOpenError) as cm:
+            r.get('/test')
+        self.assertEqual(cm.exception.apiurl, 'http://localhost')
+        # allow a trial request
+        breaker.reset_timeout = 0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(r.get('/test').read(), 'foo')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_circuit_breaker2(self):
+        """test the half-open state"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # only a single trial request is allowed
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(False)
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        r = Urllib2HTTPRequest('http://localhost', breaker_threshold=0)
+        self.assertIsNone(r.circuit_breaker('http://localhost'))
+
+    def test_circuit_breaker3(self):
+        """an unexpected exception finishes the trial request"""
+        class InterruptingLimiter(RequestLimiter):
+            def slot(self, apiurl):
+                raise KeyboardInterrupt()
+
+        r = Urllib2HTTPRequest('http://localhost', breaker_threshold=1,
+                               breaker_timeout=0,
+                               request_limiter=InterruptingLimiter())
+        breaker = r.circuit_breaker('http://localhost')
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertRaises(KeyboardInterrupt, r.get, '/test')
+        # the next trial request is allowed
+        self.assertTrue(breaker.allow())
+
+    @PUT('http://localhost/test', text='ok', exp='some data',
+         exp_headers={'Content-length': '9', 'Transfer-encoding': None})
+    def test_stream1(self):
+        """stream a file-like object (known size)"""
+        progress = []
+        r = Urllib2HTTPRequest('http://localhost', upload_blocksize=4)
+        resp = r.put('/test', data=StringIO('some data'),
+                     progress=lambda sent, total: progress.append((sent,
+                                                                   total)))
+        self.assertEqual(resp.read(), 'ok')
+        self.assertEqual(progress, [(4, 9), (8, 9), (9, 9)])
+
+    @POST('http://localhost/test', text='ok', exp='foobarbaz',
+          exp_headers={'Content-length': None,
+                       'Transfer-encoding': 'chunked'})
+    def test_stream2(self):
+        """stream an iterable (chunked transfer encoding)"""
+        progress = []
+        r = Urllib2HTTPRequest('http://localhost')
+        resp = r.post('/test', data=iter(['foo', '', 'bar', 'baz']),
+                      progress=lambda sent, total: progress.append((sent,
+                                                                    total)))
+        self.assertEqual(resp.read(), 'ok')
+        self.assertEqual(progress, [(3, -1), (6, -1), (9, -1)])
+
+    @PUT('http://localhost/test', text='error', code=503, exp='this is a test',
+         exp_headers={'Content-length': '14'})
+    @PUT('http://localhost/test', text='ok', exp='this is a test',
+         exp_headers={'Content-length': '14'})
+    def test_stream3(self):
+        """a rewindable stream is retried"""
+        sleeps = []
+        fobj = open(self.fixture_file('stream'), 'w+')
+        fobj.write('skip: this is a test')
+        fobj.seek(6)
+        r = Urllib2HTTPRequest('http://localhost',
+                               retry_policy=self._retry_policy(sleeps))
+        resp = r.put('/test', data=fobj)
+        self.assertEqual(resp.read(), 'ok')
+        self.assertEqual(len(sleeps), 1)
+        fobj.close()
+
+    def test_stream4(self):
+        """test StreamingUpload"""
+        data = StreamingUpload(iter(['foo', 'x' * 20]))
+        self.assertTrue(data.chunked)
+        self.assertFalse(data.rewindable)
+        self.assertEqual(data.read(), '3\r\nfoo\r\n')
+        self.assertEqual(data.read(), '14\r\n%s\r\n' % ('x' * 20))
+        self.assertEqual(data.read(), '0\r\n\r\n')
+        self.assertEqual(data.read(), '')
+        self.assertRaises(ValueError, data.rewind)
+        data = StreamingUpload(StringIO('foobar'), blocksize=4)
+        self.assertEqual(data.size, 6)
+        self.assertEqual(data.read(), 'foob')
+        data.rewind()
+        self.assertEqual(data.read(), 'foob')
+        self.assertEqual(data.read(), 'ar')
+        self.assertEqual(data.read(), '')
+        r = Urllib2HTTPRequest('http://localhost')
+        self.assertRaises(ValueError, r.post, '/test', data=StringIO('foo'),
+                          urlencoded=True)
+
+    @PUT('http://localhost/test', text='ok', exp='piped data',
+         exp_headers={'Content-length': None,
+                      'Transfer-encoding': 'chunked'})
+    def test_stream5(self):
+        """stream a non-seekable file (pipe)"""
+        def pipe(data):
+            rfd, wfd = os.pipe()
+            os.write(wfd, data)
+            os.close(wfd)
+            return os.fdopen(rfd, 'r')
+
+        fobj = pipe('foo')
+        data = StreamingUpload(fobj)
+        self.assertTrue(data.chunked)
+        self.assertFalse(data.rewindable)
+        self.assertRaises(ValueError, data.rewind)
+        fobj.close()
+        fobj = pipe('piped data')
+        r = Urllib2HTTPRequest('http://localhost')
+        resp = r.put('/test', data=fobj)
+        self.assertEqual(resp.read(), 'ok')
+        fobj.close()
+
+    def test_stream6(self):
+        """the mmap arguments are deprecated"""
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            Urllib2HTTPRequest('http://localhost')
+            self.assertEqual(w, [])
+            Urllib2HTTPRequest('http://localhost', mmap=False)
+            self.assertEqual(len(w), 1)
+            self.assertTrue(issubclass(w[0].category, DeprecationWarning))
+
+    @GET('http://localhost/test?foo=bar', text='foo', etag='abc')
+    @PUT('http://localhost/test', text='ok', exp='data')
+    def test_async1(self):
+        """issue requests without blocking"""
+        r = AsyncHTTPRequest(Urllib2HTTPRequest('http://localhost'),
+                             max_workers=1)
+        # with a single worker, the requests are issued in order
+        f1 = r.get('/test', foo='bar')
+        f2 = r.put('/test', data='data')
+        resp = f1.result()
+        self.assertIsInstance(resp, AsyncHTTPResponse)
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(resp.headers['etag'], 'abc')
+        self.assertEqual(resp.read().result(), 'foo')
+        self.assertEqual(f2.result().read(2).result(), 'ok')
+        r.pool.shutdown()
+
+    @GET('http://localhost/test', text='foo')
+    def test_async2(self):
+        """a worker can wait for a read (no deadlock)"""
+        r = AsyncHTTPRequest(Urllib2HTTPRequest('http://localhost'),
+                             max_workers=1)
+        resp = r.get('/test').result()
+        # the single request worker blocks until the read is finished
+        future = r.submit(lambda: resp.read().result(timeout=5))
+        self.assertEqual(future.result(timeout=5), 'foo')
+        r.pool.shutdown()
+
+    def test_token_bucket1(self):
+        """test the token bucket"""
+        now = [0.0]
+        sleeps = []
+        bucket = TokenBucket(2, burst=2, clock=lambda: now[0],
+                             sleep=sleeps.append)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.0)
+        # the bucket is empty: wait for the next token
+        self.assertEqual(bucket.acquire(), 0.5)
+        # the token for the next call is reserved as well
+        self.assertEqual(bucket.acquire(), 1.0)
+        self.assertEqual(sleeps, [0.5, 1.0])
+        now[0] = 10.0
+        # the bucket holds at most burst tokens
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.5)
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+    def test_request_limiter1(self):
+        """limit the number of in-flight requests per apiurl"""
+        limiter = RequestLimiter(max_in_flight=1)
+        entered = threading.Event()
+        done = []
+
+        def issue():
+            with limiter.slot('http://localhost'):
+                entered.set()
+                done.append(True)
+
+        with limiter.slot('http://localhost'):
+            # the limit is per apiurl
+            with limiter.slot('http://example.com'):
+                pass
+            t = threading.Thread(target=issue)
+            t.start()
+            self.assertFalse(entered.wait(0.1))
+            self.assertEqual(done, [])
+        t.join()
+        self.assertEqual(done, [True])
+
+    @GET('http://localhost/test', text='foo')
+    @GET('http://localhost/test', text='bar')
+    @GET('http://localhost/test', text='baz')
+    def test_request_limiter2(self):
+        """rate limit the requests of a request object"""
+        sleeps = []
+        limiter = RequestLimiter(rate=1, burst=2, sleep=sleeps.append)
+        r = Urllib2HTTPRequest('http://localhost', request_limiter=limiter)
+        self.assertEqual(r.get('/test').read(), 'foo')
+        self.assertEqual(r.get('/test').read(), 'bar')
+        self.assertEqual(sleeps, [])
+        self.assertEqual(r.get('/test').read(), 'baz')
+        self.assertEqual(len(sleeps), 1)
+        self.assertTrue(0.9 < sleeps[0] <= 1.0)
+
     @GET('http://localhost/test', text='foo',
          exp_headers={'Authorization': 'Basic Zm9vOmJhcg=='})
     def test_basic_auth_handler1(self):
@@ -1,6 +1,8 @@
 import os
+import zlib
 import unittest
 import stat
+import hashlib
 from cStringIO import StringIO, OutputType
 
 from lxml import etree
@@ -8,6 +10,7 @@ from lxml import etree
 from osc2.remote import (RemoteProject, RemotePackage, Request,
                          RORemoteFile, RWRemoteFile, RWLocalFile,
                          RemotePerson, RemoteGroup)
+from osc2.httprequest import HTTPError
 from test.osctest import OscTest
 from test.httptest import GET, PUT, POST, DELETE
 
@@ -47,6 +50,20 @@ class TestRemoteModel(OscTest):
         self.assertEqual(prj.person[1].get('userid'), 'foobar')
         self.assertEqual(prj.person[1].get('role'), 'bugowner')
 
+    @GET('http://localhost/source/foo/_meta', file='project.xml')
+    def test_project_async1(self):
+        """get a remote project without blocking"""
+        future = RemoteProject.find_async('foo')
+        prj = future.result()
+        self.assertEqual(prj.title, 'just a dummy title')
+
+    @GET('http://localhost/source/foo/_meta', text='<invalid', code=404)
+    def test_project_async2(self):
+        """the exception is raised by the future's result method"""
+        future = RemoteProject.find_async('foo')
+        self.assertIsInstance(future.exception(), HTTPError)
+        self.assertRaises(HTTPError, future.result)
+
     @PUT('http://localhost/source/foo/_meta', text='OK', expfile='project.xml',
          exp_content_type='application/xml')
     def test_project2(self):
@@ -712,6 +729,37 @@ class TestRemoteModel(OscTest):
         f = RORemoteFile('/path/to/file', lazy_open=False)
         f.close()
 
+    @GET('http://localhost/source/project/package/fname2', file='remotefile2')
+    def test_remotefile8(self):
+        """store file and calculate its md5 and sha1"""
+        f = RORemoteFile('/source/project/package/fname2')
+        sio = StringIO()
+        digests = f.write_to(sio, hashes=[hashlib.md5(), hashlib.sha1()])
+        self.assertEqual(sio.getvalue(), 'yet another\nsimple\nfile\n')
+        self.assertEqual(digests,
+                         [hashlib.md5(sio.getvalue()).hexdigest(),
+                          hashlib.sha1(sio.getvalue()).hexdigest()])
+
+    @GET('http://localhost/source/project/package/fname2',
+         text=zlib.compress('yet another\nsimple\nfile\n'),
+         Content_Encoding='deflate', Content_Length='30')
+    def test_remotefile9(self):
+        """compressed response (the compressed size is used)"""
+        f = RORemoteFile('/source/project/package/fname2', lazy_open=False)
+        self.assertEqual(f._remote_size, 30)
+        self.assertEqual(f.read(), 'yet another\nsimple\nfile\n')
+        f.close()
+
+    @GET('http://localhost/source/project/package/fname2', file='remotefile2')
+    def test_remotefile10(self):
+        """write file without blocking"""
+        f = RORemoteFile('/source/project/package/fname2')
+        sio = StringIO()
+        future = f.write_to_async(sio, hashes=[hashlib.md5()])
+        digests = future.result()
+        self.assertEqual(sio.getvalue(), 'yet another\nsimple\nfile\n')
+        self.assertEqual(digests, [hashlib.md5(sio.getvalue()).hexdigest()])
+
     @GET('http://localhost/source/project/package/fname?rev=123',
          file='remotefile1', Content_Length='52')
     def test_rwremotefile1(self):
@@ -871,6 +919,33 @@ class TestRemoteModel(OscTest):
         # no write back is issued
         f.close(foo='bar')
 
+    @GET('http://localhost/source/project/package/fname',
+         text=zlib.compress('compressed\n' * 1000), Content_Length='80',
+         Content_Encoding='deflate')
+    def test_rwremotefile12(self):
+        """read a compressed file (tmpfile)"""
+        f = RWRemoteFile('/source/project/package/fname', tmp_size=50)
+        self.assertEqual(f.readline(), 'compressed\n')
+        # the size of the compressed data selects the tmpfile
+        self.assertTrue(os.path.exists(f._fobj.name))
+        f.seek(0, os.SEEK_SET)
+        self.assertEqual(f.read(), 'compressed\n' * 1000)
+        f.close()
+
+    @GET('http://localhost/source/project/package/fname',
+         text=zlib.compress('compressed\n' * 1000),
+         Content_Encoding='deflate')
+    @PUT('http://localhost/source/project/package/fname', text='ok',
+         exp='modified\n  ' + 'compressed\n' * 999)
+    def test_rwremotefile13(self):
+        """read a file of unknown size (tmpfile)"""
+        f = RWRemoteFile('/source/project/package/fname', tmp_size=50)
+        self.assertEqual(f.readline(), 'compressed\n')
+        self.assertTrue(os.path.exists(f._fobj.name))
+        f.seek(0, os.SEEK_SET)
+        f.write('modified\n  ')
+        f.close()
+
     @PUT('http://localhost/foo/bar?foo=bar', text='ok',
          exp='some data')
     def test_rwlocalfile1(self):
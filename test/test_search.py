@@ -2,7 +2,8 @@ import unittest
 
 from lxml import etree
 
-from osc2.search import find_request, RequestCollection
+from osc2.search import (find_request, RequestCollection, _relative_xpath,
+                         iterfind_request, RORequest)
 from osc2.util.xpath import XPathBuilder
 from test.osctest import OscTest
 from test.httptest import GET
@@ -85,5 +86,123 @@ class TestSearch(OscTest):
         xp = xpb.state[xpb.attr('name') == 'declined']
         self.assertRaises(etree.DocumentInvalid, find_request, xp)
 
+    @GET(('http://localhost/search/request?match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D'),
+         file='collection_request1.xml')
+    def test_request_local1(self):
+        """test local evaluation (filter)"""
+        xpb = XPathBuilder()
+        collection = find_request(xpb.state[xpb.attr('name') == 'new'])
+        xp = xpb.action.source[xpb.attr('package') == 'some_package']
+        res = collection.filter(xp)
+        self.assertTrue(isinstance(res, RequestCollection))
+        self.assertEqual(res.get('matches'), '1')
+        self.assertEqual(res.request.get('id'), '42')
+        self.assertEqual([r.get('id') for r in res], ['42'])
+        # the original collection is not modified
+        self.assertTrue(len(collection.request[:]) == 3)
+        self.assertEqual(collection.get('matches'), '3')
+        # nested filter
+        xp = xpb.action.source[xpb.attr('project') == 'foo']
+        res = collection.filter(xp)
+        self.assertEqual(res.get('matches'), '3')
+        res = res.filter('/review[@by_group = "legal-auto" and '
+                         'contains(comment, "even")]')
+        self.assertEqual(res.get('matches'), '1')
+        self.assertEqual(res.request.get('id'), '108')
+
+    @GET(('http://localhost/search/request?match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D'),
+         file='collection_request1.xml')
+    def test_request_local2(self):
+        """test local evaluation (collection keyword)"""
+        xpb = XPathBuilder()
+        collection = find_request(xpb.state[xpb.attr('name') == 'new'])
+        xp = xpb.state[(xpb.attr('name') == 'new')
+                       | (xpb.attr('name') == 'review')]
+        xp = xp & (xpb.action.target[xpb.attr('project') == 'prj']
+                   | xpb.action.source[xpb.attr('project') == 'prj']
+                  ).parenthesize()
+        # no http request is issued
+        res = find_request(xp, collection=collection)
+        self.assertEqual(res.get('matches'), '0')
+        self.assertTrue(len(res.findall('request')) == 0)
+        xp = xpb.action.target[xpb.attr('project') == 'openSUSE:Factory']
+        res = find_request(xp, collection=collection)
+        self.assertEqual([r.get('id') for r in res], ['1', '42', '108'])
+
+    def test_relative_xpath(self):
+        """test the conversion of absolute location paths"""
+        xpath = ('/state[@name = "/x"] and (/action/target[@a = \'/\'] '
+                 'or //source|/foo[./bar])')
+        exp = ('./state[@name = "/x"] and (./action/target[@a = \'/\'] '
+               'or .//source|./foo[./bar])')
+        self.assertEqual(_relative_xpath(xpath), exp)
+
+    @GET(('http://localhost/search/request?match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D'),
+         file='collection_request1.xml')
+    def test_iterfind_request1(self):
+        """test iterfind_request (no paging)"""
+        xpb = XPathBuilder()
+        xp = xpb.state[xpb.attr('name') == 'new']
+        requests = list(iterfind_request(xp))
+        self.assertEqual([r.get('id') for r in requests], ['1', '42', '108'])
+        self.assertTrue(isinstance(requests[0], RORequest))
+        # yielded objects are independent copies
+        self.assertEqual(requests[0].action.source.get('project'), 'foo')
+        self.assertEqual(requests[2].review[2].get('by_group'),
+                         'autobuild-team')
+        self.assertEqual(requests[1].real_obj().get('id'), '42')
+
+    @GET(('http://localhost/search/request?limit=2&match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D&offset=0'),
+         text=('<collection matches="2"><request id="1"/>'
+               '<request id="2"/></collection>'))
+    @GET(('http://localhost/search/request?limit=2&match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D&offset=2'),
+         text=('<collection matches="2"><request id="3"/>'
+               '<request id="4"/></collection>'))
+    @GET(('http://localhost/search/request?limit=2&match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D&offset=4'),
+         text='<collection matches="1"><request id="5"/></collection>')
+    def test_iterfind_request2(self):
+        """test iterfind_request (paging)"""
+        xp = '/state[@name = "new"]'
+        ids = [r.get('id') for r in iterfind_request(xp, page_size=2)]
+        self.assertEqual(ids, ['1', '2', '3', '4', '5'])
+
+    @GET(('http://localhost/search/request?limit=2&match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D&offset=0'),
+         file='collection_request1.xml')
+    def test_iterfind_request3(self):
+        """test iterfind_request (server does not support paging)"""
+        xp = '/state[@name = "new"]'
+        ids = [r.get('id') for r in iterfind_request(xp, page_size=2)]
+        self.assertEqual(ids, ['1', '42', '108'])
+
+    @GET(('http://localhost/search/request?match='
+          '%2Fstate%5B%40name+%3D+%22declined%22%5D'),
+         text='<collection matches="1"><foo /></collection>')
+    def test_iterfind_request4(self):
+        """test iterfind_request (validation fails)"""
+        RequestCollection.SCHEMA = self.fixture_file('collection_request.xsd')
+        xp = '/state[@name = "declined"]'
+        self.assertRaises(etree.DocumentInvalid, list, iterfind_request(xp))
+
+    @GET(('http://localhost/search/request?limit=2&match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D&offset=0'),
+         text=('<collection matches="2"><request id="1"/>'
+               '<request id="2"/></collection>'))
+    @GET(('http://localhost/search/request?limit=2&match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D&offset=2'),
+         text=('<collection matches="2"><request id="1"/>'
+               '<request id="2"/></collection>'))
+    def test_iterfind_request5(self):
+        """test iterfind_request (server ignores the paging parameters)"""
+        xp = '/state[@name = "new"]'
+        ids = [r.get('id') for r in iterfind_request(xp, page_size=2)]
+        self.assertEqual(ids, ['1', '2'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,9 @@ import unittest
 
 from lxml import etree
 
-from osc2.source import Project, Package
+from osc2.httpcache import ValidatorStore
+from osc2.httprequest import NotModifiedError
+from osc2.source import Project, Package, Directory
 from test.osctest import OscTest
 from test.httptest import GET
 
@@ -116,5 +118,55 @@ class TestSource(OscTest):
         self.assertEqual(log.revision[1].comment, 'request')
         self.assertEqual(log.revision[1].requestid, '123')
 
+    @GET('http://localhost/source/foo/bar', file='file_list.xml')
+    def test8(self):
+        """list files without blocking"""
+        pkg = Package('foo', 'bar')
+        future = pkg.list_async()
+        directory = future.result()
+        self.assertEqual(directory.get('project'), 'foo')
+        self.assertEqual(directory.get('name'), 'osc')
+
+    @GET('http://localhost/source/foo?view=info', file='pkg_info.xml')
+    def test9(self):
+        """test source info of all packages"""
+        prj = Project('foo')
+        infos = prj.info()
+        self.assertEqual(len(infos), 2)
+        self.assertEqual(infos[0].get('package'), 'osc')
+        self.assertEqual(infos[0].get('srcmd5'),
+                         'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa')
+        self.assertIsNone(infos[0].get('lsrcmd5'))
+        self.assertEqual(infos[1].get('package'), 'glibc')
+        self.assertEqual(infos[1].get('lsrcmd5'),
+                         'cccccccccccccccccccccccccccccccc')
+
+    @GET('http://localhost/source/foo/bar?rev=latest', file='file_list.xml',
+         ETag='"abc"')
+    @GET('http://localhost/source/foo/bar?rev=latest', code=304, text='',
+         exp_headers={'If-None-Match': '"abc"'})
+    def test10(self):
+        """list files (not modified; the cached xml is not shared)"""
+        store = ValidatorStore()
+        pkg = Package('foo', 'bar')
+        directory = pkg.list(rev='latest', cache=False, validator_store=store)
+        self.assertEqual(directory.get('project'), 'foo')
+        directory.set('name', 'modified')
+        cached = pkg.list(rev='latest', cache=False, validator_store=store)
+        self.assertTrue(cached is not directory)
+        self.assertTrue(isinstance(cached, Directory))
+        self.assertEqual(cached.get('name'), 'osc')
+        self.assertEqual(cached.get('project'), 'foo')
+        validators = store.get('http://localhost/source/foo/bar?rev=latest')
+        self.assertIsNone(validators.value.get('project'))
+
+    @GET('http://localhost/source/foo/bar', code=304, text='',
+         exp_headers={'If-None-Match': '"abc"'})
+    def test11(self):
+        """list files (not modified, but no validator store)"""
+        pkg = Package('foo', 'bar')
+        self.assertRaises(NotModifiedError, pkg.list, cache=False,
+                          if_none_match='"abc"')
+
 if __name__ == '__main__':
     unittest.main()
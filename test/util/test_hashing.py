@@ -0,0 +1,86 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from osc2.util.hashing import (file_md5, MD5Hasher, MMAP_THRESHOLD,
+                               default_hasher)
+from test.osctest import OscTestCase
+
+
+def suite():
+    return unittest.makeSuite(TestHashing)
+
+
+class TestHashing(OscTestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp(prefix='osc_test')
+        self.files = {}
+        sizes = (0, 10, MMAP_THRESHOLD, 3 * MMAP_THRESHOLD + 7)
+        for size in sizes:
+            data = os.urandom(size)
+            fname = os.path.join(self._tmp_dir, "file%d" % size)
+            with open(fname, 'wb') as f:
+                f.write(data)
+            self.files[fname] = hashlib.md5(data).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test1(self):
+        """test file_md5 (read and mmap'ed)"""
+        for fname, md5 in self.files.iteritems():
+            self.assertEqual(file_md5(fname), md5)
+            self.assertEqual(file_md5(fname, use_mmap=True), md5)
+        self.assertRaises(ValueError, file_md5, self._tmp_dir)
+        nonexistent = os.path.join(self._tmp_dir, 'nonexistent')
+        self.assertRaises(ValueError, file_md5, nonexistent)
+
+    def test2(self):
+        """test md5sums (thread pool)"""
+        hasher = MD5Hasher(workers=3)
+        self.assertEqual(hasher.md5sums(self.files.keys()), self.files)
+        self.assertEqual(hasher.md5sums([]), {})
+        self.assertRaises(ValueError, MD5Hasher, workers=0)
+
+    def test2_1(self):
+        """test md5sums (the thread pool is shared by all callers)"""
+        hasher = MD5Hasher(workers=2)
+        results = []
+
+        def md5sums():
+            results.append(hasher.md5sums(self.files.keys()))
+
+        threads = [threading.Thread(target=md5sums) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [self.files] * 4)
+        self.assertTrue(len(hasher._pool._threads) <= 2)
+
+    def test2_2(self):
+        """test the shared hasher"""
+        hasher = default_hasher()
+        self.assertTrue(default_hasher() is hasher)
+        self.assertEqual(hasher.md5sums(self.files.keys()), self.files)
+
+    def test3(self):
+        """test md5sums (process pool)"""
+        hasher = MD5Hasher(workers=2, processes=True)
+        try:
+            self.assertEqual(hasher.md5sums(self.files.keys()), self.files)
+            # the pool is reused
+            pool = hasher._pool
+            self.assertEqual(hasher.md5sums(self.files.keys()), self.files)
+            self.assertTrue(hasher._pool is pool)
+            fnames = self.files.keys() + [self._tmp_dir]
+            self.assertRaises(ValueError, hasher.md5sums, fnames)
+        finally:
+            hasher.close()
+        self.assertRaises(ValueError, hasher.md5sums, self.files.keys())
+
+if __name__ == '__main__':
+    unittest.main()
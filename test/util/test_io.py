@@ -2,9 +2,12 @@ import unittest
 import os
 import sys
 import tempfile
+import hashlib
 from cStringIO import StringIO
 
-from osc2.util.io import TemporaryDirectory, mkdtemp, mkstemp
+from osc2.util import io
+from osc2.util.io import (TemporaryDirectory, mkdtemp, mkstemp, copy_file,
+                        iter_read)
 from test.osctest import OscTestCase
 
 
@@ -290,5 +293,109 @@ class TestIO(OscTestCase):
                 self.assertEqual(f.read(), 'foobar')
         self.assertFalse(os.path.isfile(tmpfile))
 
+    def _copy_file_tests(self):
+        """performs the actual copy_file tests"""
+        data = 'foo\nbar\n' * 4096
+        with mkdtemp(dir=self._tmpdir) as tmpdir:
+            source = os.path.join(tmpdir, 'source')
+            with open(source, 'w') as f:
+                f.write(data)
+            # filename to filename
+            dest = os.path.join(tmpdir, 'dest')
+            copy_file(source, dest, mtime=42, mode=0600)
+            with open(dest, 'r') as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(os.stat(dest).st_mtime, 42)
+            self.assertEqual(os.stat(dest).st_mode & 0777, 0600)
+            # copy only size bytes
+            copy_file(source, dest, size=6)
+            with open(dest, 'r') as f:
+                self.assertEqual(f.read(), 'foo\nba')
+            # file objects (the positions have to be respected/updated)
+            with open(source, 'r') as fsource:
+                with open(dest, 'w') as fdest:
+                    fdest.write('x')
+                    self.assertEqual(fsource.read(4), 'foo\n')
+                    copy_file(fsource, fdest, size=4)
+                    self.assertEqual(fsource.tell(), 8)
+                    self.assertEqual(fdest.tell(), 5)
+                    fdest.write('y')
+                    self.assertEqual(fsource.read(4), 'foo\n')
+            with open(dest, 'r') as f:
+                self.assertEqual(f.read(), 'xbar\ny')
+            # file-like object
+            sio = StringIO()
+            copy_file(source, sio)
+            self.assertEqual(sio.getvalue(), data)
+            self.assertEqual(''.join(iter_read(source, bufsize=7)), data)
+
+    def test_copy_file1(self):
+        """test copy_file (kernel-assisted copy, if available)"""
+        self._copy_file_tests()
+
+    def test_copy_file2(self):
+        """test copy_file (buffered copy)"""
+        funcs = io._KERNEL_COPY_FUNCS[:]
+        reflink = io._reflink
+        io._KERNEL_COPY_FUNCS[:] = []
+        io._reflink = lambda src_fd, dst_fd: False
+        try:
+            self._copy_file_tests()
+        finally:
+            io._KERNEL_COPY_FUNCS[:] = funcs
+            io._reflink = reflink
+
+    def test_copy_file3(self):
+        """test copy_file (nonexistent source)"""
+        self.assertRaises(ValueError, copy_file,
+                          os.path.join(self._tmpdir, 'nonexistent'),
+                          os.path.join(self._tmpdir, 'dest'))
+
+    def test_copy_file4(self):
+        """test copy_file and iter_read with hashes"""
+        data = 'foo\nbar\n' * 4096
+        md5 = hashlib.md5(data).hexdigest()
+        sha1 = hashlib.sha1(data).hexdigest()
+        with mkdtemp(dir=self._tmpdir) as tmpdir:
+            source = os.path.join(tmpdir, 'source')
+            with open(source, 'w') as f:
+                f.write(data)
+            dest = os.path.join(tmpdir, 'dest')
+            digests = copy_file(source, dest,
+                                hashes=[hashlib.md5(), hashlib.sha1()])
+            self.assertEqual(digests, [md5, sha1])
+            with open(dest, 'r') as f:
+                self.assertEqual(f.read(), data)
+            # only the copied data is hashed
+            sio = StringIO()
+            digests = copy_file(source, sio, size=4, hashes=[hashlib.md5()])
+            self.assertEqual(digests, [hashlib.md5('foo\n').hexdigest()])
+            # no hashes
+            self.assertEqual(copy_file(source, dest), [])
+            h = hashlib.md5()
+            self.assertEqual(''.join(iter_read(source, hashes=[h])), data)
+            self.assertEqual(h.hexdigest(), md5)
+
+    def test_copy_file5(self):
+        """test copy_file (dest object with a file attribute)"""
+        class Wrapper(object):
+            def __init__(self):
+                self.file = StringIO()
+                self.data = []
+
+            def write(self, data):
+                self.data.append(data)
+
+        data = 'foo\nbar\n' * 4096
+        with mkdtemp(dir=self._tmpdir) as tmpdir:
+            source = os.path.join(tmpdir, 'source')
+            with open(source, 'w') as f:
+                f.write(data)
+            dest = Wrapper()
+            copy_file(source, dest)
+            # the dest object is not unwrapped
+            self.assertEqual(''.join(dest.data), data)
+            self.assertEqual(dest.file.getvalue(), '')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,79 @@
+import threading
+import unittest
+
+from osc2.util.pool import Future, ThreadPool, as_completed, wait_all
+from test.osctest import OscTestCase
+
+
+def suite():
+    return unittest.makeSuite(TestPool)
+
+
+def fail(msg):
+    raise ValueError(msg)
+
+
+class TestPool(OscTestCase):
+    def test_future1(self):
+        """test a future's result and callbacks"""
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assertFalse(future.done())
+        self.assertRaises(RuntimeError, future.result, timeout=0.01)
+        future.set_result(42)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 42)
+        self.assertIsNone(future.exception())
+        self.assertEqual(called, [future])
+        # a finished future calls the callback immediately
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [future, future])
+
+    def test_pool1(self):
+        """execute callables in the pool"""
+        with ThreadPool(max_workers=2) as pool:
+            futures = [pool.submit(pow, i, 2) for i in range(10)]
+            self.assertEqual(wait_all(futures), [i * i for i in range(10)])
+            self.assertEqual(pool.map(pow, [2, 3], [3, 2]), [8, 9])
+            self.assertTrue(len(pool._threads) <= 2)
+        self.assertRaises(RuntimeError, pool.submit, pow, 2, 2)
+        self.assertRaises(ValueError, ThreadPool, 0)
+
+    def test_pool2(self):
+        """the exception is reraised by the future's result method"""
+        with ThreadPool() as pool:
+            future = pool.submit(fail, 'foo')
+            self.assertIsInstance(future.exception(), ValueError)
+            self.assertRaises(ValueError, future.result)
+            futures = [pool.submit(pow, 2, 2), future]
+            self.assertRaises(ValueError, wait_all, futures)
+
+    def test_pool3(self):
+        """the callables are executed concurrently"""
+        event = threading.Event()
+        with ThreadPool(max_workers=2) as pool:
+            blocked = pool.submit(event.wait, 5)
+            future = pool.submit(pow, 2, 3)
+            self.assertEqual(future.result(timeout=5), 8)
+            self.assertFalse(blocked.done())
+            event.set()
+            futures = list(as_completed([blocked, future]))
+            self.assertEqual(set(futures), set([blocked, future]))
+
+    def test_pool4(self):
+        """a failing done callback does not kill the worker"""
+        event = threading.Event()
+        called = []
+        with ThreadPool(max_workers=1) as pool:
+            future = pool.submit(event.wait, 5)
+            future.add_done_callback(fail)
+            future.add_done_callback(called.append)
+            event.set()
+            self.assertTrue(future.result())
+            # the worker is still alive
+            self.assertEqual(pool.submit(pow, 2, 3).result(timeout=5), 8)
+            self.assertEqual(called, [future])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,13 @@
+import os
+import threading
 import unittest
 from collections import Sequence
 
-from osc2.util.xml import fromstring
+from lxml import etree
+
+from osc2.util.xml import (fromstring, get_schema, assert_valid, get_parser,
+                            OscElement, _XPathCache)
+from osc2.util.io import mkdtemp
 from test.osctest import OscTestCase
 
 
@@ -83,9 +89,102 @@ class TestXML(OscTestCase):
         data = self.xml.findall('2 + 3')
         self.assertEqual(data, 5.0)
 
+    def test_find_first_match(self):
+        """find returns the first match in document order"""
+        elm = self.xml.find('//foo | //bar')
+        self.assertTrue(elm is self.xml.foo)
+        elm = self.xml.find('foo/bar[not(@name)]')
+        self.assertTrue(elm is self.xml.foo.bar[1])
+
+    def test_find_cached(self):
+        """find and findall results do not depend on the cache"""
+        for _ in range(2):
+            self.assertEqual(self.xml.find('//bar').get('name'), 'xyz')
+            self.assertEqual(len(self.xml.findall('//bar')), 3)
+            self.assertEqual(self.xml.find('count(//bar)'), 3.0)
+            self.assertIsNone(self.xml.find('nonexistent'))
+
+    def test_xpath_cache(self):
+        """test the xpath lru cache"""
+        cache = _XPathCache(maxsize=2)
+        foo = cache.get('foo')
+        self.assertTrue(cache.get('foo') is foo)
+        # first and non-first expressions are different entries
+        foo_first = cache.get('foo', first=True)
+        self.assertFalse(foo_first is foo)
+        self.assertTrue(cache.get('foo') is foo)
+        # evicts the least recently used entry (foo_first)
+        cache.get('bar')
+        self.assertTrue(cache.get('foo') is foo)
+        self.assertFalse(cache.get('foo', first=True) is foo_first)
+        cache.clear()
+        self.assertFalse(cache.get('foo') is foo)
+
     def test_iterfind(self):
         """iterfind is not overriden (the default does not support an xpath)"""
         self.assertRaises(SyntaxError, self.xml.iterfind, '//foo')
 
+    def _write_schema(self, filename, root_name):
+        with open(filename, 'w') as f:
+            f.write('<element name="%s" '
+                    'xmlns="http://relaxng.org/ns/structure/1.0">'
+                    '<empty/></element>' % root_name)
+
+    def test_schema_cache1(self):
+        """a schema is compiled only once"""
+        with mkdtemp() as tmpdir:
+            filename = os.path.join(tmpdir, 'schema.rng')
+            self._write_schema(filename, 'root')
+            schema = get_schema(filename)
+            self.assertTrue(isinstance(schema, etree.RelaxNG))
+            self.assertTrue(get_schema(filename) is schema)
+            # relative and absolute paths share the same entry
+            cwd = os.getcwd()
+            try:
+                os.chdir(tmpdir)
+                self.assertTrue(get_schema('schema.rng') is schema)
+            finally:
+                os.chdir(cwd)
+
+    def test_schema_cache2(self):
+        """a modified schema file is compiled again"""
+        with mkdtemp() as tmpdir:
+            filename = os.path.join(tmpdir, 'schema.rng')
+            self._write_schema(filename, 'root')
+            os.utime(filename, (-1, 1))
+            schema = get_schema(filename)
+            assert_valid(filename, etree.fromstring('<root/>'))
+            self._write_schema(filename, 'other')
+            os.utime(filename, (-1, 2))
+            self.assertFalse(get_schema(filename) is schema)
+            assert_valid(filename, etree.fromstring('<other/>'))
+            self.assertRaises(etree.DocumentInvalid, assert_valid, filename,
+                              etree.fromstring('<root/>'))
+
+    def test_schema_cache3(self):
+        """unsupported schema file"""
+        self.assertRaises(ValueError, get_schema, 'schema.dtd')
+        self.assertRaises(ValueError, assert_valid, 'schema.dtd',
+                          etree.fromstring('<root/>'))
+
+    def test_parser_cache1(self):
+        """a parser is reused for the same configuration"""
+        parser = get_parser(foo=OscElement)
+        self.assertTrue(get_parser(foo=OscElement) is parser)
+        self.assertFalse(get_parser() is parser)
+        self.assertFalse(get_parser(tree_class=OscElement) is parser)
+        self.assertFalse(get_parser(bar=OscElement) is parser)
+
+    def test_parser_cache2(self):
+        """each thread gets its own parser"""
+        parser = get_parser()
+        parsers = []
+        t = threading.Thread(target=lambda: parsers.append(get_parser()))
+        t.start()
+        t.join()
+        self.assertEqual(len(parsers), 1)
+        self.assertFalse(parsers[0] is parser)
+        self.assertTrue(get_parser() is parser)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,10 @@
 import os
 import unittest
 
-from osc2.util.xpath import XPathBuilder, XPathSyntaxError, Tree
+from lxml import etree
+
+from osc2.util.xpath import (XPathBuilder, XPathSyntaxError, Tree,
+                             XPathTemplate)
 from test.osctest import OscTest
 
 
@@ -621,5 +624,85 @@ class TestXPath(OscTest):
         exp = '/foo/bar[x/y or z]'
         self.assertEqual(xp.tostring(), exp)
 
+    def test_cached_string1(self):
+        """the string representation is cached"""
+        xpb = XPathBuilder()
+        xp = xpb.foo.bar[xpb.attr('name') == 'x']
+        exp = '/foo/bar[@name = "x"]'
+        self.assertEqual(xp.tostring(), exp)
+        self.assertTrue(xp.tostring() is xp.tostring())
+
+    def test_cached_string2(self):
+        """a tree modification invalidates the cached string"""
+        xpb = XPathBuilder()
+        xp = xpb.foo.bar
+        self.assertEqual(xp.tostring(), '/foo/bar')
+        xp = xpb.x.join(xp)
+        self.assertEqual(xp.tostring(), '/x/foo/bar')
+
+    def test_cached_string3(self):
+        """the cached string of an expression is kept per tree"""
+        xpb = XPathBuilder()
+        pred = xpb.attr('a') == 'x'
+        xp = xpb.foo[pred]
+        res = xp.tostring()
+        self.assertEqual(res, '/foo[@a = "x"]')
+        # building another expression does not invalidate the string
+        xpb.bar[xpb.attr('b') == 'y'].tostring()
+        self.assertTrue(xp.tostring() is res)
+        # modifying a descendant invalidates the string
+        other = xpb.attr('a') == 'y'
+        lit = other._children[1]
+        other.remove_child(lit)
+        pred.remove_child(pred._children[1])
+        pred.append_child(lit)
+        self.assertEqual(xp.tostring(), '/foo[@a = "y"]')
+
+    def test_variable1(self):
+        """test a variable reference"""
+        xpb = XPathBuilder()
+        xp = xpb.foo[xpb.attr('name') == xpb.var('name')]
+        self.assertEqual(xp.tostring(), '/foo[@name = $name]')
+
+    def test_template1(self):
+        """test template evaluation"""
+        xpb = XPathBuilder()
+        xp = xpb.descendant('entry')[xpb.attr('name') == xpb.var('name')]
+        tmpl = XPathTemplate(xp)
+        root = etree.fromstring('<r><entry name="a"/><entry name=\'"b\'/></r>')
+        elms = tmpl(root, name='a')
+        self.assertEqual(len(elms), 1)
+        self.assertEqual(elms[0].get('name'), 'a')
+        # no quoting issues
+        elms = tmpl(root, name='"b')
+        self.assertEqual(len(elms), 1)
+        self.assertEqual(tmpl(root, name='c'), [])
+        self.assertTrue(tmpl.compile() is tmpl.compile())
+
+    def test_template2(self):
+        """test template tostring with bound variables"""
+        xpb = XPathBuilder()
+        xp = (xpb.foo[(xpb.attr('name') == xpb.var('name'))
+                      & (xpb.attr('x') == '$name')
+                      & (xpb.attr('y') == xpb.var('num'))])
+        tmpl = XPathTemplate(xp)
+        exp = '/foo[@name = $name and @x = "$name" and @y = $num]'
+        self.assertEqual(tmpl.tostring(), exp)
+        exp = '/foo[@name = "bar" and @x = "$name" and @y = $num]'
+        self.assertEqual(tmpl.tostring(name='bar'), exp)
+        exp = '/foo[@name = "bar" and @x = "$name" and @y = 42]'
+        self.assertEqual(tmpl.tostring(name='bar', num=42), exp)
+
+    def test_template3(self):
+        """a template is hashable"""
+        xpb = XPathBuilder()
+        tmpl1 = XPathTemplate(xpb.foo.bar)
+        tmpl2 = XPathTemplate('/foo/bar')
+        self.assertEqual(tmpl1, tmpl2)
+        self.assertEqual(hash(tmpl1), hash(tmpl2))
+        self.assertNotEqual(tmpl1, XPathTemplate('/foo'))
+        d = {tmpl1: 'x'}
+        self.assertEqual(d[tmpl2], 'x')
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,12 @@
 import os
 import unittest
 
-from osc2.wc.convert import convert_package, convert_project
+from osc2.wc import convert
+from osc2.wc.convert import convert_package, convert_project, convert_store
 from osc2.wc.project import Project
 from osc2.wc.package import Package
-from osc2.wc.util import WCInconsistentError, WCFormatVersionError
+from osc2.wc.util import (WCInconsistentError, WCFormatVersionError,
+                          wc_store_backend)
 from test.osctest import OscTest
 from test.httptest import GET
 
@@ -107,6 +109,79 @@ class TestConvert(OscTest):
         self.assertEqual(pkg.files(), ['add'])
         pkg = prj.package('deleted')
         self.assertEqual(pkg.files(), ['deleted'])
+    def test_store1(self):
+        """test store convert (project)"""
+        path = self.fixture_file('project_1')
+        convert_project(path)
+        self.assertEqual(wc_store_backend(path), 'file')
+        convert_store(path, 'sqlite')
+        self.assertEqual(wc_store_backend(path), 'sqlite')
+        self._exists(path, '_store.db', store=True)
+        self._exists(path, '_version', store=True)
+        self._not_exists(path, '_packages', store=True)
+        self._not_exists(path, '_project', store=True)
+        self._exists(path, 'foo', '_store.db', data=True)
+        self._not_exists(path, 'foo', '_files', data=True)
+        prj = Project(path)
+        self.assertEqual(prj.name, 'project_1')
+        self.assertEqual(prj._status('foo'), ' ')
+        pkg = prj.package('foo')
+        self.assertEqual(pkg.files(), ['file', 'deleted', 'modified',
+                                       'added', 'added2'])
+        self.assertEqual(pkg.status('added'), 'A')
+        # a newly added package uses the project's backend
+        os.mkdir(os.path.join(path, 'new'))
+        prj.add('new')
+        self.assertEqual(prj._status('new'), 'A')
+        self._exists(path, 'new', '_store.db', data=True)
+        # and back again
+        convert_store(path, 'file')
+        self.assertEqual(wc_store_backend(path), 'file')
+        self._not_exists(path, '_store.db', store=True)
+        self._exists(path, '_packages', store=True)
+        self._not_exists(path, 'foo', '_store.db', data=True)
+        self._exists(path, 'foo', '_files', data=True)
+        prj = Project(path)
+        self.assertEqual(prj._status('new'), 'A')
+        pkg = prj.package('foo')
+        self.assertEqual(pkg.status('added'), 'A')
+
+    def test_store1_1(self):
+        """test store convert (the package wcs are locked)"""
+        path = self.fixture_file('project_1')
+        convert_project(path)
+        locked = []
+
+        def wc_lock(lock_path):
+            locked.append(os.path.basename(lock_path))
+            return orig_wc_lock(lock_path)
+
+        orig_wc_lock = convert.wc_lock
+        convert.wc_lock = wc_lock
+        try:
+            convert_store(path, 'sqlite')
+        finally:
+            convert.wc_lock = orig_wc_lock
+        self.assertEqual(locked[0], 'project_1')
+        self.assertEqual(sorted(locked[1:]), ['added', 'deleted', 'foo'])
+        self.assertEqual(wc_store_backend(os.path.join(path, 'foo')),
+                         'sqlite')
+
+    def test_store2(self):
+        """test store convert (package, unsupported backend)"""
+        path = self.fixture_file('convert_1')
+        self.assertRaises(ValueError, convert_store,
+                          self.fixture_file('nonexistent'), 'sqlite')
+        convert_package(path)
+        self.assertRaises(ValueError, convert_store, path, 'foo')
+        convert_store(path, 'sqlite')
+        # nothing to do
+        convert_store(path, 'sqlite')
+        self.assertEqual(wc_store_backend(path), 'sqlite')
+        self._not_exists(path, '_files', store=True)
+        pkg = Package(path)
+        self.assertEqual(pkg.files(), ['add'])
+        self.assertEqual(pkg.status('add'), 'A')
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,6 +10,7 @@ from osc2.wc.base import (TransactionListener, FileConflictError,
 from osc2.wc.package import (Package, FileSkipHandler, PackageUpdateState,
                              FileUpdateInfo, file_md5, is_binaryfile,
                              FileCommitPolicy, UnifiedDiff, Diff)
+import osc2.wc.package
 from osc2.wc.util import WCInconsistentError, WCFormatVersionError
 from osc2.source import Package as SourcePackage
 from osc2.util.io import mkdtemp
@@ -46,6 +47,20 @@ class TL(TransactionListener):
         self._processed[filename] = (new_state, old_state)
 
 
+class UploadPackage(Package):
+    """Records the uploads instead of issuing http requests."""
+
+    def __init__(self, *args, **kwargs):
+        self.fail = kwargs.pop('fail', [])
+        self.uploaded = []
+        super(UploadPackage, self).__init__(*args, **kwargs)
+
+    def _upload_file(self, cstate, filename):
+        if filename in self.fail:
+            raise ValueError(filename)
+        self.uploaded.append(filename)
+
+
 class UD(UnifiedDiff):
     def __init__(self):
         super(UD, self).__init__()
@@ -172,6 +187,42 @@ class TestPackage(OscTest):
         self.assertEqual(pkg.status('nonexistent'), '?')
         self.assertEqual(pkg.status('unknown'), '?')
 
+    def test9_1(self):
+        """test status (md5 is only computed if the sizes are equal)"""
+        path = self.fixture_file('status1')
+        pkg = Package(path)
+        hashed = []
+
+        def record_md5(filename):
+            hashed.append(os.path.basename(filename))
+            return orig_md5(filename)
+        orig_md5 = osc2.wc.package.file_md5
+        osc2.wc.package.file_md5 = record_md5
+        try:
+            self.assertEqual(pkg.status('file1'), ' ')
+            self.assertEqual(pkg.status('modified'), 'M')
+        finally:
+            osc2.wc.package.file_md5 = orig_md5
+        self.assertEqual(hashed, ['file1'])
+
+    def test9_1_1(self):
+        """test status (the packages share a hasher by default)"""
+        path = self.fixture_file('status1')
+        self.assertTrue(Package(path).hasher is Package(path).hasher)
+        self.assertEqual(Package(path).states('file1', 'modified'),
+                         {'file1': ' ', 'modified': 'M'})
+
+    def test9_2(self):
+        """test states (compute all md5sums at once)"""
+        path = self.fixture_file('status1')
+        pkg = Package(path)
+        states = pkg.states()
+        self.assertEqual(sorted(states.keys()), sorted(pkg.files()))
+        for filename, st in states.iteritems():
+            self.assertEqual(st, pkg.status(filename))
+        self.assertEqual(pkg.states('file1', 'modified', 'unknown'),
+                         {'file1': ' ', 'modified': 'M', 'unknown': '?'})
+
     @GET('http://localhost/source/prj/foo', file='foo_list1.xml')
     def test10(self):
         """test _calculate_updateinfo 1"""
@@ -1515,6 +1566,65 @@ class TestPackage(OscTest):
         self.assertFalse(pkg.is_expanded())
         self.assertTrue(pkg.is_unexpanded())
 
+    def _check_commit6(self, path, pkg):
+        self._check_md5(path, 'foo', '5fb9f8bed64fb741e760b0db312b7c5a',
+                        data=True)
+        self._exists(path, 'added')
+        self._check_md5(path, 'added', '8dee900466b680b0717524878e42bf04',
+                        data=True)
+        self._not_exists(path, 'bar')
+        self._not_exists(path, 'bar', data=True)
+        self.assertEqual(pkg.status('foo'), ' ')
+        self.assertEqual(pkg.status('bar'), '?')
+        self.assertEqual(pkg.status('foobar'), '?')
+        self.assertEqual(pkg.status('added'), ' ')
+
+    @GET('http://localhost/source/prj/commit_6?rev=latest',
+         file='commit_6_latest.xml')
+    @POST('http://localhost/source/prj/commit_6?cmd=commitfilelist&comment=x',
+          expfile='commit_6_lfiles1.xml', file='commit_6_mfiles1.xml')
+    @POST('http://localhost/source/prj/commit_6?cmd=commitfilelist&comment=x',
+          expfile='commit_6_lfiles1.xml', file='commit_6_files1.xml')
+    def test_commit14(self):
+        """test commit (concurrent uploads)"""
+        path = self.fixture_file('commit_6')
+        tl = TL()
+        pkg = UploadPackage(path, upload_workers=2,
+                            transaction_listener=[tl])
+        pkg.commit('foo', 'bar', 'foobar', 'added', comment='x')
+        self.assertEqual(sorted(pkg.uploaded), ['added', 'foo'])
+        self.assertEqual(sorted(tl._transfer),
+                         [('upload', 'added'), ('upload', 'foo')])
+        self.assertEqual(tl._processed['foo'], (' ', 'M'))
+        self.assertEqual(tl._processed['added'], (' ', 'A'))
+        self._check_commit6(path, pkg)
+
+    @GET('http://localhost/source/prj/commit_6?rev=latest',
+         file='commit_6_latest.xml')
+    @POST('http://localhost/source/prj/commit_6?cmd=commitfilelist&comment=x',
+          expfile='commit_6_lfiles1.xml', file='commit_6_mfiles1.xml')
+    @POST('http://localhost/source/prj/commit_6?cmd=commitfilelist&comment=x',
+          expfile='commit_6_lfiles1.xml', file='commit_6_mfiles1.xml')
+    @POST('http://localhost/source/prj/commit_6?cmd=commitfilelist&comment=x',
+          expfile='commit_6_lfiles1.xml', file='commit_6_files1.xml')
+    def test_commit15(self):
+        """test commit (resume an interrupted concurrent upload)"""
+        path = self.fixture_file('commit_6')
+        pkg = UploadPackage(path, upload_workers=2, fail=['added'])
+        self.assertRaises(ValueError, pkg.commit, 'foo', 'bar', 'foobar',
+                          'added', comment='x')
+        self.assertEqual(pkg.uploaded, ['foo'])
+        # foo was moved into the transaction dir
+        self._not_exists(path, 'foo')
+        self._exists(path, 'added')
+        # resume the commit (the server still reports both files as
+        # missing, so foo is uploaded from the transaction dir)
+        pkg = UploadPackage(path, upload_workers=2,
+                            finish_pending_transaction=False)
+        pkg.commit(comment='x')
+        self.assertEqual(sorted(pkg.uploaded), ['added', 'foo'])
+        self._check_commit6(path, pkg)
+
     def test_diff1(self):
         """test diff (added file)"""
         path = self.fixture_file('status1')
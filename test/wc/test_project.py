@@ -1,11 +1,15 @@
 import os
 import unittest
 import shutil
+import threading
+import time
 
 from osc2.wc.base import (FileConflictError, TransactionListener,
                           UpdateStateMixin)
-from osc2.wc.project import Project, ProjectUpdateState
+from osc2.wc.project import (Project, ProjectUpdateState,
+                             ProjectCommitError)
 from osc2.wc.util import WCInconsistentError
+from osc2.util.hashing import MD5Hasher
 from osc2.util.io import mkdtemp
 from test.osctest import OscTest
 from test.httptest import GET, PUT, POST, DELETE
@@ -44,6 +48,56 @@ class ProjectTL(TransactionListener):
         self._processed[key] = (new_state, old_state)
 
 
+class CommitProject(Project):
+    """Records the committed packages instead of committing them"""
+
+    def __init__(self, *args, **kwargs):
+        self.fail = kwargs.pop('fail', [])
+        self.committed = []
+        self._lock = threading.Lock()
+        super(CommitProject, self).__init__(*args, **kwargs)
+
+    def _commit_package(self, package, filenames, comment, added,
+                        listener=None):
+        for l in listener or []:
+            l.transfer('upload', package)
+        if package in self.fail:
+            raise ValueError("commit of %s failed" % package)
+        with self._lock:
+            self.committed.append((package, filenames, comment, added))
+
+
+class RecordingHasher(MD5Hasher):
+    """Records the filenames which are hashed"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingHasher, self).__init__(*args, **kwargs)
+        self.filenames = []
+
+    def md5sums(self, filenames):
+        filenames = list(filenames)
+        with self._lock:
+            self.filenames.extend(filenames)
+        return super(RecordingHasher, self).md5sums(filenames)
+
+
+class ConcurrencyTL(ProjectTL):
+    """Records if the listener was called concurrently"""
+
+    def __init__(self, *args, **kwargs):
+        super(ConcurrencyTL, self).__init__(*args, **kwargs)
+        self._active = 0
+        self.concurrent = False
+
+    def transfer(self, transfer_type, filename):
+        self._active += 1
+        if self._active > 1:
+            self.concurrent = True
+        time.sleep(0.05)
+        super(ConcurrencyTL, self).transfer(transfer_type, filename)
+        self._active -= 1
+
+
 class TestProject(OscTest):
 
     def __init__(self, *args, **kwargs):
@@ -132,6 +186,75 @@ class TestProject(OscTest):
         self.assertEqual(prj._status('del'), 'D')
         self.assertEqual(prj._status('asdf'), '?')
 
+    def test6_0(self):
+        """test lazy package construction"""
+        path = self.fixture_file('prj2')
+        prj = Project(path)
+        pkg = prj.package('foo_modified')
+        self.assertEqual(pkg.files(), ['file', 'add'])
+        self.assertTrue(pkg.is_updateable())
+        self.assertTrue(pkg.is_commitable())
+        self.assertEqual(pkg.has_conflicts(), [])
+        self.assertEqual(pkg.name, 'foo_modified')
+        self.assertIsNone(pkg._package)
+        # the parsed _files are shared
+        self.assertTrue(pkg._tracker() is
+                        prj.package('foo_modified')._tracker())
+        # but not with another thread
+        trackers = []
+        t = threading.Thread(target=lambda: trackers.append(
+            prj.package('foo_modified')._tracker()))
+        t.start()
+        t.join()
+        self.assertFalse(trackers[0] is pkg._tracker())
+        self.assertEqual(trackers[0].find('file').get('md5'),
+                         pkg._tracker().find('file').get('md5'))
+        # construct the Package object on demand
+        self.assertEqual(pkg.status('file'), 'M')
+        self.assertIsNotNone(pkg._package)
+        path = self.fixture_file('prj3')
+        prj = Project(path)
+        pkg = prj.package('conflict')
+        self.assertEqual(pkg.has_conflicts(), ['conflict'])
+        self.assertFalse(pkg.is_updateable())
+        self.assertIsNone(pkg._package)
+
+    def test6_1(self):
+        """test package_states"""
+        path = self.fixture_file('prj2')
+        prj = Project(path)
+        states = list(prj.package_states(workers=3))
+        self.assertEqual([s[0] for s in states], prj.packages())
+        states = dict([(s[0], s[1:]) for s in states])
+        self.assertEqual(states['foo'], (' ', {'file': ' '}))
+        self.assertEqual(states['bar'], ('A', {'add': 'A', 'add2': 'A'}))
+        self.assertEqual(states['abc'],
+                         ('D', {'modified': 'D', 'dummy': 'D', 'foo': 'D'}))
+        self.assertEqual(states['xxx'], ('!', {}))
+        self.assertEqual(states['del'], ('D', {}))
+        self.assertEqual(states['foo_modified'],
+                         (' ', {'file': 'M', 'add': 'A'}))
+
+    def test6_2(self):
+        """test package_states (specify packages; untracked files)"""
+        path = self.fixture_file('prj2')
+        prj = Project(path)
+        states = list(prj.package_states('abc', 'xxx', untracked=True))
+        self.assertEqual(states,
+                         [('abc', 'D', {'modified': 'D', 'dummy': 'D',
+                                        'foo': 'D', 'untracked': '?'}),
+                          ('xxx', '!', {})])
+
+    def test6_3(self):
+        """test package_states (all packages share a single hasher)"""
+        path = self.fixture_file('prj2')
+        prj = Project(path)
+        hasher = RecordingHasher()
+        states = dict([(p, states)
+                       for p, _, states in prj.package_states(hasher=hasher)])
+        self.assertEqual(states['foo_modified'], {'file': 'M', 'add': 'A'})
+        self.assertTrue(hasher.filenames)
+
     @GET('http://localhost/source/prj2', file='prj2_list1.xml')
     def test7(self):
         """test _calculate_updateinfo"""
@@ -168,6 +291,18 @@ class TestProject(OscTest):
         # no conflicts because bar shouldn't be added/updated
         self.assertEqual(uinfo.conflicted, [])
 
+    @GET('http://localhost/source/prj2?view=info', file='prj2_info1.xml')
+    def test8_2(self):
+        """test _calculate_updateinfo 4 (skip unchanged packages)"""
+        path = self.fixture_file('prj2')
+        prj = Project(path)
+        uinfo = prj._calculate_updateinfo(skip_unchanged=True)
+        # foo's srcmd5 did not change
+        self.assertEqual(uinfo.candidates, ['foo_modified'])
+        self.assertEqual(uinfo.added, ['osc'])
+        self.assertEqual(uinfo.deleted, ['abc', 'xxx', 'del'])
+        self.assertEqual(uinfo.conflicted, ['bar'])
+
     @GET('http://localhost/source/prj2', text='<directory count="0"/>')
     def test9(self):
         """test _calculate_updateinfo 3 (empty package list)"""
@@ -343,6 +478,33 @@ class TestProject(OscTest):
         self.assertEqual(prj._status('foo'), ' ')
         self._not_exists(path, '.osc', '_transaction')
 
+    @GET('http://localhost/source/prj2?view=info', file='prj2_info1.xml')
+    def test_update1_1(self):
+        """test update (skip unchanged package)"""
+        path = self.fixture_file('prj2')
+        tl = ProjectTL()
+        prj = Project(path, skip_unchanged=True, transaction_listener=[tl])
+        self.assertEqual(prj._status('foo'), ' ')
+        # only a single request is needed
+        prj.update('foo')
+        self.assertEqual(prj._status('foo'), ' ')
+        self.assertEqual(tl._begin, ['prj_update'])
+        self.assertEqual(tl._processed, {})
+        self._not_exists(path, '.osc', '_transaction')
+
+    @GET('http://localhost/source/prj2', file='prj2_list2.xml')
+    @GET('http://localhost/source/prj2/foo?foo=bar&rev=latest',
+         file='foo_list1.xml')
+    @GET(('http://localhost/source/prj2/foo/added'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='foo_added_file')
+    def test_update1_2(self):
+        """test update (skip_unchanged is ignored if kwargs are passed)"""
+        path = self.fixture_file('prj2')
+        prj = Project(path, skip_unchanged=True)
+        prj.update('foo', foo='bar')
+        self.assertEqual(prj._status('foo'), ' ')
+        self._not_exists(path, '.osc', '_transaction')
+
     @GET('http://localhost/source/prj2', file='prj2_list3.xml')
     def test_update2(self):
         """test update (delete package; local state 'D')"""
@@ -517,6 +679,42 @@ class TestProject(OscTest):
         self.assertEqual(tl._processed['update:modified'], (None, 'D'))
         self.assertEqual(tl._processed['prj_update:abc'], (None, 'D'))
 
+    @GET('http://localhost/source/prj2', file='prj2_list4.xml')
+    @GET('http://localhost/source/prj2', file='prj2_list4.xml')
+    @GET('http://localhost/source/prj2', file='prj2_list4.xml')
+    @GET('http://localhost/source/prj2/add?rev=latest', file='add_list1.xml')
+    @GET(('http://localhost/source/prj2/add/file'
+          '?rev=daaaaaaaaaaaaaaaaaaaaaaaaaaaaaaf'), file='foo_file')
+    def test_update9_1(self):
+        """test sparse update (package is materialized on first access)"""
+        path = self.fixture_file('prj2')
+        tl = ProjectTL()
+        prj = Project(path, transaction_listener=[tl])
+        self.assertEqual(prj._status('add'), '?')
+        prj.update('add', sparse=True)
+        self.assertEqual(prj._status('add'), 'N')
+        self.assertEqual(tl._processed, {'prj_update:add': ('N', None)})
+        self._not_exists(path, 'add')
+        self._not_exists(path, '.osc', 'data', 'add')
+        self._not_exists(path, '.osc', '_transaction')
+        self.assertEqual(Project.wc_check(path), ([], '', []))
+        # a package with state 'N' is neither updated nor committed
+        uinfo = prj._calculate_updateinfo()
+        self.assertNotIn('add', uinfo)
+        cinfo = prj._calculate_commitinfo('add')
+        self.assertEqual(cinfo.unchanged, ['add'])
+        prj.revert('add')
+        self.assertEqual(prj._status('add'), 'N')
+        states = dict([(p, (st, states))
+                       for p, st, states in prj.package_states()])
+        self.assertEqual(states['add'], ('N', {}))
+        # check out the package
+        pkg = prj.package('add')
+        self.assertEqual(prj._status('add'), ' ')
+        self.assertEqual(pkg.status('file'), ' ')
+        self._exists(path, 'add', 'file')
+        self._exists(path, '.osc', 'data', 'add')
+
     @GET('http://localhost/source/prj2', file='prj2_list2.xml')
     @GET('http://localhost/source/prj2/foo?foo=bar&rev=latest',
          file='foo_list1.xml')
@@ -830,6 +1028,131 @@ class TestProject(OscTest):
         self.assertEqual(pkg.status('conflict'), 'C')
         self._not_exists(path, '.osc', '_transaction')
 
+    def test_commit13(self):
+        """test concurrent commit"""
+        path = self.fixture_file('prj2')
+        tl = ProjectTL()
+        prj = CommitProject(path, commit_workers=2, transaction_listener=[tl])
+        self.assertEqual(prj._status('bar'), 'A')
+        prj.commit('bar', 'foo_modified', comment='foo')
+        self.assertEqual(sorted(prj.committed),
+                         [('bar', [], 'foo', True),
+                          ('foo_modified', [], 'foo', False)])
+        self.assertEqual(prj._status('bar'), ' ')
+        self.assertEqual(prj._status('foo_modified'), ' ')
+        self._not_exists(path, '.osc', '_transaction')
+        self.assertEqual(tl._processed['prj_commit:bar'], (' ', 'A'))
+        self.assertEqual(tl._processed['prj_commit:foo_modified'],
+                         (' ', ' '))
+        self.assertEqual(tl._finished, ['prj_commit'])
+
+    @DELETE('http://localhost/source/prj2/abc', text='<ok/>')
+    def test_commit14(self):
+        """test concurrent commit (a package fails; resume)"""
+        path = self.fixture_file('prj2')
+        prj = CommitProject(path, commit_workers=2, fail=['foo_modified'])
+        try:
+            prj.commit('bar', 'foo_modified', 'abc')
+            self.fail('ProjectCommitError expected')
+        except ProjectCommitError as e:
+            self.assertEqual(e.errors.keys(), ['foo_modified'])
+            self.assertTrue(isinstance(e.errors['foo_modified'],
+                                       ValueError))
+        # the other packages were committed
+        self.assertEqual(prj.committed, [('bar', [], '', True)])
+        self.assertEqual(prj._status('bar'), ' ')
+        self.assertEqual(prj._status('abc'), '?')
+        self.assertEqual(prj._status('foo_modified'), ' ')
+        self._exists(path, '.osc', '_transaction')
+        # resume the commit
+        prj = CommitProject(path, commit_workers=2,
+                            finish_pending_transaction=False)
+        prj.commit()
+        self.assertEqual(prj.committed, [('foo_modified', [], '', False)])
+        self._not_exists(path, '.osc', '_transaction')
+
+    def test_commit15(self):
+        """test concurrent commit (listeners are not called concurrently)"""
+        path = self.fixture_file('prj2')
+        tl = ConcurrencyTL()
+        prj = CommitProject(path, commit_workers=2, transaction_listener=[tl])
+        prj.commit('bar', 'foo_modified')
+        self.assertEqual(sorted(tl._transfer),
+                         [('upload', 'bar'), ('upload', 'foo_modified')])
+        self.assertFalse(tl.concurrent)
+
+    @DELETE('http://localhost/source/prj2/abc', text='<ok/>')
+    def test_commit16(self):
+        """test concurrent commit (a package fails; default ctor)"""
+        path = self.fixture_file('prj2')
+        prj = CommitProject(path, commit_workers=2, fail=['foo_modified'])
+        self.assertRaises(ProjectCommitError, prj.commit, 'bar',
+                          'foo_modified', 'abc')
+        self._exists(path, '.osc', '_transaction')
+        # the pending transaction is rolled back but the states of the
+        # committed packages are kept
+        prj = CommitProject(path, commit_workers=2)
+        self._not_exists(path, '.osc', '_transaction')
+        self.assertEqual(prj._status('bar'), ' ')
+        self.assertEqual(prj._status('abc'), '?')
+        prj.commit('foo_modified')
+        self.assertEqual(prj.committed, [('foo_modified', [], '', False)])
+        self._not_exists(path, '.osc', '_transaction')
+
+    @GET('http://localhost/source/prj2/bar/_meta', text='<OK/>', code=404,
+         unordered=True)
+    @PUT('http://localhost/source/prj2/bar/_meta', text='<OK/>',
+         expfile='commit_2_meta.xml', unordered=True)
+    @GET('http://localhost/source/prj2/bar?rev=latest',
+         file='commit_2_latest.xml', unordered=True)
+    @POST('http://localhost/source/prj2/bar?cmd=commitfilelist',
+          expfile='commit_2_lfiles.xml', file='commit_2_mfiles.xml',
+          unordered=True)
+    @PUT('http://localhost/source/prj2/bar/add?rev=repository',
+         expfile='commit_2_add', text=UPLOAD_REV, unordered=True)
+    @PUT('http://localhost/source/prj2/bar/add2?rev=repository',
+         expfile='commit_2_add2', text=UPLOAD_REV, unordered=True)
+    @POST('http://localhost/source/prj2/bar?cmd=commitfilelist',
+          expfile='commit_2_lfiles.xml', file='commit_2_files.xml',
+          unordered=True)
+    @GET('http://localhost/source/prj2/foo_modified?rev=latest',
+         file='commit_1_latest.xml', unordered=True)
+    @POST('http://localhost/source/prj2/foo_modified?cmd=commitfilelist',
+          expfile='commit_1_lfiles.xml', file='commit_1_mfiles.xml',
+          unordered=True)
+    @PUT('http://localhost/source/prj2/foo_modified/add?rev=repository',
+         expfile='commit_1_add', text=UPLOAD_REV, unordered=True)
+    @PUT('http://localhost/source/prj2/foo_modified/file?rev=repository',
+         expfile='commit_1_file', text=UPLOAD_REV, unordered=True)
+    @POST('http://localhost/source/prj2/foo_modified?cmd=commitfilelist',
+          expfile='commit_1_lfiles.xml', file='commit_1_files.xml',
+          unordered=True)
+    def test_commit17(self):
+        """test concurrent commit (real packages)"""
+        path = self.fixture_file('prj2')
+        tl = TL(abort=False)
+        prj = Project(path, commit_workers=2, transaction_listener=[tl])
+        self.assertEqual(prj._status('bar'), 'A')
+        self.assertEqual(prj._status('foo_modified'), ' ')
+        prj.commit('bar', 'foo_modified')
+        self.assertEqual(prj._status('bar'), ' ')
+        self.assertEqual(prj._status('foo_modified'), ' ')
+        pkg = prj.package('bar')
+        self.assertEqual(pkg.status('add'), ' ')
+        self.assertEqual(pkg.status('add2'), ' ')
+        pkg = prj.package('foo_modified')
+        self.assertEqual(pkg.status('file'), ' ')
+        self.assertEqual(pkg.status('add'), ' ')
+        self._exists(path, '.osc', 'data', 'bar')
+        self._not_exists(path, '.osc', '_transaction')
+        # the listener is notified by both packages (hence, the
+        # order of the package's commit transactions is arbitrary)
+        self.assertEqual(tl._processed['bar'], (' ', 'A'))
+        self.assertEqual(tl._processed['foo_modified'], (' ', ' '))
+        self.assertEqual(sorted(tl._finished),
+                         ['commit', 'commit', 'prj_commit'])
+        self.assertEqual(tl._finished[-1], 'prj_commit')
+
     def test_repair1(self):
         """test repair (missing _project and storefile)"""
         path = self.fixture_file('inv1')
@@ -1,17 +1,37 @@
 import os
+import threading
 import unittest
 
 from test.osctest import OscTest
 from osc2.util.io import mkdtemp
 from osc2.wc.util import (WCFormatVersionError, wc_is_project, wc_is_package,
                           wc_read_project, wc_read_package, wc_read_apiurl,
-                          WCLock, wc_parent, wc_init)
+                          WCLock, wc_parent, wc_init, wc_write_project,
+                          wc_store_backend, missing_storepaths,
+                          XMLTransactionState, wc_store_transaction,
+                          _storefile_stamp, wc_write_packages,
+                          XMLPackageTracker)
+from osc2.wc import store
+from osc2.wc.store import set_durability, get_durability
 
 
 def suite():
     return unittest.makeSuite(TestWCUtil)
 
 
+class DummyTransactionState(XMLTransactionState):
+
+    def __init__(self, path, xml_data=None):
+        info = None
+        if xml_data is None:
+            info = object()
+        super(DummyTransactionState, self).__init__(path, 'dummy', 'prepare',
+                                                    info, xml_data)
+
+    def _listnames(self):
+        return ()
+
+
 class TestWCUtil(OscTest):
     def __init__(self, *args, **kwargs):
         kwargs['fixtures_dir'] = os.path.join('wc', 'test_util_fixtures')
@@ -309,6 +329,157 @@ class TestWCUtil(OscTest):
         self.assertRaises(WCFormatVersionError, wc_init, path,
                           ext_storedir=storedir)
         self.assertFalse(os.path.exists(path))
+    def test_wc_init9(self):
+        """init wc (sqlite store backend)"""
+        path = self.fixture_file('init')
+        self.assertRaises(ValueError, wc_init, path, backend='foo')
+        wc_init(path, backend='sqlite')
+        storedir = self.fixture_file('init', '.osc')
+        self.assertEqual(sorted(os.listdir(storedir)),
+                         ['_store.db', '_version', 'data'])
+        self.assertEqual(wc_store_backend(path), 'sqlite')
+        self.assertEqual(missing_storepaths(path, '_project', '_version'),
+                         ['_project'])
+        wc_write_project(path, 'foo')
+        self.assertEqual(wc_read_project(path), 'foo')
+        self.assertEqual(missing_storepaths(path, '_project'), [])
+        self._not_exists(path, '_project', store=True)
+        # the transaction state is kept in the database, too
+        tstate = DummyTransactionState(path)
+        self.assertIsNotNone(DummyTransactionState.read_state(path))
+        self._exists(path, '_transaction', 'data', store=True)
+        self._not_exists(path, '_transaction', 'state', store=True)
+        tstate.cleanup()
+        self.assertIsNone(DummyTransactionState.read_state(path))
+        self._not_exists(path, '_transaction', store=True)
+
+    def test_tracker1(self):
+        """the xpath, which finds an entry, is shared by all trackers"""
+        path = self.fixture_file('init')
+        wc_init(path)
+        wc_write_packages(path, '<packages><package name="foo" '
+                          'state=" "/></packages>')
+        tracker1 = XMLPackageTracker(path)
+        tracker2 = XMLPackageTracker(path)
+        self.assertTrue(tracker1._find_xpath is tracker2._find_xpath)
+        self.assertEqual(tracker2.find('foo').get('state'), ' ')
+        self.assertIsNone(tracker2.find('bar'))
+
+    def test_wc_init10(self):
+        """init wc (sqlite store backend; storefile stamps)"""
+        path = self.fixture_file('init')
+        wc_init(path, backend='sqlite')
+        storedir = self.fixture_file('init', '.osc')
+        # the backend is cached
+        self.assertTrue(store.get_store(storedir) is store.get_store(storedir))
+        self.assertRaises(OSError, _storefile_stamp, path, '_project')
+        wc_write_project(path, 'foo')
+        stamp = _storefile_stamp(path, '_project')
+        self.assertEqual(_storefile_stamp(path, '_project'), stamp)
+        self.assertEqual(wc_read_project(path), 'foo')
+        self.assertEqual(_storefile_stamp(path, '_project'), stamp)
+        wc_write_project(path, 'foo')
+        self.assertNotEqual(_storefile_stamp(path, '_project'), stamp)
+        # plain storefiles are still stat'ed
+        self.assertIsNotNone(_storefile_stamp(path, '_version'))
+
+    def _store_transaction(self, backend):
+        path = self.fixture_file('init')
+        wc_init(path, backend=backend)
+        wc_write_project(path, 'foo')
+        storefile = self.fixture_file('init', '.osc', '_project')
+        with wc_store_transaction(path):
+            wc_write_project(path, 'bar')
+            # nested transactions are merged
+            with wc_store_transaction(path):
+                wc_write_project(path, 'baz')
+            self.assertEqual(wc_read_project(path), 'baz')
+            if backend == 'file':
+                with open(storefile, 'r') as f:
+                    self.assertEqual(f.read(), 'foo\n')
+        self.assertEqual(wc_read_project(path), 'baz')
+        if backend == 'file':
+            with open(storefile, 'r') as f:
+                self.assertEqual(f.read(), 'baz\n')
+        # the writes are also committed if an exception is raised
+        try:
+            with wc_store_transaction(path):
+                wc_write_project(path, 'foo')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(wc_read_project(path), 'foo')
+
+    def test_store_transaction1(self):
+        """test store transaction (file backend)"""
+        self._store_transaction('file')
+
+    def test_store_transaction2(self):
+        """test store transaction (sqlite backend)"""
+        self._store_transaction('sqlite')
+
+    def test_store_transaction3(self):
+        """test store transaction (transaction state, durability)"""
+        durability = get_durability()
+        self.assertRaises(ValueError, set_durability, 'foo')
+        self.assertRaises(ValueError, wc_store_transaction,
+                          self.fixture_file('nonexistent'))
+        set_durability('full')
+        try:
+            path = self.fixture_file('init')
+            wc_init(path)
+            with wc_store_transaction(path):
+                tstate = DummyTransactionState(path)
+                self.assertIsNotNone(DummyTransactionState.read_state(path))
+                self._not_exists(path, '_transaction', 'state', store=True)
+            self._exists(path, '_transaction', 'state', store=True)
+            with wc_store_transaction(path):
+                tstate.cleanup()
+                self.assertIsNone(DummyTransactionState.read_state(path))
+            self._not_exists(path, '_transaction', store=True)
+        finally:
+            set_durability(durability)
+
+    def test_store_transaction4(self):
+        """test store transaction (only the batch commit is synced)"""
+        path = self.fixture_file('init')
+        wc_init(path)
+        synced = []
+        fsync = store.os.fsync
+        store.os.fsync = synced.append
+        try:
+            wc_write_project(path, 'foo')
+            self.assertEqual(synced, [])
+            with wc_store_transaction(path):
+                wc_write_project(path, 'bar')
+            self.assertEqual(len(synced), 1)
+        finally:
+            store.os.fsync = fsync
+
+    def test_store_transaction5(self):
+        """test store transaction (transactions are per thread)"""
+        path = self.fixture_file('init')
+        wc_init(path)
+        wc_write_project(path, 'foo')
+        storefile = self.fixture_file('init', '.osc', '_project')
+        read = []
+
+        def write():
+            # not batched by the main thread's transaction
+            read.append(wc_read_project(path))
+            with wc_store_transaction(path):
+                wc_write_project(path, 'bar')
+            with open(storefile, 'r') as f:
+                read.append(f.read())
+
+        with wc_store_transaction(path):
+            wc_write_project(path, 'baz')
+            t = threading.Thread(target=write)
+            t.start()
+            t.join()
+            self.assertEqual(read, ['foo', 'bar\n'])
+            self.assertEqual(wc_read_project(path), 'baz')
+        self.assertEqual(wc_read_project(path), 'baz')
 
 if __name__ == '__main__':
     unittest.main()